@@ -0,0 +1,86 @@
+# secdemo/ai_batch.py
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from secdemo.ai_ollama import OllamaChatClient
+from secdemo.llm_cache import cached_chat
+
+
+class BatchLlmJob:
+    """
+    複数の LLM 呼び出しをバックグラウンドのワーカープールで並列実行する。
+    - parallel はサーバ側の同時処理スロット数に合わせる（llama-server --parallel / OLLAMA_NUM_PARALLEL）
+    - 結果は終わった順に results へ入る。UI は snapshot() で途中経過をポーリングする
+    - ワーカーは streamlit に触らない（session_state への反映は UI 側で行う）
+    """
+
+    def __init__(
+        self,
+        items: List[Any],
+        make_messages: Callable[[Any], List[Dict[str, str]]],
+        ollama_base: str,
+        model: str,
+        temperature: float = 0.2,
+        system: Optional[str] = None,
+        parallel: int = 2,
+        timeout: int = 180,
+        use_cache: bool = True,
+    ):
+        self.items = list(items)
+        self.total = len(self.items)
+        self.model = model
+        self.results: Dict[int, str] = {}
+        self.errors: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+        self._make_messages = make_messages
+        self._client = OllamaChatClient(ollama_base, timeout=timeout)
+        self._temperature = float(temperature)
+        self._system = system
+        self._use_cache = use_cache
+
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(parallel)), thread_name_prefix="llm-batch")
+        self._futures = [self._pool.submit(self._run_one, i) for i in range(self.total)]
+        self._pool.shutdown(wait=False)
+
+    def _run_one(self, idx: int) -> None:
+        if self._cancel.is_set():
+            return
+        try:
+            messages = self._make_messages(self.items[idx])
+            kwargs = dict(model=self.model, messages=messages, temperature=self._temperature, system=self._system)
+            text = cached_chat(self._client, **kwargs) if self._use_cache else self._client.chat(**kwargs)
+            with self._lock:
+                self.results[idx] = text
+        except Exception as e:
+            with self._lock:
+                self.errors[idx] = str(e)
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        for f in self._futures:
+            f.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return all(f.done() for f in self._futures)
+
+    def snapshot(self) -> Tuple[int, Dict[int, str], Dict[int, str]]:
+        """(完了件数, results のコピー, errors のコピー)"""
+        with self._lock:
+            results = dict(self.results)
+            errors = dict(self.errors)
+        return len(results) + len(errors), results, errors
+
+    def wait(self) -> None:
+        for f in self._futures:
+            if not f.cancelled():
+                f.result()
@@ -0,0 +1,158 @@
+# secdemo/ai_mapreduce.py
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from secdemo.ai_ollama import OllamaChatClient
+from secdemo.llm_cache import cached_chat
+from secdemo.prompt_budget import Tokenizer, count_tokens, heuristic_tokens
+
+# (title, body)
+Chunk = Tuple[str, str]
+
+
+# -------------------------
+# Chunking
+# -------------------------
+def _risk_bucket(r: str) -> str:
+    s = (r or "").lower()
+    if "high" in s:
+        return "High"
+    if "medium" in s:
+        return "Medium"
+    if "low" in s:
+        return "Low"
+    return "Info"
+
+
+def format_group_line(g: Dict[str, Any]) -> str:
+    param = f" param={g['param']}" if g.get("param") else ""
+    cwe = f" CWE-{g['cweid']}" if str(g.get("cweid") or "") not in ("", "-1", "0") else ""
+    urls = ", ".join((g.get("urls") or [g.get("url", "")])[:3])
+    return f"- [{g.get('risk','')}] {g.get('name','')}{param}{cwe} ×{g.get('count', 1)}  ({urls})"
+
+
+def chunk_alert_groups(
+    groups: List[Dict[str, Any]],
+    by: str = "risk",
+    max_tokens: int = 1500,
+) -> List[Chunk]:
+    """
+    アラートグループを risk / CWE ごとに束ね、各チャンクが max_tokens に収まるよう分割する。
+    1行が大きすぎる場合でもそのまま1チャンクとして残す（切り捨てない）。
+    """
+    buckets: Dict[str, List[str]] = {}
+    for g in groups:
+        if by == "cwe":
+            key = f"CWE-{g.get('cweid')}" if str(g.get("cweid") or "") not in ("", "-1", "0") else "CWE不明"
+        else:
+            key = _risk_bucket(g.get("risk", ""))
+        buckets.setdefault(key, []).append(format_group_line(g))
+
+    chunks: List[Chunk] = []
+    for key, lines in buckets.items():
+        part: List[str] = []
+        used = 0
+        for line in lines:
+            # 行ごとの計測は回数が多いので見積もりで数える（外部 tokenizer を1行ずつ呼ばない）
+            t = heuristic_tokens(line) + 1
+            if part and used + t > max_tokens:
+                chunks.append((key, "\n".join(part)))
+                part, used = [], 0
+            part.append(line)
+            used += t
+        if part:
+            chunks.append((key, "\n".join(part)))
+
+    # 同じ key が複数チャンクに割れた場合は (1/3) のように番号を振る
+    totals: Dict[str, int] = {}
+    for key, _ in chunks:
+        totals[key] = totals.get(key, 0) + 1
+    seen: Dict[str, int] = {}
+    numbered: List[Chunk] = []
+    for key, body in chunks:
+        seen[key] = seen.get(key, 0) + 1
+        title = key if totals[key] == 1 else f"{key} ({seen[key]}/{totals[key]})"
+        numbered.append((title, body))
+    return numbered
+
+
+# -------------------------
+# Map / Reduce
+# -------------------------
+def map_chunks(
+    client: OllamaChatClient,
+    model: str,
+    chunks: List[Chunk],
+    make_prompt: Callable[[str, str], str],
+    temperature: float = 0.2,
+    system: Optional[str] = None,
+    parallel: int = 2,
+    on_done: Optional[Callable[[int, int], None]] = None,
+) -> List[Chunk]:
+    """
+    各チャンクを並列に要約し、入力と同じ順序で (title, summary) を返す。
+    on_done(done, total) は呼び出し元スレッドで呼ばれる（進捗表示用）。
+    """
+    results: List[Optional[str]] = [None] * len(chunks)
+
+    def _one(i: int) -> str:
+        title, body = chunks[i]
+        return cached_chat(
+            client,
+            model=model,
+            messages=[{"role": "user", "content": make_prompt(title, body)}],
+            temperature=temperature,
+            system=system,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, int(parallel)), thread_name_prefix="llm-map") as pool:
+        futures = {pool.submit(_one, i): i for i in range(len(chunks))}
+        done = 0
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                # 1チャンクの失敗でレポート全体を落とさない（素材は残す）
+                results[i] = f"（要約失敗: {e}）\n{chunks[i][1]}"
+            done += 1
+            if on_done:
+                on_done(done, len(chunks))
+
+    return [(chunks[i][0], results[i] or "") for i in range(len(chunks))]
+
+
+def fit_summaries(
+    client: OllamaChatClient,
+    model: str,
+    summaries: List[Chunk],
+    max_tokens: int,
+    make_collapse_prompt: Callable[[str], str],
+    temperature: float = 0.2,
+    system: Optional[str] = None,
+    parallel: int = 2,
+    tokenizer: Optional[Tokenizer] = None,
+) -> str:
+    """
+    部分要約を連結し、max_tokens を超える間は隣接する要約を束ねて再要約（collapse）する。
+    """
+    def _join(items: List[Chunk]) -> str:
+        return "\n\n".join(f"### {t}\n{s.strip()}" for t, s in items)
+
+    items = list(summaries)
+    while count_tokens(_join(items), tokenizer) > max_tokens and len(items) > 1:
+        # 隣接ペアごとに束ねて1段分まとめる
+        pairs = [items[i : i + 2] for i in range(0, len(items), 2)]
+        merged = [(" + ".join(t for t, _ in p), _join(p)) for p in pairs]
+        items = map_chunks(
+            client,
+            model,
+            merged,
+            lambda title, body: make_collapse_prompt(body),
+            temperature=temperature,
+            system=system,
+            parallel=parallel,
+        )
+    return _join(items)
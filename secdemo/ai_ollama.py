@@ -1,7 +1,10 @@
 # secdemo/ai_ollama.py
 from __future__ import annotations
 
-from typing import List, Dict, Optional
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 import httpx
 
 DEFAULT_SYSTEM = (
@@ -10,18 +13,71 @@ DEFAULT_SYSTEM = (
     "Focus on explanation, risk assessment, and defensive guidance."
 )
 
+# 試す順番（Ollama → OpenAI互換 llama-server など）
+CHAT_ENDPOINTS = ("/api/generate", "/api/chat", "/v1/completions")
+
+# -------------------------
+# Process-level caches
+# -------------------------
+# base_url ごとに「実際に使えたエンドポイント」と pooled httpx.Client を覚える。
+# エンドポイントが違う（404 など）と分かったときだけ捨てて、次の呼び出しで再プローブする。
+# 接続エラー / タイムアウトでは他のエンドポイントを試さずにすぐ失敗する（キャッシュも残す）。
+_ENDPOINT_CACHE: Dict[str, str] = {}
+_HTTP_CLIENTS: Dict[str, httpx.Client] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _shared_http_client(base_url: str) -> httpx.Client:
+    with _CACHE_LOCK:
+        client = _HTTP_CLIENTS.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.Client(limits=httpx.Limits(max_connections=16, max_keepalive_connections=8))
+            _HTTP_CLIENTS[base_url] = client
+        return client
+
+
+def cached_endpoint(base_url: str) -> Optional[str]:
+    with _CACHE_LOCK:
+        return _ENDPOINT_CACHE.get(base_url.rstrip("/"))
+
+
+def _transport_error(e: Exception, base_url: str, timeout: float) -> Optional[RuntimeError]:
+    """
+    通信レベルの失敗ならエンドポイント違いではないので、他を試さずに返すエラーを作る（それ以外は None）。
+    - 接続できない（ConnectError / ConnectTimeout）→ unreachable
+    - 接続はできたが応答が遅い（ReadTimeout / WriteTimeout / PoolTimeout）→ timed out（長い生成など）
+    """
+    name = type(e).__name__
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return RuntimeError(f"LLM server unreachable: {base_url} ({name})")
+    if isinstance(e, httpx.TimeoutException):
+        return RuntimeError(f"LLM response timed out after {timeout:g}s: {base_url} ({name})")
+    if isinstance(e, httpx.TransportError):
+        return RuntimeError(f"LLM connection error: {base_url} ({name})")
+    return None
+
+
+def _remember_endpoint(base_url: str, path: Optional[str]) -> None:
+    with _CACHE_LOCK:
+        if path:
+            _ENDPOINT_CACHE[base_url] = path
+        else:
+            _ENDPOINT_CACHE.pop(base_url, None)
+
+
 
 class OllamaChatClient:
     def __init__(self, base_url: str, timeout: int = 180):
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
+        self._http = _shared_http_client(self.base_url)
 
     # -------------------------
     # Utils
     # -------------------------
     def _post(self, path: str, payload: dict) -> dict:
         url = f"{self.base_url}{path}"
-        r = httpx.post(url, json=payload, timeout=self.timeout)
+        r = self._http.post(url, json=payload, timeout=self.timeout)
         r.raise_for_status()
         return r.json()
 
@@ -29,7 +85,7 @@ class OllamaChatClient:
         for path in ("/api/tags", "/v1/models"):
             try:
                 url = f"{self.base_url}{path}"
-                r = httpx.get(url, timeout=self.timeout)
+                r = self._http.get(url, timeout=self.timeout)
                 r.raise_for_status()
                 data = r.json()
                 if "models" in data:
@@ -40,6 +96,56 @@ class OllamaChatClient:
                 continue
         return []
 
+    def parallel_slots(self) -> Optional[int]:
+        """llama-server の /props から同時処理スロット数を取得（Ollama など取れない場合は None）"""
+        try:
+            r = self._http.get(f"{self.base_url}/props", timeout=min(self.timeout, 5))
+            r.raise_for_status()
+            n = int(r.json().get("total_slots") or 0)
+            return n if n > 0 else None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _build_prompt(messages: List[Dict[str, str]], system: Optional[str]) -> str:
+        # messages → prompt
+        parts = []
+        if system:
+            parts.append(system)
+        for m in messages:
+            role = m.get("role", "user")
+            content = m.get("content", "")
+            parts.append(f"{role.upper()}: {content}")
+        return "\n\n".join(parts)
+
+    def _endpoint_order(self) -> List[str]:
+        # 前回成功したエンドポイントを先頭に。無ければ既定順でプローブ
+        known = cached_endpoint(self.base_url)
+        if known in CHAT_ENDPOINTS:
+            return [known] + [p for p in CHAT_ENDPOINTS if p != known]
+        return list(CHAT_ENDPOINTS)
+
+    @staticmethod
+    def _payload(
+        path: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        prompt: str,
+        temperature: float,
+        stream: bool,
+    ) -> Dict[str, Any]:
+        if path == "/api/chat":
+            return {"model": model, "messages": messages, "temperature": temperature, "stream": stream}
+        return {"model": model, "prompt": prompt, "temperature": temperature, "stream": stream}
+
+    @staticmethod
+    def _text_from(path: str, data: Dict[str, Any]) -> str:
+        if path == "/api/generate":
+            return data.get("response", "")
+        if path == "/api/chat":
+            return data.get("message", {}).get("content", "")
+        return data["choices"][0]["text"]
+
     # -------------------------
     # Chat (auto fallback)
     # -------------------------
@@ -50,58 +156,200 @@ class OllamaChatClient:
         temperature: float = 0.2,
         system: Optional[str] = None,
     ) -> str:
-        # messages → prompt
-        parts = []
-        if system:
-            parts.append(system)
-        for m in messages:
-            role = m.get("role", "user")
-            content = m.get("content", "")
-            parts.append(f"{role.upper()}: {content}")
-        prompt = "\n\n".join(parts)
+        prompt = self._build_prompt(messages, system)
 
-        # ① /api/generate
-        try:
-            data = self._post(
-                "/api/generate",
-                {
-                    "model": model,
-                    "prompt": prompt,
-                    "temperature": temperature,
-                    "stream": False,
-                },
-            )
-            return data.get("response", "")
-        except Exception:
-            pass
+        last_err: Optional[Exception] = None
+        for path in self._endpoint_order():
+            try:
+                data = self._post(path, self._payload(path, model, messages, prompt, temperature, stream=False))
+                text = self._text_from(path, data)
+            except Exception as e:
+                err = _transport_error(e, self.base_url, self.timeout)
+                if err is not None:
+                    raise err from e
+                if cached_endpoint(self.base_url) == path:
+                    _remember_endpoint(self.base_url, None)
+                last_err = e
+                continue
+            _remember_endpoint(self.base_url, path)
+            return text
 
-        # ② /api/chat
-        try:
-            data = self._post(
-                "/api/chat",
-                {
-                    "model": model,
-                    "messages": messages,
-                    "temperature": temperature,
-                },
-            )
-            return data.get("message", {}).get("content", "")
-        except Exception:
-            pass
+        raise RuntimeError(
+            "Ollama API endpoint not found. "
+            "Ensure 'ollama serve' is running and API is enabled."
+        ) from last_err
 
-        # ③ OpenAI互換 /v1/completions
-        try:
-            data = self._post(
-                "/v1/completions",
-                {
-                    "model": model,
-                    "prompt": prompt,
-                    "temperature": temperature,
-                },
-            )
-            return data["choices"][0]["text"]
-        except Exception as e:
-            raise RuntimeError(
-                "Ollama API endpoint not found. "
-                "Ensure 'ollama serve' is running and API is enabled."
-            ) from e
+    # -------------------------
+    # Chat (streaming)
+    # -------------------------
+    @staticmethod
+    def _iter_ndjson(lines: Iterable[str], pick: Callable[[Dict[str, Any]], str]) -> Iterator[str]:
+        # Ollama: 1行1JSON、最後に done=true
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(str(data["error"]))
+            token = pick(data)
+            if token:
+                yield token
+            if data.get("done"):
+                return
+
+    @staticmethod
+    def _iter_sse(lines: Iterable[str]) -> Iterator[str]:
+        # OpenAI互換: "data: {...}" 行、最後に "data: [DONE]"
+        for line in lines:
+            line = line.strip()
+            if not line.startswith("data:"):
+                continue
+            body = line[len("data:") :].strip()
+            if body == "[DONE]":
+                return
+            data = json.loads(body)
+            choices = data.get("choices") or [{}]
+            token = choices[0].get("text") or (choices[0].get("delta") or {}).get("content") or ""
+            if token:
+                yield token
+
+    def _stream_parser(self, path: str) -> Callable[[Iterable[str]], Iterator[str]]:
+        if path == "/api/generate":
+            return lambda lines: self._iter_ndjson(lines, lambda d: d.get("response", ""))
+        if path == "/api/chat":
+            return lambda lines: self._iter_ndjson(lines, lambda d: (d.get("message") or {}).get("content", ""))
+        return self._iter_sse
+
+    def chat_stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        system: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        chat() のストリーミング版。生成されたトークン（断片）を届いた順に yield する。
+        エンドポイントの選び方（キャッシュ → フォールバック）は chat() と同じ。
+        """
+        prompt = self._build_prompt(messages, system)
+
+        last_err: Optional[Exception] = None
+        for path in self._endpoint_order():
+            payload = self._payload(path, model, messages, prompt, temperature, stream=True)
+            parse = self._stream_parser(path)
+            started = False
+            try:
+                with self._http.stream("POST", f"{self.base_url}{path}", json=payload, timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    for token in parse(r.iter_lines()):
+                        if not started:
+                            started = True
+                            _remember_endpoint(self.base_url, path)
+                        yield token
+                _remember_endpoint(self.base_url, path)
+                return
+            except Exception as e:
+                if started:
+                    # 途中まで出力済みなら別エンドポイントでやり直さない
+                    raise
+                err = _transport_error(e, self.base_url, self.timeout)
+                if err is not None:
+                    raise err from e
+                if cached_endpoint(self.base_url) == path:
+                    _remember_endpoint(self.base_url, None)
+                last_err = e
+
+        raise RuntimeError(
+            "Ollama API endpoint not found. "
+            "Ensure 'ollama serve' is running and API is enabled."
+        ) from last_err
+
+
+# -------------------------
+# Model catalog（TTL キャッシュ + バックグラウンド更新）
+# -------------------------
+MODEL_LIST_TTL_SEC = 60.0
+MODEL_LIST_NEGATIVE_TTL_SEC = 15.0
+
+# base_url -> {"models": [...], "fetched_at": monotonic, "ok": bool}
+_MODEL_CATALOG: Dict[str, Dict[str, Any]] = {}
+_MODEL_REFRESHING: Dict[str, threading.Thread] = {}
+
+
+def _refresh_models(base_url: str, timeout: float) -> None:
+    try:
+        models = OllamaChatClient(base_url, timeout=timeout).list_models()
+    except Exception:
+        models = []
+    with _CACHE_LOCK:
+        _MODEL_CATALOG[base_url] = {"models": models, "fetched_at": time.monotonic(), "ok": bool(models)}
+        _MODEL_REFRESHING.pop(base_url, None)
+
+
+def cached_list_models(
+    base_url: str,
+    ttl: float = MODEL_LIST_TTL_SEC,
+    negative_ttl: float = MODEL_LIST_NEGATIVE_TTL_SEC,
+    wait: float = 1.0,
+    timeout: float = 10.0,
+) -> List[str]:
+    """
+    モデル一覧をプロセス共有でキャッシュして返す（rerun ごとに取りに行かない）。
+    - 期限切れなら裏で取り直し、その間は手元の一覧を返す
+    - 取得失敗（空）も negative_ttl の間は覚えておき、再試行で待たされないようにする
+    - 初回だけ最大 wait 秒まで結果を待つ
+    """
+    base = (base_url or "").rstrip("/")
+    if not base:
+        return []
+
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        entry = _MODEL_CATALOG.get(base)
+        fresh = entry is not None and now - entry["fetched_at"] < (ttl if entry["ok"] else negative_ttl)
+        worker = _MODEL_REFRESHING.get(base)
+        if not fresh and worker is None:
+            worker = threading.Thread(target=_refresh_models, args=(base, timeout), daemon=True)
+            _MODEL_REFRESHING[base] = worker
+            worker.start()
+
+    if entry is None and worker is not None and wait > 0:
+        worker.join(wait)
+        with _CACHE_LOCK:
+            entry = _MODEL_CATALOG.get(base)
+
+    return list(entry["models"]) if entry else []
+
+
+# -------------------------
+# Parallel slots（/props をバックグラウンドで一度だけ確認）
+# -------------------------
+# base_url -> スロット数（取れなかったら None）
+_SLOTS: Dict[str, Optional[int]] = {}
+_SLOTS_PROBING: Dict[str, threading.Thread] = {}
+
+
+def _probe_slots(base_url: str, timeout: float) -> None:
+    n = OllamaChatClient(base_url, timeout=timeout).parallel_slots()
+    with _CACHE_LOCK:
+        _SLOTS[base_url] = n
+        _SLOTS_PROBING.pop(base_url, None)
+
+
+def cached_parallel_slots(base_url: str, timeout: float = 5.0) -> Optional[int]:
+    """
+    サーバの同時処理スロット数（プロセス共有でキャッシュ）。描画をブロックしない。
+    まだ分からなければ裏で /props を確認して None を返す（次の rerun で値が入る）。
+    """
+    base = (base_url or "").rstrip("/")
+    if not base:
+        return None
+    with _CACHE_LOCK:
+        if base in _SLOTS:
+            return _SLOTS[base]
+        if base not in _SLOTS_PROBING:
+            worker = threading.Thread(target=_probe_slots, args=(base, timeout), daemon=True)
+            _SLOTS_PROBING[base] = worker
+            worker.start()
+    return None
@@ -0,0 +1,120 @@
+# secdemo/alerts.py
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ALERT_KEYS = (
+    "risk",
+    "name",
+    "url",
+    "param",
+    "attack",
+    "evidence",
+    "cweid",
+    "wascid",
+    "pluginid",
+    "desc",
+    "solution",
+    "reference",
+)
+
+
+def normalize_alert(a: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    UI側が参照するキーを必ず持つように正規化（KeyError防止）
+    """
+    base = {k: "" for k in ALERT_KEYS}
+    if not a:
+        return base
+    base.update({k: a.get(k, base.get(k, "")) for k in base.keys()})
+    return base
+
+
+def from_zap_alert(a: Dict[str, Any]) -> Dict[str, Any]:
+    """ZAP API の alert 1件を UI 用のキーへ変換"""
+    return normalize_alert(
+        {
+            "risk": a.get("risk") or a.get("riskdesc") or "",
+            "name": a.get("alert") or a.get("name") or "",
+            "url": a.get("url") or "",
+            "param": a.get("param") or "",
+            "attack": a.get("attack") or "",
+            "evidence": a.get("evidence") or "",
+            "cweid": a.get("cweid") or "",
+            "wascid": a.get("wascid") or "",
+            "pluginid": a.get("pluginId") or a.get("pluginid") or "",
+            "desc": a.get("description") or "",
+            "solution": a.get("solution") or "",
+            "reference": a.get("reference") or "",
+        }
+    )
+
+
+def alert_key(a: Dict[str, Any]) -> Tuple[str, str, str]:
+    """同一検出とみなすキー：(pluginId or name, risk, param)"""
+    return (
+        str(a.get("pluginid") or a.get("name") or ""),
+        str(a.get("risk") or ""),
+        str(a.get("param") or ""),
+    )
+
+
+def collect_alerts(alerts: Iterable[Dict[str, Any]], max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    ストリームで届くアラートをリスト化する。
+    max_items を超えた後は、既出キーのインスタンスは保持せず
+    代表行の "instances"（その行が代表する件数）を数えるだけにする（メモリ上限）。
+    """
+    out: List[Dict[str, Any]] = []
+    first: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for a in alerts:
+        k = alert_key(a)
+        rep = first.get(k)
+        if rep is not None and max_items is not None and len(out) >= max_items:
+            rep["instances"] += 1
+            continue
+        a["instances"] = 1
+        first.setdefault(k, a)
+        out.append(a)
+    return out
+
+
+# -----------------------------
+# Grouping（URLごとのインスタンスを1行に畳む）
+# -----------------------------
+def _risk_rank(text: str) -> int:
+    s = (text or "").lower()
+    if "high" in s:
+        return 3
+    if "medium" in s:
+        return 2
+    if "low" in s:
+        return 1
+    if "info" in s:
+        return 0
+    return -1
+
+
+def group_alerts(alerts: Iterable[Dict[str, Any]], url_samples: int = 5) -> List[Dict[str, Any]]:
+    """
+    (pluginId/name, risk, param) をキーに1パスでインスタンスを畳み込む。
+    各グループは代表インスタンスの項目 + "count"（インスタンス数）+ "urls"（URLサンプル）。
+    並びは risk 降順 → count 降順。
+    """
+    index: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for a in alerts:
+        k = alert_key(a)
+        g = index.get(k)
+        if g is None:
+            g = normalize_alert(a)
+            g["count"] = 0
+            g["urls"] = []
+            index[k] = g
+        g["count"] += int(a.get("instances") or 1)
+        url = a.get("url") or ""
+        if url and len(g["urls"]) < url_samples and url not in g["urls"]:
+            g["urls"].append(url)
+
+    groups = list(index.values())
+    groups.sort(key=lambda g: (-_risk_rank(g.get("risk", "")), -g["count"], g.get("name", "")))
+    return groups
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+Header = Tuple[str, str]
+
+_CONTENT_LENGTH = "content-length"
+
+
+@dataclass
+class HttpRequest:
+    method: str = "GET"
+    url: str = ""
+    http_version: str = "HTTP/1.1"
+    headers: List[Header] = field(default_factory=list)
+    body: str = ""
+
+
+# ----------------------------
+# Raw <-> HttpRequest
+# ----------------------------
+
+def parse_raw_http_request(raw: str) -> HttpRequest:
+    """
+    Raw リクエスト（ZAP / Burp から貼ったもの）を解析する。
+    改行は CRLF / LF のどちらでもよい。リクエストラインが不正なら ValueError。
+    """
+    text = (raw or "").lstrip("\r\n")
+    m = re.search(r"\r?\n\r?\n", text)
+    if m:
+        head, body = text[: m.start()], text[m.end() :]
+    else:
+        head, body = text, ""
+
+    lines = re.split(r"\r?\n", head)
+    parts = lines[0].split()
+    if len(parts) < 2:
+        raise ValueError(f"リクエストラインを解析できません: {lines[0][:80]!r}")
+    method, url = parts[0].upper(), parts[1]
+    http_version = parts[2] if len(parts) > 2 else "HTTP/1.1"
+
+    headers: List[Header] = []
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        if ":" not in line:
+            raise ValueError(f"ヘッダ行を解析できません: {line[:80]!r}")
+        k, v = line.split(":", 1)
+        headers.append((k.strip(), v.strip()))
+
+    return HttpRequest(method=method, url=url, http_version=http_version, headers=headers, body=body)
+
+
+def build_raw_http_request(msg: Dict[str, Any]) -> str:
+    """
+    dict（method / url / http_version / headers / body）から Raw リクエストを組み立てる。
+    Content-Length ヘッダがあれば body に合わせて付け直す（body があって無い場合は足す）。
+    """
+    method = (msg.get("method") or "GET").upper()
+    url = msg.get("url") or "/"
+    http_version = msg.get("http_version") or "HTTP/1.1"
+    body = msg.get("body") or ""
+    headers: List[Header] = list(msg.get("headers") or [])
+
+    length = str(len(body.encode("utf-8")))
+    has_length = any(k.lower() == _CONTENT_LENGTH for k, _ in headers)
+    if has_length:
+        headers = [(k, length if k.lower() == _CONTENT_LENGTH else v) for k, v in headers]
+    elif body:
+        headers.append(("Content-Length", length))
+
+    lines = [f"{method} {url} {http_version}"]
+    lines += [f"{k}: {v}" for k, v in headers]
+    return "\r\n".join(lines) + "\r\n\r\n" + body
+
+
+# ----------------------------
+# Headers
+# ----------------------------
+
+def kvlist_to_headers(rows: Optional[List[Dict[str, Any]]]) -> List[Header]:
+    """[{name, value}] → [(name, value)]（name が空の行は捨てる）"""
+    out: List[Header] = []
+    for r in rows or []:
+        name = str(r.get("name", "")).strip()
+        if name:
+            out.append((name, "" if r.get("value") is None else str(r.get("value"))))
+    return out
+
+
+def _header(headers: List[Header], name: str) -> str:
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return ""
+
+
+# ----------------------------
+# Query / Body params
+# ----------------------------
+
+def extract_query_params(url: str) -> List[Dict[str, str]]:
+    query = urlsplit(url or "").query
+    return [{"name": k, "value": v} for k, v in parse_qsl(query, keep_blank_values=True)]
+
+
+def set_query_params(url: str, params: List[Dict[str, Any]]) -> str:
+    u = urlsplit(url or "")
+    query = urlencode([(p["name"], p.get("value", "")) for p in params if p.get("name")])
+    return urlunsplit((u.scheme, u.netloc, u.path, query, u.fragment))
+
+
+def _is_form_urlencoded(headers: List[Header]) -> bool:
+    return _header(headers, "content-type").lower().startswith("application/x-www-form-urlencoded")
+
+
+def extract_body_params_if_form_urlencoded(headers: List[Header], body: str) -> List[Dict[str, str]]:
+    if not body or not _is_form_urlencoded(headers):
+        return []
+    return [{"name": k, "value": v} for k, v in parse_qsl(body, keep_blank_values=True)]
+
+
+def set_body_params_form_urlencoded(headers: List[Header], params: List[Dict[str, Any]]) -> str:
+    """x-www-form-urlencoded の body を作る（Content-Type が違っても params から作る）"""
+    return urlencode([(p["name"], p.get("value", "")) for p in params if p.get("name")])
+
+
+# ----------------------------
+# Cookie
+# ----------------------------
+
+def parse_cookie_header(value: str) -> List[Dict[str, str]]:
+    """'a=1; b=2' → [{name: a, value: 1}, ...]（値はデコードしない）"""
+    out: List[Dict[str, str]] = []
+    for part in (value or "").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, v = part.partition("=")
+        out.append({"name": name.strip(), "value": v.strip()})
+    return out
+
+
+def build_cookie_header(items: List[Dict[str, Any]]) -> str:
+    return "; ".join(f"{it['name']}={it.get('value', '')}" for it in items if it.get("name"))
@@ -1,42 +1,13 @@
-import re
-import time
-from typing import List, Dict, Any
+from typing import List
 
 import streamlit as st
 
-from . import zap_client as zap
-from .http_parser import parse_raw_http_request, build_raw_http_request
-
-
-
-def _extract_status_and_length(raw_response: str):
-    status = ""
-    length = 0
-    if not raw_response:
-        return status, length
-    # status
-    m = re.search(r"HTTP/\d\.\d\s+(\d+)", raw_response)
-    if m:
-        status = m.group(1)
-    # length: body length (rough)
-    parts = raw_response.split("\r\n\r\n", 1)
-    body = parts[1] if len(parts) == 2 else ""
-    length = len(body.encode("utf-8", errors="ignore"))
-    return status, length
-
-
-def _regex_hits(raw_response: str, patterns: List[str]) -> Dict[str, bool]:
-    hits = {}
-    text = raw_response or ""
-    for p in patterns:
-        p = (p or "").strip()
-        if not p:
-            continue
-        try:
-            hits[p] = bool(re.search(p, text, flags=re.IGNORECASE))
-        except re.error:
-            hits[p] = False
-    return hits
+from .intruder_engine import IntruderJob
+from .intruder_store import IntruderStore, list_runs
+from .response_cluster import outlier_clusters
+from .payload_positions import ATTACK_MODES, RequestTemplate, count_requests, iter_attack, strip_markers
+
+PAGE_SIZES = [50, 100, 200, 500]
 
 
 def render_intruder_panel():
@@ -45,11 +16,7 @@ def render_intruder_panel():
         st.warning("未接続です。ZAP Liveタブで接続テストをしてください。")
         return
 
-    # state init
-    if "intruder_results" not in st.session_state:
-        st.session_state.intruder_results = []
-
-    st.caption("指定パラメータにpayloadを流し込み → 連続送信 → status/size/regex差分を表示します。")
+    st.caption("指定パラメータにpayloadを流し込み → 連続送信 → status/size/regex差分を表示します。Raw 内の §値§ も差し込み位置になります。")
 
     raw = st.text_area(
         "Base Raw Request（RepeaterのRawを貼り付け推奨）",
@@ -58,15 +25,51 @@ def render_intruder_panel():
         key="intruder_base_raw",
     )
 
-    param_name = st.text_input("対象パラメータ名（query/body/cookieのいずれか）", value="q", key="intruder_param_name")
-
-    payloads_text = st.text_area(
-        "Payload list（1行1つ）",
-        value="1\n' OR '1'='1\n<svg/onload=alert(1)>\n../../../../etc/passwd",
-        height=160,
-        key="intruder_payloads",
+    param_name = st.text_input(
+        "対象パラメータ名（query/body/cookie、カンマ区切りで複数可）",
+        value="q",
+        key="intruder_param_name",
+    )
+    mode = st.selectbox(
+        "攻撃モード",
+        ATTACK_MODES,
+        key="intruder_mode",
+        help="sniper: 1リストを各位置へ順番に / pitchfork: 位置ごとのリストを同じ行どうし / cluster-bomb: 全組み合わせ",
     )
 
+    # ベースリクエストはここで1回だけ解析（payload ごとには解析しない）
+    template = None
+    if raw.strip():
+        try:
+            template = RequestTemplate.from_raw(raw, param_name.split(","))
+        except Exception as e:
+            st.error(f"差し込み位置を作れません: {e}")
+    if template is not None and template.slots:
+        st.caption("差し込み位置: " + ", ".join(f"{n}（元の値: {o[:30]}）" for n, o in zip(template.slots, template.originals)))
+
+    default_payloads = "1\n' OR '1'='1\n<svg/onload=alert(1)>\n../../../../etc/passwd"
+    payload_lists: List[List[str]] = []
+    if mode == "sniper" or template is None or len(template.slots) <= 1:
+        payloads_text = st.text_area("Payload list（1行1つ）", value=default_payloads, height=160, key="intruder_payloads")
+        payload_lists = [[p for p in payloads_text.splitlines() if p.strip()]]
+        if template is not None and mode != "sniper":
+            payload_lists = payload_lists * len(template.slots)
+    else:
+        cols = st.columns(min(len(template.slots), 3))
+        for i, slot in enumerate(template.slots):
+            with cols[i % len(cols)]:
+                text = st.text_area(
+                    f"Payload list: {slot}",
+                    value=default_payloads,
+                    height=160,
+                    key=f"intruder_payloads_{slot}",
+                )
+            payload_lists.append([p for p in text.splitlines() if p.strip()])
+
+    total = count_requests(mode, len(template.slots), payload_lists) if template is not None else 0
+    if template is not None:
+        st.caption(f"送信予定: {total} 件")
+
     patterns_text = st.text_input(
         "差分検出regex（カンマ区切り）例: error, sql, warning, root:x",
         value="error, sql, warning, root:x",
@@ -74,126 +77,156 @@ def render_intruder_panel():
     )
     patterns = [p.strip() for p in patterns_text.split(",") if p.strip()]
 
+    job = st.session_state.get("intruder_job")
+    running = job is not None and not job.finished
+
     follow = st.checkbox("followRedirects", value=True, key="intruder_follow_redirects")
-    delay_ms = st.slider("送信間隔(ms)", 0, 1000, 50, 50, key="intruder_delay_ms")
-
-    def build_mutated_raw(base_raw: str, name: str, value: str) -> str:
-        msg = parse_raw_http_request(base_raw)
-        # URL query
-        if "?" in msg.url and name:
-            from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
-            u = urlsplit(msg.url)
-            qs = dict(parse_qsl(u.query, keep_blank_values=True))
-            if name in qs:
-                qs[name] = value
-                msg.url = urlunsplit((u.scheme, u.netloc, u.path, urlencode(qs, doseq=True), u.fragment))
-
-        # Body (x-www-form-urlencoded)
-        ctype = ""
-        for k, v in msg.headers:
-            if k.lower() == "content-type":
-                ctype = v
-        if name and ctype.lower().startswith("application/x-www-form-urlencoded") and msg.body:
-            from urllib.parse import parse_qsl, urlencode
-            d = dict(parse_qsl(msg.body, keep_blank_values=True))
-            if name in d:
-                d[name] = value
-                msg.body = urlencode(d, doseq=True)
-
-        # Cookie
-        for i, (k, v) in enumerate(msg.headers):
-            if k.lower() == "cookie":
-                from .http_parser import parse_cookie_header, build_cookie_header
-                ck = parse_cookie_header(v)
-                found = False
-                for item in ck:
-                    if item.get("name") == name:
-                        item["value"] = value
-                        found = True
-                if found:
-                    msg.headers[i] = (k, build_cookie_header(ck))
-
-        return build_raw_http_request({
-            "method": msg.method,
-            "url": msg.url,
-            "http_version": msg.http_version,
-            "headers": msg.headers,
-            "body": msg.body or "",
+    c1, c2 = st.columns(2)
+    with c1:
+        workers = st.slider("並列数（workers）", 1, 16, 4, key="intruder_workers", disabled=running)
+    with c2:
+        rate = st.slider("送信レート上限(req/s, 0=無制限)", 0, 200, 20, 5, key="intruder_rate", disabled=running)
+
+    b1, b2 = st.columns(2)
+    with b1:
+        start = st.button(
+            "▶ Intruder 実行",
+            use_container_width=True,
+            disabled=(running or template is None or not template.slots or total == 0),
+        )
+    with b2:
+        if st.button("⏹ 中止", use_container_width=True, disabled=not running, key="intruder_cancel"):
+            job.cancel()
+
+    if start:
+        store = IntruderStore.create()
+        st.session_state.intruder_run = store.run_id
+        st.session_state.intruder_run_pick = store.run_id
+        st.session_state.intruder_job = IntruderJob(
+            st.session_state.zap_base,
+            st.session_state.zap_apikey,
+            strip_markers(raw),
+            iter_attack(template, mode, payload_lists),
+            patterns,
+            param=", ".join(template.slots),
+            total=total,
+            workers=workers,
+            rate_per_sec=float(rate),
+            follow_redirects=bool(follow),
+            store=store,
+        )
+        st.rerun()
+
+    # 結果はディスク（secdemo_data/intruder/<run>/）にあり、表示のたびに必要なページだけ読む
+    runs = list_runs()
+    run_id = st.session_state.get("intruder_run")
+    if not running and runs:
+        # selectbox は session_state だけで動かす（index= と併用しない）
+        if st.session_state.get("intruder_run_pick") not in runs:
+            st.session_state.intruder_run_pick = run_id if run_id in runs else runs[0]
+        run_id = st.selectbox("表示する実行", runs, key="intruder_run_pick")
+        st.session_state.intruder_run = run_id
+    store = IntruderStore(run_id) if run_id in runs else None
+
+    if job is not None and running:
+        @st.fragment(run_every=1.0)
+        def _progress():
+            sent, _ = job.snapshot()
+            total = job.total or max(sent, 1)
+            label = f"{sent}/{total} 送信" + ("（中止）" if job.cancelled else "")
+            st.progress(min(sent / max(total, 1), 1.0), text=label)
+            if store is not None:
+                _render_results(store)
+            if job.finished:
+                # 完了したらポーリングを止めるため全体を描き直す
+                st.rerun()
+
+        _progress()
+    else:
+        if job is not None and job.error and job.store is not None and job.store.run_id == run_id:
+            st.error("Intruder が停止しました（Baseline送信の失敗など）")
+            st.code(job.error)
+        if store is not None:
+            _render_results(store)
+        else:
+            st.info("まだIntruder結果がありません。")
+
+
+def _render_results(store: IntruderStore):
+    total_rows = store.count()
+    if not total_rows:
+        st.info("まだIntruder結果がありません。")
+        return
+
+    st.markdown("#### 結果（差分）")
+
+    # 本文の simhash でクラスタ分けし、少数派（外れ）クラスタだけを見る
+    baseline = store.get_meta("baseline") or {}
+    normal = [baseline["cluster"]] if baseline.get("cluster") is not None else []
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        only_outliers = st.checkbox("外れクラスタのみ表示", value=True, key="intruder_only_outliers")
+    with c2:
+        ratio = st.slider("外れとみなす割合（%以下）", 1, 50, 5, key="intruder_outlier_ratio")
+    outliers = outlier_clusters(store.cluster_sizes(), normal=normal, max_ratio=ratio / 100.0)
+
+    summary = store.cluster_summary()
+    st.caption(f"結果: {total_rows} 件 / クラスタ数: {len(summary)} / 外れクラスタ: {len(outliers)}")
+    with st.expander("クラスタ一覧", expanded=False):
+        st.dataframe(
+            [{**s, "baseline": "Y" if s["cluster"] in normal else "", "outlier": "Y" if s["cluster"] in outliers else ""} for s in summary],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    clusters = outliers if only_outliers else None
+    n_shown = store.count(clusters)
+    if not n_shown:
+        st.info("外れクラスタはありません（すべて baseline に近いか、多数派の応答です）。")
+        return
+
+    # ページング（no 順）
+    p1, p2 = st.columns([1, 1])
+    with p1:
+        page_size = st.selectbox("1ページの件数", PAGE_SIZES, index=1, key="intruder_page_size")
+    pages = max(1, -(-n_shown // page_size))
+    if st.session_state.get("intruder_page", pages + 1) > pages:
+        # 初回、または絞り込みやページ件数が変わってページ数が減った
+        st.session_state.intruder_page = 1
+    with p2:
+        page = st.number_input(f"ページ（全 {pages}）", min_value=1, max_value=pages, step=1, key="intruder_page")
+
+    rows = []
+    for r in store.page((int(page) - 1) * page_size, page_size, clusters):
+        diff_regex = [k for k, v in (r.get("regex_diff") or {}).items() if v]
+        counts = r.get("regex_counts") or {}
+        hit_regex = [f"{k}×{counts[k]}" if k in counts else k for k, v in (r.get("regex_hits") or {}).items() if v]
+
+        rows.append({
+            "no": r["no"],
+            "payload": r["payload"],
+            "status": r["status"],
+            "len": r["length"],
+            "Δlen": r["delta_length"],
+            "cluster": r["cluster"],
+            "statusΔ": "Y" if r["d_status"] else "",
+            "bodyΔ": "Y" if r["d_cluster"] else "",
+            "hit(regex)": ", ".join(hit_regex)[:80],
+            "diff(regex)": ", ".join(diff_regex)[:80],
         })
 
-    if st.button("▶ Intruder 実行", use_container_width=True, disabled=(not raw.strip() or not param_name.strip())):
-        payloads = [p for p in payloads_text.splitlines() if p.strip()]
-        st.session_state.intruder_results = []
+    st.dataframe(rows, use_container_width=True, hide_index=True)
 
-        # baseline（payload無しの状態）
-        baseline_resp = ""
-        try:
-            res0 = zap.send_request(st.session_state.zap_base, st.session_state.zap_apikey, raw, follow_redirects=bool(follow))
-            payload0 = res0.get("sendRequest", {}) if isinstance(res0, dict) else {}
-            baseline_resp = (payload0.get("responseHeader", "") or "") + (payload0.get("responseBody", "") or "")
-        except Exception as e:
-            st.error("Baseline送信に失敗しました")
-            st.code(str(e))
-            return
-
-        base_status, base_len = _extract_status_and_length(baseline_resp)
-        base_hits = _regex_hits(baseline_resp, patterns)
-
-        for idx, p in enumerate(payloads, 1):
-            mutated = build_mutated_raw(raw, param_name.strip(), p)
-            try:
-                res = zap.send_request(st.session_state.zap_base, st.session_state.zap_apikey, mutated, follow_redirects=bool(follow))
-                payload = res.get("sendRequest", {}) if isinstance(res, dict) else {}
-                resp = (payload.get("responseHeader", "") or "") + (payload.get("responseBody", "") or "")
-            except Exception as e:
-                resp = f"ERROR: {e}"
-
-            stt, ln = _extract_status_and_length(resp)
-            hits = _regex_hits(resp, patterns)
-
-            st.session_state.intruder_results.append({
-                "no": idx,
-                "param": param_name.strip(),
-                "payload": p,
-                "status": stt,
-                "length": ln,
-                "d_status": (stt != base_status),
-                "d_length": (ln != base_len),
-                "delta_length": (ln - base_len),
-                "regex_hits": hits,
-                "regex_diff": {k: (hits.get(k) != base_hits.get(k)) for k in hits.keys()},
-            })
-
-            if delay_ms:
-                time.sleep(delay_ms / 1000.0)
-
-        st.success("Intruder 完了")
-
-    # 表示
-    if st.session_state.intruder_results:
-        st.markdown("#### 結果（差分）")
-
-        rows = []
-        for r in st.session_state.intruder_results:
-            diff_regex = [k for k, v in (r.get("regex_diff") or {}).items() if v]
-            hit_regex = [k for k, v in (r.get("regex_hits") or {}).items() if v]
-
-            rows.append({
-                "no": r["no"],
-                "payload": r["payload"],
-                "status": r["status"],
-                "len": r["length"],
-                "Δlen": r["delta_length"],
-                "statusΔ": "Y" if r["d_status"] else "",
-                "lenΔ": "Y" if r["d_length"] else "",
-                "hit(regex)": ", ".join(hit_regex)[:80],
-                "diff(regex)": ", ".join(diff_regex)[:80],
-            })
-
-        st.dataframe(rows, use_container_width=True, hide_index=True)
-
-        pick = st.number_input("詳細を見る No", min_value=1, max_value=len(st.session_state.intruder_results), value=1, step=1)
-        item = st.session_state.intruder_results[int(pick) - 1]
+    # 実行・絞り込み・ページが変わったら、表示中ページの先頭行を選び直す
+    view = (store.run_id, only_outliers, page_size, int(page))
+    if st.session_state.get("_intruder_pick_view") != view or "intruder_pick_no" not in st.session_state:
+        st.session_state._intruder_pick_view = view
+        st.session_state.intruder_pick_no = rows[0]["no"]
+    pick = st.number_input("詳細を見る No", min_value=1, step=1, key="intruder_pick_no")
+    item = store.get(int(pick))
+    if item is not None:
         st.json(item)
+        with st.expander("レスポンス", expanded=False):
+            st.code(store.body(int(pick)) or "", language="http")
     else:
-        st.info("まだIntruder結果がありません。")
+        st.caption("この No の結果はまだ届いていません。")
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import zap_client as zap
+from .intruder_store import IntruderStore
+from .response_cluster import SimhashClusterer, simhash
+from .response_match import ResponseMatcher, status_and_length
+
+
+# ----------------------------
+# Send
+# ----------------------------
+
+def send_message(zap_base: str, apikey: str, raw_request: str, follow_redirects: bool) -> Dict[str, Any]:
+    """ZAP sendRequest で送り、最後のメッセージ（リダイレクト追従時は最終応答）を返す"""
+    res = zap.send_request(zap_base, apikey, raw_request, follow_redirects=follow_redirects)
+    payload = res.get("sendRequest", {}) if isinstance(res, dict) else {}
+    if isinstance(payload, list):
+        payload = payload[-1] if payload else {}
+    return payload if isinstance(payload, dict) else {}
+
+
+# ----------------------------
+# Rate limiter
+# ----------------------------
+
+class TokenBucket:
+    """
+    rate_per_sec 個/秒で補充されるトークンバケット（burst まで貯まる）。
+    固定 sleep と違い、応答待ちの時間も間隔に含まれるので並列時も全体レートが守られる。
+    rate_per_sec <= 0 なら無制限。
+    """
+
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate = float(rate_per_sec)
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """トークンを1つ取る（取れるまで待つ）。cancel されたら False"""
+        if self.rate <= 0:
+            return not (cancel and cancel.is_set())
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if cancel is not None:
+                if cancel.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+# ----------------------------
+# Engine
+# ----------------------------
+
+# (no, payload 表示用ラベル, 送信する raw request)
+IntruderRequest = Tuple[int, str, str]
+
+
+class IntruderJob:
+    """
+    Intruder をバックグラウンドで実行する（UI から切り離したワーカープール）。
+    - requests は遅延生成のイテレータでよい（ワーカーが1件ずつ取り出す）
+    - 送信は TokenBucket で全体のレートを制限、ZAP への HTTP はプールされたセッションを共有
+    - 結果は終わった順に results へ積む。UI は snapshot() で差分だけ取り出して表に流す
+    - 本文の simhash はワーカー側で計算し、行には指紋とクラスタ ID だけ載せる（本文は UI へ渡さない）
+    - store を渡すと行と本文はディスクへ書き、メモリには件数しか残さない（UI は store をページングして読む）
+    - ワーカーは streamlit に触らない
+    """
+
+    def __init__(
+        self,
+        zap_base: str,
+        apikey: str,
+        base_raw: str,
+        requests: Iterable[IntruderRequest],
+        patterns: List[str],
+        param: str = "",
+        total: Optional[int] = None,
+        workers: int = 4,
+        rate_per_sec: float = 20.0,
+        follow_redirects: bool = True,
+        cluster_distance: int = 3,
+        store: Optional[IntruderStore] = None,
+    ):
+        self.zap_base = zap_base
+        self.apikey = apikey
+        self.base_raw = base_raw
+        self.patterns = list(patterns)
+        # パターンは実行ごとに1回だけコンパイル
+        self._matcher = ResponseMatcher(self.patterns)
+        self.clusterer = SimhashClusterer(max_distance=cluster_distance)
+        self.param = param
+        self.total = total
+        self.follow_redirects = bool(follow_redirects)
+        self.store = store
+
+        self.results: List[Dict[str, Any]] = []
+        self.baseline: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.sent = 0
+
+        self._requests: Iterator[IntruderRequest] = iter(requests)
+        self._bucket = TokenBucket(rate_per_sec, burst=max(1, int(workers)))
+        self._workers = max(1, int(workers))
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+        threading.Thread(target=self._run, daemon=True, name="intruder").start()
+
+    # ----------------------------
+    # Worker side
+    # ----------------------------
+
+    def _next_request(self) -> Optional[IntruderRequest]:
+        # ジェネレータは並行に next() できないのでロックで1件ずつ渡す
+        with self._lock:
+            try:
+                return next(self._requests)
+            except StopIteration:
+                return None
+
+    def _analyze(self, msg: Dict[str, Any]) -> Tuple[str, int, Dict[str, Dict[str, Any]], int]:
+        status, length = status_and_length(msg)
+        body = msg.get("responseBody", "") or ""
+        text = (msg.get("responseHeader", "") or "") + body
+        return status, length, self._matcher.scan(text), simhash(body)
+
+    def _worker(self) -> None:
+        base_status = self.baseline["status"]
+        base_len = self.baseline["length"]
+        base_hits = self.baseline["regex_hits"]
+        while not self._cancel.is_set():
+            req = self._next_request()
+            if req is None or not self._bucket.acquire(self._cancel):
+                return
+            no, payload, raw = req
+            try:
+                msg = send_message(self.zap_base, self.apikey, raw, self.follow_redirects)
+            except Exception as e:
+                msg = {"responseBody": f"ERROR: {e}"}
+
+            stt, ln, scan, fp = self._analyze(msg)
+            hits = ResponseMatcher.hits(scan)
+            row = {
+                "no": no,
+                "param": self.param,
+                "payload": payload,
+                "status": stt,
+                "length": ln,
+                "d_status": (stt != base_status),
+                "d_length": (ln != base_len),
+                "delta_length": (ln - base_len),
+                "regex_hits": hits,
+                "regex_diff": {k: (hits.get(k) != base_hits.get(k)) for k in hits.keys()},
+                "regex_counts": {k: v["count"] for k, v in scan.items() if v["count"]},
+                "regex_offsets": {k: v["offsets"] for k, v in scan.items() if v["offsets"]},
+                "simhash": f"{fp:016x}",
+            }
+            with self._lock:
+                row["cluster"] = self.clusterer.add(fp, stt)
+                row["d_cluster"] = row["cluster"] != self.baseline["cluster"]
+                if self.store is None:
+                    self.results.append(row)
+            if self.store is not None:
+                self.store.add(row, (msg.get("responseHeader", "") or "") + (msg.get("responseBody", "") or ""))
+            with self._lock:
+                self.sent += 1
+
+    def _run(self) -> None:
+        try:
+            # baseline（payload無しの状態）
+            msg = send_message(self.zap_base, self.apikey, self.base_raw, self.follow_redirects)
+            stt, ln, scan, fp = self._analyze(msg)
+            self.baseline = {
+                "status": stt,
+                "length": ln,
+                "regex_hits": ResponseMatcher.hits(scan),
+                "simhash": f"{fp:016x}",
+                "cluster": self.clusterer.add(fp, stt),
+            }
+            if self.store is not None:
+                self.store.set_meta("baseline", self.baseline)
+                self.store.set_meta("param", self.param)
+                self.store.set_meta("total", self.total)
+
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="intruder") as pool:
+                for f in [pool.submit(self._worker) for _ in range(self._workers)]:
+                    f.result()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if self.store is not None:
+                try:
+                    self.store.close()
+                except Exception as e:
+                    self.error = self.error or str(e)
+            self._done.set()
+
+    # ----------------------------
+    # UI side
+    # ----------------------------
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def snapshot(self, since: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+        """(送信済み件数, results[since:] のコピー)"""
+        with self._lock:
+            return self.sent, list(self.results[since:])
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from secdemo.paths import data_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    no           INTEGER PRIMARY KEY,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    length       INTEGER NOT NULL,
+    delta_length INTEGER NOT NULL,
+    cluster      INTEGER,
+    d_status     INTEGER NOT NULL,
+    d_cluster    INTEGER NOT NULL,
+    data         TEXT NOT NULL,
+    body_off     INTEGER NOT NULL,
+    body_size    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_status ON results(status);
+CREATE INDEX IF NOT EXISTS idx_results_cluster ON results(cluster);
+"""
+
+# 列として持つもの（残りは data に JSON で入れる）
+_COLUMNS = ("no", "payload", "status", "length", "delta_length", "cluster", "d_status", "d_cluster")
+
+# 残す実行の数（古いものから消す）
+MAX_RUNS = 20
+# まとめて commit する件数 / 間隔
+COMMIT_EVERY = 32
+COMMIT_INTERVAL_SEC = 0.5
+
+
+def runs_dir() -> str:
+    return data_dir("intruder")
+
+
+def list_runs() -> List[str]:
+    """保存済みの実行 ID（新しい順）"""
+    root = runs_dir()
+    runs = [d for d in os.listdir(root) if os.path.isfile(os.path.join(root, d, "results.sqlite3"))]
+    return sorted(runs, reverse=True)
+
+
+def _prune_runs(keep: int = MAX_RUNS) -> None:
+    for run_id in list_runs()[keep:]:
+        shutil.rmtree(os.path.join(runs_dir(), run_id), ignore_errors=True)
+
+
+class IntruderStore:
+    """
+    Intruder 1回分の結果をディスクに置く（secdemo_data/intruder/<run_id>/）。
+    - results.sqlite3: 行（no が主キー、status / cluster に索引）
+    - bodies.bin: レスポンスを zlib 圧縮して追記。行には (offset, size) だけ持つ
+    書き込みはワーカースレッドから add()（ロックで直列化、まとめて commit）。
+    UI 側は呼び出しごとに別接続で読む（WAL なので書き込み中でも読める）。
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.dir = os.path.join(runs_dir(), run_id)
+        os.makedirs(self.dir, exist_ok=True)
+        self.db_path = os.path.join(self.dir, "results.sqlite3")
+        self.blob_path = os.path.join(self.dir, "bodies.bin")
+
+        self._lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._blob = None
+        self._blob_size = 0
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    @classmethod
+    def create(cls, prefix: str = "run") -> "IntruderStore":
+        _prune_runs(MAX_RUNS - 1)
+        return cls(f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ----------------------------
+    # Write（ワーカー側）
+    # ----------------------------
+
+    def _open_writer(self) -> None:
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+            self._blob = open(self.blob_path, "ab")
+            self._blob_size = self._blob.tell()
+
+    def _commit(self) -> None:
+        # 行が参照する本文を先にファイルへ出してから commit
+        self._blob.flush()
+        self._writer.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def set_meta(self, key: str, value: Any) -> None:
+        with self._lock, self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+
+    def add(self, row: Dict[str, Any], body: str = "") -> None:
+        packed = zlib.compress((body or "").encode("utf-8", errors="replace"), 6)
+        data = {k: v for k, v in row.items() if k not in _COLUMNS}
+        with self._lock:
+            self._open_writer()
+            off = self._blob_size
+            self._blob.write(packed)
+            self._blob_size += len(packed)
+            self._writer.execute(
+                "INSERT OR REPLACE INTO results (no, payload, status, length, delta_length, cluster, d_status, d_cluster, data, body_off, body_size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    int(row["no"]),
+                    str(row.get("payload", "")),
+                    str(row.get("status", "")),
+                    int(row.get("length", 0)),
+                    int(row.get("delta_length", 0)),
+                    row.get("cluster"),
+                    int(bool(row.get("d_status"))),
+                    int(bool(row.get("d_cluster"))),
+                    json.dumps(data, ensure_ascii=False),
+                    off,
+                    len(packed),
+                ),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY or time.monotonic() - self._last_commit >= COMMIT_INTERVAL_SEC:
+                self._commit()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._writer is not None and self._pending:
+                self._commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._commit()
+                self._writer.close()
+                self._blob.close()
+                self._writer = None
+                self._blob = None
+
+    # ----------------------------
+    # Read（UI 側）
+    # ----------------------------
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        with self._connect() as con:
+            row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    @staticmethod
+    def _where(clusters: Optional[Sequence[int]]) -> tuple:
+        if clusters is None:
+            return "", ()
+        if not clusters:
+            return " WHERE 0", ()
+        return f" WHERE cluster IN ({','.join('?' * len(clusters))})", tuple(int(c) for c in clusters)
+
+    def count(self, clusters: Optional[Sequence[int]] = None) -> int:
+        where, args = self._where(clusters)
+        with self._connect() as con:
+            return con.execute("SELECT COUNT(*) FROM results" + where, args).fetchone()[0]
+
+    def page(self, offset: int = 0, limit: int = 100, clusters: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        """no 順に limit 件（clusters を渡すとそのクラスタだけ）"""
+        where, args = self._where(clusters)
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            cur = con.execute(
+                f"SELECT {', '.join(_COLUMNS)}, data FROM results{where} ORDER BY no LIMIT ? OFFSET ?",
+                args + (int(limit), int(offset)),
+            )
+            return [self._to_row(r) for r in cur]
+
+    @staticmethod
+    def _to_row(r: sqlite3.Row) -> Dict[str, Any]:
+        row = {k: r[k] for k in _COLUMNS}
+        row["d_status"] = bool(row["d_status"])
+        row["d_cluster"] = bool(row["d_cluster"])
+        row.update(json.loads(r["data"] or "{}"))
+        return row
+
+    def get(self, no: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            r = con.execute(f"SELECT {', '.join(_COLUMNS)}, data FROM results WHERE no = ?", (int(no),)).fetchone()
+        return self._to_row(r) if r else None
+
+    def body(self, no: int) -> Optional[str]:
+        with self._connect() as con:
+            r = con.execute("SELECT body_off, body_size FROM results WHERE no = ?", (int(no),)).fetchone()
+        if not r:
+            return None
+        with open(self.blob_path, "rb") as f:
+            f.seek(r[0])
+            return zlib.decompress(f.read(r[1])).decode("utf-8", errors="replace")
+
+    def cluster_sizes(self) -> Dict[int, int]:
+        with self._connect() as con:
+            return {c: n for c, n in con.execute("SELECT cluster, COUNT(*) FROM results WHERE cluster IS NOT NULL GROUP BY cluster")}
+
+    def cluster_summary(self) -> List[Dict[str, Any]]:
+        """クラスタごとの件数・status・代表 payload（少ない順）"""
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT r.cluster, g.n, r.status, r.no, r.payload FROM results r"
+                " JOIN (SELECT cluster, COUNT(*) AS n, MIN(no) AS first FROM results WHERE cluster IS NOT NULL GROUP BY cluster) g"
+                " ON r.no = g.first ORDER BY g.n, r.cluster"
+            )
+            return [
+                {"cluster": c, "size": n, "status": s, "sample_no": no, "sample_payload": p}
+                for c, n, s, no, p in cur
+            ]
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import itertools
+import re
+from typing import Dict, Iterator, List, Sequence, Tuple
+from urllib.parse import parse_qsl, quote_plus, urlsplit, urlunsplit
+
+from .http_parser import parse_raw_http_request, build_raw_http_request, parse_cookie_header, build_cookie_header
+from .intruder_engine import IntruderRequest
+
+ATTACK_MODES = ("sniper", "pitchfork", "cluster-bomb")
+
+# テンプレート内の差し込み位置の印（slot 番号。-1 は Content-Length）
+_MARK = "\x00§{}§\x00"
+_MARK_RE = re.compile("\x00§(-?\\d+)§\x00")
+# Burp 風の §value§ 指定
+_BURP_RE = re.compile("§([^§]*)§")
+# 行末は CRLF / LF のどちらでもよい（\r は残す）。最後のヘッダでなくても当たるように
+_CONTENT_LENGTH_RE = re.compile(r"(?im)^(content-length:[ \t]*)\d+[ \t]*(?=\r?$)")
+
+_ENC_RAW = "raw"
+_ENC_URL = "url"
+
+
+def _split_segments(text: str) -> List[object]:
+    """リテラル文字列と slot 番号(int) の並びに分解"""
+    out: List[object] = []
+    pos = 0
+    for m in _MARK_RE.finditer(text):
+        if m.start() > pos:
+            out.append(text[pos : m.start()])
+        out.append(int(m.group(1)))
+        pos = m.end()
+    if pos < len(text):
+        out.append(text[pos:])
+    return out
+
+
+class RequestTemplate:
+    """
+    ベースの raw request を1回だけ解析し、差し込み位置に印を付けたテンプレートにする。
+    以後の生成は文字列の連結だけ（payload ごとに再解析しない）。
+    - slots: 差し込み先の名前（同じ名前が query/body/cookie に複数あれば全部に同じ値が入る）
+    - Body に差し込み位置があれば Content-Length も都度計算し直す
+    """
+
+    def __init__(self, slots: List[str], originals: List[str], encodings: List[str], head: List[object], sep: str, body: List[object]):
+        self.slots = slots
+        self.originals = originals
+        self._encodings = encodings
+        self._head = head
+        self._sep = sep
+        self._body = body
+        self._body_has_slot = any(isinstance(s, int) for s in body)
+
+    # ----------------------------
+    # Build
+    # ----------------------------
+
+    @classmethod
+    def from_raw(cls, raw: str, names: Sequence[str] = ()) -> "RequestTemplate":
+        """
+        §value§ の印があればそれを差し込み位置にする（名前は §1, §2 ...）。
+        無ければ names のパラメータ（query / x-www-form-urlencoded body / cookie）を差し込み位置にする。
+        """
+        if _BURP_RE.search(raw):
+            return cls._from_markers(raw)
+        return cls._from_params(raw, [n.strip() for n in names if n and n.strip()])
+
+    @classmethod
+    def _from_markers(cls, raw: str) -> "RequestTemplate":
+        originals: List[str] = []
+
+        def _mark(m: "re.Match[str]") -> str:
+            originals.append(m.group(1))
+            return _MARK.format(len(originals) - 1)
+
+        text = _BURP_RE.sub(_mark, raw)
+        slots = [f"§{i + 1}" for i in range(len(originals))]
+        return cls._from_text(text, slots, originals, [_ENC_RAW] * len(slots))
+
+    @classmethod
+    def _from_params(cls, raw: str, names: List[str]) -> "RequestTemplate":
+        msg = parse_raw_http_request(raw)
+        slot_of = {n: i for i, n in enumerate(names)}
+        originals = ["" for _ in names]
+        found = [False for _ in names]
+        url_slots = set()
+
+        def _encode_pairs(pairs: List[Tuple[str, str]]) -> str:
+            parts = []
+            for k, v in pairs:
+                i = slot_of.get(k)
+                if i is None:
+                    parts.append(f"{quote_plus(k)}={quote_plus(v)}")
+                else:
+                    if not found[i]:
+                        originals[i] = v
+                    found[i] = True
+                    url_slots.add(i)
+                    parts.append(f"{quote_plus(k)}={_MARK.format(i)}")
+            return "&".join(parts)
+
+        # URL query
+        url = msg.url
+        if "?" in url:
+            u = urlsplit(url)
+            pairs = parse_qsl(u.query, keep_blank_values=True)
+            if any(k in slot_of for k, _ in pairs):
+                url = urlunsplit((u.scheme, u.netloc, u.path, _encode_pairs(pairs), u.fragment))
+
+        # Body (x-www-form-urlencoded)
+        headers = list(msg.headers)
+        body = msg.body or ""
+        ctype = ""
+        for k, v in headers:
+            if k.lower() == "content-type":
+                ctype = v
+        if body and ctype.lower().startswith("application/x-www-form-urlencoded"):
+            pairs = parse_qsl(body, keep_blank_values=True)
+            if any(k in slot_of for k, _ in pairs):
+                body = _encode_pairs(pairs)
+
+        # Cookie（値はエンコードしない）
+        for hi, (k, v) in enumerate(headers):
+            if k.lower() != "cookie":
+                continue
+            items = parse_cookie_header(v)
+            hit = False
+            for it in items:
+                i = slot_of.get(it.get("name"))
+                if i is None:
+                    continue
+                if not found[i]:
+                    originals[i] = it.get("value", "")
+                found[i] = True
+                it["value"] = _MARK.format(i)
+                hit = True
+            if hit:
+                headers[hi] = (k, build_cookie_header(items))
+
+        missing = [n for n, ok in zip(names, found) if not ok]
+        if missing:
+            raise ValueError(f"パラメータが見つかりません: {', '.join(missing)}")
+
+        text = build_raw_http_request({
+            "method": msg.method,
+            "url": url,
+            "http_version": msg.http_version,
+            "headers": headers,
+            "body": body,
+        })
+        # 同じ名前が query/body と cookie の両方にある場合は URL エンコード側に合わせる
+        encodings = [_ENC_URL if i in url_slots else _ENC_RAW for i in range(len(names))]
+        return cls._from_text(text, list(names), originals, encodings)
+
+    @classmethod
+    def _from_text(cls, text: str, slots: List[str], originals: List[str], encodings: List[str]) -> "RequestTemplate":
+        sep = "\r\n\r\n" if "\r\n\r\n" in text else "\n\n"
+        head, _, body = text.partition(sep)
+        body_segments = _split_segments(body)
+        if any(isinstance(s, int) for s in body_segments):
+            head = _CONTENT_LENGTH_RE.sub(lambda m: m.group(1) + _MARK.format(-1), head, count=1)
+        return cls(slots, originals, encodings, _split_segments(head), sep, body_segments)
+
+    # ----------------------------
+    # Render
+    # ----------------------------
+
+    def _encode(self, i: int, value: str) -> str:
+        return quote_plus(value) if self._encodings[i] == _ENC_URL else value
+
+    def render(self, values: Dict[int, str]) -> str:
+        """values: slot 番号 -> 差し込む値（無い slot は元の値）"""
+        enc = [self._encode(i, values[i]) if i in values else self._encode(i, o) for i, o in enumerate(self.originals)]
+        body = "".join(s if isinstance(s, str) else enc[s] for s in self._body)
+        clen = str(len(body.encode("utf-8"))) if self._body_has_slot else ""
+        head = "".join(s if isinstance(s, str) else (clen if s < 0 else enc[s]) for s in self._head)
+        return head + self._sep + body
+
+
+# ----------------------------
+# Attack modes（すべて遅延生成）
+# ----------------------------
+
+def count_requests(mode: str, n_slots: int, payload_lists: Sequence[Sequence[str]]) -> int:
+    if not payload_lists or n_slots == 0:
+        return 0
+    if mode == "sniper":
+        return n_slots * len(payload_lists[0])
+    if mode == "pitchfork":
+        return min(len(p) for p in payload_lists[:n_slots])
+    total = 1
+    for p in payload_lists[:n_slots]:
+        total *= len(p)
+    return total
+
+
+def iter_attack(
+    template: RequestTemplate,
+    mode: str,
+    payload_lists: Sequence[Sequence[str]],
+) -> Iterator[IntruderRequest]:
+    """
+    - sniper: 1つの payload リストを、各位置に1つずつ順番に入れる（他の位置は元の値）
+    - pitchfork: 位置ごとのリストを同じ番目どうしで組にする（最短のリストで終わる）
+    - cluster-bomb: 位置ごとのリストの全組み合わせ
+    """
+    n = len(template.slots)
+    if n == 0:
+        return
+    single = n == 1
+
+    if mode == "sniper":
+        payloads = payload_lists[0] if payload_lists else []
+        combos = (({i: p}, p if single else f"{template.slots[i]}={p}") for i in range(n) for p in payloads)
+    else:
+        lists = list(payload_lists[:n])
+        if len(lists) < n:
+            raise ValueError(f"{mode} には位置ごと（{n}個）の payload リストが必要です")
+        product = zip(*lists) if mode == "pitchfork" else itertools.product(*lists)
+        combos = (
+            (dict(enumerate(vals)), vals[0] if single else " | ".join(f"{template.slots[i]}={v}" for i, v in enumerate(vals)))
+            for vals in product
+        )
+
+    for no, (values, label) in enumerate(combos, 1):
+        yield no, label, template.render(values)
+
+
+def strip_markers(raw: str) -> str:
+    """§value§ を value に戻す（baseline 送信用）"""
+    return _BURP_RE.sub(lambda m: m.group(1), raw)
@@ -3,6 +3,7 @@ import shutil
 import subprocess
 from typing import Any, Dict, List, Optional
 from .utils import now_str
+from secdemo.prompt_budget import PromptSection, build_prompt
 
 import streamlit as st
 from secdemo.ui import render_app
@@ -90,25 +91,32 @@ def parse_nmap_grepable(text: str) -> List[Dict[str, Any]]:
             })
     return rows
 
-def build_ai_input(scan_results: List[Dict[str, Any]], nmap_ports_table: List[Dict[str, Any]]) -> str:
-    blocks = []
+def build_ai_input(
+    scan_results: List[Dict[str, Any]],
+    nmap_ports_table: List[Dict[str, Any]],
+    max_tokens: int = 8000,
+) -> str:
+    # 予算が足りないときは stderr → stdout → ポート表 の順に削る
+    sections = []
     if nmap_ports_table:
         open_rows = [r for r in nmap_ports_table if r.get("state") == "open"]
-        blocks.append("## Parsed Nmap Ports (open only)")
-        blocks.append(str(open_rows[:200]))
+        sections.append(PromptSection(
+            "nmap",
+            header="## Parsed Nmap Ports (open only)",
+            items=[str(r) for r in open_rows],
+            priority=100,
+            min_tokens=200,
+        ))
 
-    blocks.append("## Raw Execution Logs")
+    sections.append(PromptSection("raw", fixed=True, text="## Raw Execution Logs"))
     for i, r in enumerate(scan_results, 1):
-        blocks.append(
-            f"""### [{i:02d}] {r['tool']}
+        sections.append(PromptSection(
+            f"cmd{i}",
+            fixed=True,
+            text=f"""### [{i:02d}] {r['tool']}
 command: {" ".join(r["command"])}
-returncode: {r["returncode"]}
-
-stdout:
-{(r["stdout"] or "")[:10000]}
-
-stderr:
-{(r["stderr"] or "")[:6000]}
-"""
-        )
-    return "\n\n".join(blocks)
+returncode: {r["returncode"]}""",
+        ))
+        sections.append(PromptSection(f"stdout{i}", header="stdout:", text=r["stdout"] or "", priority=50, min_tokens=200))
+        sections.append(PromptSection(f"stderr{i}", header="stderr:", text=r["stderr"] or "", priority=10, min_tokens=50))
+    return build_prompt(sections, max_tokens)
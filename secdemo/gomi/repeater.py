@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import time
+from datetime import datetime
+
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 
-from . import zap_client as zap
+from .intruder_engine import send_message
+from .repeater_history import RepeaterHistory, side_by_side
+from .response_match import status_and_length
 from .http_parser import (
     parse_raw_http_request,
     build_raw_http_request,
@@ -59,6 +64,26 @@ def _safe_set_state(key, default):
         st.session_state[key] = default
 
 
+# Response 表示は行単位でページング（文字数で切らない）
+RESPONSE_VIEW_LINES = 400
+HISTORY_LIST_LIMIT = 100
+
+
+def _fmt_time(ts) -> str:
+    return datetime.fromtimestamp(ts).strftime("%m-%d %H:%M:%S")
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_side_by_side(root: str, hash_a: str, hash_b: str, context: int):
+    # blob は内容アドレスなので (hash_a, hash_b, context) で結果が決まる
+    history = RepeaterHistory(root)
+    return side_by_side(history.blob(hash_a).splitlines(), history.blob(hash_b).splitlines(), context=context)
+
+
+def _entry_label(e) -> str:
+    return f"#{e['id']} {_fmt_time(e['sent_at'])} {e['method']} {e['status'] or '-'} {e['url'][:60]}"
+
+
 # ----------------------------
 # Raw <-> Form sync
 # ----------------------------
@@ -141,7 +166,7 @@ def render_repeater_panel():
         return
 
     _safe_set_state("zap_repeater_request", "")
-    _safe_set_state("zap_repeater_response", "")
+    _safe_set_state("zap_repeater_last_id", None)
 
     # Repeaterフォームの初期値（widget生成前に用意）
     _safe_set_state("rep_method", "GET")
@@ -234,6 +259,7 @@ def render_repeater_panel():
     st.divider()
 
     st.markdown("#### ③ 送信")
+    history = RepeaterHistory()
     colA, colB = st.columns([1, 2])
     with colA:
         if st.button("🚀 Send（ZAP経由）", use_container_width=True, disabled=(not st.session_state.get("rep_url", "").strip())):
@@ -241,15 +267,25 @@ def render_repeater_panel():
             st.session_state.zap_repeater_request = raw_to_send
 
             try:
-                res = zap.send_request(
+                t0 = time.monotonic()
+                payload = send_message(
                     st.session_state.zap_base,
                     st.session_state.zap_apikey,
                     raw_to_send,
-                    follow_redirects=bool(st.session_state.get("rep_follow_redirects", True)),
+                    bool(st.session_state.get("rep_follow_redirects", True)),
                 )
-                payload = res.get("sendRequest", {}) if isinstance(res, dict) else {}
+                elapsed_ms = int((time.monotonic() - t0) * 1000)
                 resp = (payload.get("responseHeader", "") or "") + (payload.get("responseBody", "") or "")
-                st.session_state.zap_repeater_response = resp
+                status, _ = status_and_length(payload)
+                # 送信ごとに履歴へ（同じ内容の request / response は1つの blob を共有）
+                st.session_state.zap_repeater_last_id = history.add(
+                    raw_to_send,
+                    resp,
+                    method=st.session_state.get("rep_method", ""),
+                    url=st.session_state.get("rep_url", ""),
+                    status=status,
+                    elapsed_ms=elapsed_ms,
+                )
                 st.success("送信しました")
             except Exception as e:
                 st.error("送信に失敗しました")
@@ -259,14 +295,105 @@ def render_repeater_panel():
         st.caption("Tip：History→Message取得→RawをRepeaterへ→フォーム同期→パラメータ編集→Send が最短です。")
 
     st.markdown("#### ④ Response")
-    if st.session_state.get("zap_repeater_response", "").strip():
-        st.code(st.session_state.zap_repeater_response[:20000], language="http")
+    last_id = st.session_state.get("zap_repeater_last_id")
+    entry = history.get(last_id) if last_id else None
+    if entry is not None:
+        resp = history.response(entry)
+        st.caption(f"#{entry['id']} status={entry['status'] or '-'} / {entry['resp_size']} bytes / {entry['elapsed_ms']} ms")
+        lines = resp.splitlines()
+        if len(lines) > RESPONSE_VIEW_LINES:
+            start = st.number_input(
+                f"表示開始行（全 {len(lines)} 行、{RESPONSE_VIEW_LINES} 行ずつ）",
+                min_value=1,
+                max_value=len(lines),
+                value=1,
+                step=RESPONSE_VIEW_LINES,
+                key="rep_resp_view_start",
+            )
+            st.code("\n".join(lines[int(start) - 1 : int(start) - 1 + RESPONSE_VIEW_LINES]), language="http")
+        else:
+            st.code(resp, language="http")
         st.download_button(
             "⬇ Response保存（txt）",
-            data=st.session_state.zap_repeater_response.encode("utf-8", errors="ignore"),
-            file_name="repeater_response.txt",
+            data=resp.encode("utf-8", errors="ignore"),
+            file_name=f"repeater_response_{entry['id']}.txt",
             mime="text/plain",
             use_container_width=True,
         )
     else:
         st.info("まだレスポンスがありません。")
+
+    st.markdown("#### ⑤ 履歴 / 差分")
+    entries = history.list(limit=HISTORY_LIST_LIMIT)
+    if not entries:
+        st.info("まだ送信履歴がありません。")
+        return
+
+    stats = history.stats()
+    st.caption(
+        f"履歴 {stats['entries']} 件 / 保存 blob {stats['blobs']} 個（重複は共有）"
+        f" / 本文 {stats['bytes']:,} bytes → 圧縮後 {stats['stored_bytes']:,} bytes"
+    )
+    st.dataframe(
+        [
+            {
+                "id": e["id"],
+                "time": _fmt_time(e["sent_at"]),
+                "method": e["method"],
+                "url": e["url"],
+                "status": e["status"],
+                "ms": e["elapsed_ms"],
+                "size": e["resp_size"],
+                "response": e["resp_hash"][:10],
+            }
+            for e in entries
+        ],
+        use_container_width=True,
+        hide_index=True,
+        height=220,
+    )
+
+    by_id = {e["id"]: e for e in entries}
+    ids = list(by_id)
+    for k in ("rep_diff_a", "rep_diff_b"):
+        # 古い履歴が消えて選択肢から外れたら選び直し
+        if st.session_state.get(k) not in by_id:
+            st.session_state.pop(k, None)
+    d1, d2, d3, d4 = st.columns([2, 2, 1, 1])
+    with d1:
+        a_id = st.selectbox("A", ids, index=min(1, len(ids) - 1), format_func=lambda i: _entry_label(by_id[i]), key="rep_diff_a")
+    with d2:
+        b_id = st.selectbox("B", ids, index=0, format_func=lambda i: _entry_label(by_id[i]), key="rep_diff_b")
+    with d3:
+        target = st.radio("比較対象", ["Response", "Request"], key="rep_diff_target")
+    with d4:
+        context = st.number_input("前後の行数", min_value=0, max_value=50, value=3, step=1, key="rep_diff_context")
+
+    ea, eb = by_id[a_id], by_id[b_id]
+    hash_key = "resp_hash" if target == "Response" else "req_hash"
+    if ea[hash_key] == eb[hash_key]:
+        # 内容アドレスなので hash が同じなら中身も同じ（読み出し不要）
+        st.success(f"#{a_id} と #{b_id} の {target} は同一です。")
+    else:
+        # 差分は押したときだけ計算（Send 直後の再描画で毎回走らせない）
+        diff_key = (ea[hash_key], eb[hash_key], int(context))
+        if st.button("🔍 差分を表示", key="rep_diff_run"):
+            st.session_state.rep_diff_shown = diff_key
+        if st.session_state.get("rep_diff_shown") != diff_key:
+            st.caption("A / B を選んで「差分を表示」を押してください。")
+        else:
+            with st.spinner("差分を計算中..."):
+                rows = _cached_side_by_side(history.root, *diff_key)
+            _render_diff_rows(rows)
+
+    if st.button("🗑 履歴を消去", key="rep_history_clear"):
+        history.clear()
+        st.session_state.zap_repeater_last_id = None
+        st.rerun()
+
+
+def _render_diff_rows(rows):
+    n_del = sum(1 for r in rows if r["op"] in ("-", "~"))
+    n_ins = sum(1 for r in rows if r["op"] in ("+", "~"))
+    st.caption(f"A: -{n_del} 行 / B: +{n_ins} 行（~ は変更行）")
+    st.dataframe(rows, use_container_width=True, hide_index=True, height=420)
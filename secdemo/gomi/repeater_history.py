@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from secdemo.paths import data_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    sent_at    REAL NOT NULL,
+    method     TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    status     TEXT NOT NULL,
+    elapsed_ms INTEGER NOT NULL,
+    req_hash   TEXT NOT NULL,
+    resp_hash  TEXT NOT NULL,
+    resp_size  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash        TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+"""
+
+# 残す履歴の件数（古いものから消し、参照されなくなった blob も消す）
+MAX_ENTRIES = 500
+
+
+def _blob_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _read_blob(path: str) -> str:
+    # blob は内容アドレスで不変なのでパスでキャッシュしてよい
+    with open(path, "rb") as f:
+        return zlib.decompress(f.read()).decode("utf-8", errors="replace")
+
+
+class RepeaterHistory:
+    """
+    Repeater の送信履歴（secdemo_data/repeater/）。
+    - history.sqlite3: 送信ごとの行（method / url / status / 所要時間 / request・response の hash）
+    - blobs/xx/<sha256>: request / response 本文を zlib 圧縮して内容アドレスで保存
+      同じ内容は1つしか置かないので、同じ応答を何度送っても容量は増えない
+    """
+
+    def __init__(self, root: Optional[str] = None, max_entries: int = MAX_ENTRIES):
+        self.root = root or data_dir("repeater")
+        self.blob_dir = os.path.join(self.root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db_path = os.path.join(self.root, "history.sqlite3")
+        self.max_entries = max_entries
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ----------------------------
+    # Blobs
+    # ----------------------------
+
+    def _blob_path(self, h: str) -> str:
+        return os.path.join(self.blob_dir, h[:2], h)
+
+    def _put_blob(self, con: sqlite3.Connection, text: str) -> str:
+        h = _blob_hash(text)
+        if con.execute("SELECT 1 FROM blobs WHERE hash = ?", (h,)).fetchone() and os.path.exists(self._blob_path(h)):
+            return h
+        raw = text.encode("utf-8", errors="replace")
+        packed = zlib.compress(raw, 6)
+        path = self._blob_path(h)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        con.execute("INSERT OR REPLACE INTO blobs (hash, size, stored_size) VALUES (?, ?, ?)", (h, len(raw), len(packed)))
+        return h
+
+    def blob(self, h: str) -> str:
+        if not h:
+            return ""
+        try:
+            return _read_blob(self._blob_path(h))
+        except FileNotFoundError:
+            return ""
+
+    # ----------------------------
+    # Entries
+    # ----------------------------
+
+    def add(self, raw_request: str, response: str, method: str = "", url: str = "", status: str = "", elapsed_ms: int = 0) -> int:
+        with self._connect() as con:
+            req_hash = self._put_blob(con, raw_request or "")
+            resp_hash = self._put_blob(con, response or "")
+            cur = con.execute(
+                "INSERT INTO entries (sent_at, method, url, status, elapsed_ms, req_hash, resp_hash, resp_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), method, url, status, int(elapsed_ms), req_hash, resp_hash, len((response or "").encode("utf-8", errors="replace"))),
+            )
+            entry_id = cur.lastrowid
+            self._prune(con)
+        return entry_id
+
+    def _prune(self, con: sqlite3.Connection) -> None:
+        count = con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        con.execute(
+            "DELETE FROM entries WHERE id IN (SELECT id FROM entries ORDER BY id ASC LIMIT ?)",
+            (count - self.max_entries,),
+        )
+        orphans = [h for (h,) in con.execute(
+            "SELECT hash FROM blobs WHERE hash NOT IN (SELECT req_hash FROM entries UNION SELECT resp_hash FROM entries)"
+        )]
+        for h in orphans:
+            try:
+                os.remove(self._blob_path(h))
+            except OSError:
+                pass
+        con.executemany("DELETE FROM blobs WHERE hash = ?", [(h,) for h in orphans])
+
+    def list(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """新しい順"""
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            cur = con.execute("SELECT * FROM entries ORDER BY id DESC LIMIT ? OFFSET ?", (int(limit), int(offset)))
+            return [dict(r) for r in cur]
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            r = con.execute("SELECT * FROM entries WHERE id = ?", (int(entry_id),)).fetchone()
+        return dict(r) if r else None
+
+    def request(self, entry: Dict[str, Any]) -> str:
+        return self.blob(entry.get("req_hash", ""))
+
+    def response(self, entry: Dict[str, Any]) -> str:
+        return self.blob(entry.get("resp_hash", ""))
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as con:
+            entries = con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            blobs, raw, stored = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()
+        return {"entries": entries, "blobs": blobs, "bytes": raw, "stored_bytes": stored}
+
+    def clear(self) -> None:
+        with self._connect() as con:
+            hashes = [h for (h,) in con.execute("SELECT hash FROM blobs")]
+            con.execute("DELETE FROM entries")
+            con.execute("DELETE FROM blobs")
+        for h in hashes:
+            try:
+                os.remove(self._blob_path(h))
+            except OSError:
+                pass
+
+
+# ----------------------------
+# Line diff（Myers）
+# ----------------------------
+
+# (tag, a_start, a_end, b_start, b_end)  tag: equal / delete / insert
+Opcode = Tuple[str, int, int, int, int]
+
+# 編集距離がこれを超えたら残りは「まとめて置換」とみなす（巨大な差分で止まらないように）
+# 戻り用の trace は O(D^2)、走査は O(D(N+M)) なので両方に上限を置く
+MAX_EDIT_DISTANCE = 1000
+MAX_DIFF_WORK = 5_000_000
+
+
+def _myers_edits(a: Sequence[int], b: Sequence[int], max_d: int) -> Optional[List[Tuple[str, int, int]]]:
+    """
+    Myers の O((N+M)D) 差分。(tag, a_idx, b_idx) を1行ずつ返す。max_d を超えたら None。
+    戻り用には各 d で使う対角線の範囲（-d-1 .. d+1）だけを写して持つ。
+    """
+    n, m = len(a), len(b)
+    offset = n + m + 1
+    v = [0] * (2 * offset + 2)
+    trace: List[List[int]] = []
+    for d in range(0, min(n + m, max_d) + 1):
+        trace.append(v[offset - d - 1 : offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m, d)
+    return None
+
+
+def _backtrack(trace: List[List[int]], n: int, m: int, d_end: int) -> List[Tuple[str, int, int]]:
+    edits: List[Tuple[str, int, int]] = []
+    x, y = n, m
+    for d in range(d_end, 0, -1):
+        snap = trace[d]
+        base = d + 1  # snap[base + k] == v[k]
+        k = x - y
+        if k == -d or (k != d and snap[base + k - 1] < snap[base + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = snap[base + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            edits.append(("equal", x, y))
+        if x == prev_x:
+            y -= 1
+            edits.append(("insert", x, y))
+        else:
+            x -= 1
+            edits.append(("delete", x, y))
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        edits.append(("equal", x, y))
+    edits.reverse()
+    return edits
+
+
+def diff_lines(a: Sequence[str], b: Sequence[str], max_d: int = MAX_EDIT_DISTANCE) -> List[Opcode]:
+    """
+    行単位の差分を opcodes で返す。
+    共通の先頭・末尾を先に落とし、行は整数 ID にしてから Myers で比べる。
+    """
+    n, m = len(a), len(b)
+    pre = 0
+    while pre < n and pre < m and a[pre] == b[pre]:
+        pre += 1
+    suf = 0
+    while suf < n - pre and suf < m - pre and a[n - 1 - suf] == b[m - 1 - suf]:
+        suf += 1
+
+    ids: Dict[str, int] = {}
+    mid_a = [ids.setdefault(s, len(ids)) for s in a[pre : n - suf]]
+    mid_b = [ids.setdefault(s, len(ids)) for s in b[pre : m - suf]]
+
+    ops: List[Opcode] = []
+
+    def _push(tag: str, a0: int, a1: int, b0: int, b1: int) -> None:
+        if a0 == a1 and b0 == b1:
+            return
+        if ops and ops[-1][0] == tag:
+            t, pa0, _, pb0, _ = ops[-1]
+            ops[-1] = (t, pa0, a1, pb0, b1)
+        else:
+            ops.append((tag, a0, a1, b0, b1))
+
+    _push("equal", 0, pre, 0, pre)
+    work = len(mid_a) + len(mid_b)
+    if work:
+        max_d = min(max_d, max(1, MAX_DIFF_WORK // work))
+    edits = _myers_edits(mid_a, mid_b, max_d)
+    if edits is None:
+        _push("delete", pre, n - suf, pre, pre)
+        _push("insert", n - suf, n - suf, pre, m - suf)
+    else:
+        for tag, i, j in edits:
+            ai, bj = pre + i, pre + j
+            if tag == "equal":
+                _push("equal", ai, ai + 1, bj, bj + 1)
+            elif tag == "delete":
+                _push("delete", ai, ai + 1, bj, bj)
+            else:
+                _push("insert", ai, ai, bj, bj + 1)
+    _push("equal", n - suf, n, m - suf, m)
+    return ops
+
+
+def side_by_side(a: Sequence[str], b: Sequence[str], context: int = 3, max_d: int = MAX_EDIT_DISTANCE) -> List[Dict[str, Any]]:
+    """
+    左右並べて表示する行を作る。削除と挿入が続く箇所は同じ行に並べ、
+    変更のない部分は前後 context 行だけ残して「… n 行省略」にまとめる。
+    """
+    ops = diff_lines(a, b, max_d)
+    rows: List[Dict[str, Any]] = []
+
+    def _row(tag: str, i: Optional[int], j: Optional[int]) -> Dict[str, Any]:
+        return {
+            "op": tag,
+            "A#": "" if i is None else i + 1,
+            "A": "" if i is None else a[i],
+            "B#": "" if j is None else j + 1,
+            "B": "" if j is None else b[j],
+        }
+
+    k = 0
+    while k < len(ops):
+        tag, a0, a1, b0, b1 = ops[k]
+        if tag == "equal":
+            length = a1 - a0
+            head = context if k > 0 else 0
+            tail = context if k < len(ops) - 1 else 0
+            if length <= head + tail + 1:
+                rows.extend(_row(" ", a0 + t, b0 + t) for t in range(length))
+            else:
+                rows.extend(_row(" ", a0 + t, b0 + t) for t in range(head))
+                rows.append({"op": "…", "A#": "", "A": f"… {length - head - tail} 行省略", "B#": "", "B": ""})
+                rows.extend(_row(" ", a1 - tail + t, b1 - tail + t) for t in range(tail))
+            k += 1
+            continue
+
+        # delete の直後の insert は置換として横に並べる
+        dels = list(range(a0, a1)) if tag == "delete" else []
+        ins = list(range(b0, b1)) if tag == "insert" else []
+        if tag == "delete" and k + 1 < len(ops) and ops[k + 1][0] == "insert":
+            ins = list(range(ops[k + 1][3], ops[k + 1][4]))
+            k += 1
+        for t in range(max(len(dels), len(ins))):
+            i = dels[t] if t < len(dels) else None
+            j = ins[t] if t < len(ins) else None
+            rows.append(_row("~" if i is not None and j is not None else ("-" if j is None else "+"), i, j))
+        k += 1
+    return rows
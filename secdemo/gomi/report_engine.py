@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import List, Dict, Any, Optional
 
+from secdemo.prompt_budget import PromptSection, build_prompt
 
 
 
@@ -102,20 +103,21 @@ def build_combined_prompt(
     intruder_results: Optional[List[Dict[str, Any]]] = None,
     quick_ai_summary: Optional[Dict[str, Any]] = None,
     quick_ai_raw: str = "",
+    max_tokens: int = 12000,
 ) -> str:
     base = build_zap_prompt(alerts_used, report_title, report_scope, extra_instructions)
 
-    lines = [base]
-    lines.append("")
-    lines.append("---")
-    lines.append("## 追加入力（手動検査/補助ツール）")
+    # 予算が足りないときは QuickCheck 生出力 → Intruder 差分（後ろの行から）の順に削る
+    sections = [
+        PromptSection("base", fixed=True, text=base),
+        PromptSection("extra", fixed=True, text="---\n## 追加入力（手動検査/補助ツール）"),
+    ]
 
     # Intruder
     intruder_results = intruder_results or []
     if intruder_results:
-        lines.append("")
-        lines.append("### Intruder結果（差分のあるもの中心）")
-        for r in intruder_results[:200]:
+        lines = []
+        for r in intruder_results:
             diffs = []
             if r.get("d_status"):
                 diffs.append("status差分")
@@ -128,38 +130,48 @@ def build_combined_prompt(
             if not diffs:
                 continue
 
-            lines.append(f"- no={r.get('no')} param={r.get('param')} payload={repr(r.get('payload'))}")
-            lines.append(f"  - status={r.get('status')} length={r.get('length')}")
-            lines.append(f"  - diff={'; '.join(diffs)}")
+            lines.append(
+                f"- no={r.get('no')} param={r.get('param')} payload={repr(r.get('payload'))}\n"
+                f"  - status={r.get('status')} length={r.get('length')}\n"
+                f"  - diff={'; '.join(diffs)}"
+            )
+        sections.append(PromptSection(
+            "intruder",
+            header="### Intruder結果（差分のあるもの中心）",
+            items=lines,
+            priority=60,
+            min_tokens=300,
+        ))
 
     else:
-        lines.append("")
-        lines.append("### Intruder結果")
-        lines.append("(なし)")
+        sections.append(PromptSection("intruder", fixed=True, text="### Intruder結果\n(なし)"))
 
     # QuickCheck (AI summary)
     if quick_ai_summary:
-        lines.append("")
-        lines.append("### QuickCheck結果（AI要約JSON）")
-        lines.append("```json")
         import json as _json
-        lines.append(_json.dumps(quick_ai_summary, ensure_ascii=False, indent=2))
-        lines.append("```")
+        sections.append(PromptSection(
+            "quick",
+            fixed=True,
+            text="### QuickCheck結果（AI要約JSON）\n```json\n"
+            + _json.dumps(quick_ai_summary, ensure_ascii=False, indent=2)
+            + "\n```",
+        ))
     elif quick_ai_raw:
-        lines.append("")
-        lines.append("### QuickCheck結果（生出力）")
-        lines.append("```")
-        lines.append(quick_ai_raw[:12000])
-        lines.append("```")
+        sections.append(PromptSection("quick_head", fixed=True, text="### QuickCheck結果（生出力）"))
+        sections.append(PromptSection("quick", header="```", text=quick_ai_raw, priority=20, min_tokens=300))
+        sections.append(PromptSection("quick_end", fixed=True, text="```"))
     else:
-        lines.append("")
-        lines.append("### QuickCheck結果")
-        lines.append("(なし)")
-
-    lines.append("")
-    lines.append("## 統合出力要件（追加）")
-    lines.append("- ZAPアラートに加えて、Intruder/QuickCheckで得た“差分”や“根拠”も引用して報告に反映する")
-    lines.append("- ただし、確証が弱いものは「要追加確認」と明示する")
-    lines.append("- 報告書末尾に「実行した検査（コマンド/手順）」の章を作る")
-
-    return "\n".join(lines)
+        sections.append(PromptSection("quick", fixed=True, text="### QuickCheck結果\n(なし)"))
+
+    sections.append(PromptSection(
+        "tail",
+        fixed=True,
+        text="\n".join([
+            "## 統合出力要件（追加）",
+            "- ZAPアラートに加えて、Intruder/QuickCheckで得た“差分”や“根拠”も引用して報告に反映する",
+            "- ただし、確証が弱いものは「要追加確認」と明示する",
+            "- 報告書末尾に「実行した検査（コマンド/手順）」の章を作る",
+        ]),
+    ))
+
+    return build_prompt(sections, max_tokens)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+# 64bit simhash
+FP_BITS = 64
+# 指紋を取るのは本文の先頭だけ（巨大なレスポンスで時間を食わないように）
+MAX_FP_CHARS = 200_000
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_\-]+|[^\sA-Za-z0-9_\-]")
+# 数字を含む / 長い16進・base64 風のトークン（タイムスタンプ、CSRF トークン、セッションID など）は1つに潰す
+_VOLATILE_RE = re.compile(r"\d|^[A-Za-z0-9_\-]{24,}$|^[0-9a-fA-F]{8,}$")
+
+
+def _tokens(text: str) -> List[str]:
+    out = []
+    for t in _TOKEN_RE.findall(text.lower()):
+        out.append("#" if _VOLATILE_RE.search(t) else t)
+    return out
+
+
+def _hash64(s: str) -> int:
+    # 組み込み hash() はプロセスごとに変わるので使わない（保存した指紋と比べられるように）
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8", errors="ignore"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """
+    本文のトークン shingle（連続 n 個）から 64bit simhash を作る。
+    近い本文ほどハミング距離が小さい。揮発するトークンは正規化してから数える。
+    """
+    toks = _tokens((text or "")[:MAX_FP_CHARS])
+    if not toks:
+        return 0
+    if len(toks) < shingle:
+        shingles = Counter([" ".join(toks)])
+    else:
+        shingles = Counter(" ".join(toks[i : i + shingle]) for i in range(len(toks) - shingle + 1))
+
+    v = [0] * FP_BITS
+    for sh, w in shingles.items():
+        h = _hash64(sh)
+        for b in range(FP_BITS):
+            if (h >> b) & 1:
+                v[b] += w
+            else:
+                v[b] -= w
+    fp = 0
+    for b in range(FP_BITS):
+        if v[b] > 0:
+            fp |= 1 << b
+    return fp
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimhashClusterer:
+    """
+    simhash を逐次クラスタリングする（代表点クラスタリング + LSH）。
+    - 64bit を bands 個の帯に分け、どれかの帯が一致する代表だけを候補にする
+      （bands > max_distance なら、距離 max_distance 以内の代表は必ずどこかの帯で一致する）
+    - 候補の中で最も近い代表のクラスタへ入れる。無ければ新しいクラスタ
+    - 1件あたり候補の数だけ比較するので全体はほぼ線形。クラスタ ID は一度振ったら変わらない
+    - key（status など）が違うものは別クラスタ
+    """
+
+    def __init__(self, max_distance: int = 3, bands: int = 4):
+        if bands <= max_distance:
+            raise ValueError("bands must be greater than max_distance")
+        self.max_distance = max_distance
+        self._bands = bands
+        self._band_bits = FP_BITS // bands
+        self._mask = (1 << self._band_bits) - 1
+        self._buckets: Dict[Tuple[Hashable, int, int], List[int]] = {}
+        self.leaders: List[int] = []
+        self.sizes: List[int] = []
+
+    def _band_keys(self, fp: int, key: Hashable) -> List[Tuple[Hashable, int, int]]:
+        return [(key, i, (fp >> (i * self._band_bits)) & self._mask) for i in range(self._bands)]
+
+    def add(self, fp: int, key: Hashable = None) -> int:
+        """指紋を追加してクラスタ ID を返す"""
+        bkeys = self._band_keys(fp, key)
+        best: Optional[int] = None
+        best_d = self.max_distance + 1
+        for bk in bkeys:
+            for cid in self._buckets.get(bk, ()):
+                d = hamming(fp, self.leaders[cid])
+                if d < best_d:
+                    best, best_d = cid, d
+        if best is not None:
+            self.sizes[best] += 1
+            return best
+
+        cid = len(self.leaders)
+        self.leaders.append(fp)
+        self.sizes.append(1)
+        for bk in bkeys:
+            self._buckets.setdefault(bk, []).append(cid)
+        return cid
+
+
+# ----------------------------
+# 外れクラスタ
+# ----------------------------
+
+def outlier_clusters(
+    sizes: Mapping[int, int],
+    normal: Iterable[int] = (),
+    max_ratio: float = 0.05,
+) -> List[int]:
+    """
+    クラスタごとの件数から「少数派」のクラスタを返す（小さい順）。
+    - normal（baseline のクラスタなど）は外れにしない
+    - 全体の max_ratio 以下（最低1件）のクラスタを外れとみなす
+    """
+    total = sum(sizes.values())
+    if not total:
+        return []
+    limit = max(1, int(total * max_ratio))
+    skip = set(normal)
+    return sorted((c for c, n in sizes.items() if n <= limit and c not in skip), key=lambda c: (sizes[c], c))
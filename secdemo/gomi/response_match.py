@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+try:  # Python 3.11+
+    from re import _parser as _sre_parse
+except ImportError:  # pragma: no cover
+    import sre_parse as _sre_parse  # type: ignore[no-redef]
+
+
+# 結合すると意味が変わる / コンパイルできなくなるパターン（番号・名前付き後方参照、名前付きグループ、インラインフラグ）
+_UNSAFE_TO_COMBINE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?<[^=!]|\(\?[aiLmsux-]+[:)]")
+
+_STATUS_RE = re.compile(r"^HTTP/\d(?:\.\d)?\s+(\d{3})")
+
+# 1パターンあたりに覚えておくヒット位置の数
+MAX_OFFSETS = 5
+
+
+def _min_width(pattern: str, flags: int) -> int:
+    # 空文字に一致しうる（幅 0 の）パターンは先読みにまとめると全位置で当たるので結合しない
+    try:
+        return _sre_parse.parse(pattern, flags).getwidth()[0]
+    except Exception:
+        return 0
+
+
+class ResponseMatcher:
+    """
+    Intruder の差分検出 regex を1回だけコンパイルし、レスポンスごとに1パスで走査する。
+    - 結合できるパターンは (?=A|B|..)(?=(?P<p0>A)?)(?=(?P<p1>B)?).. の1本にまとめる
+      （同じ位置から始まる一致も隠れない。件数・位置は m.start(グループ) からそのまま取る）
+    - 後方参照やインラインフラグを含むもの、空文字に一致しうるものは個別に compile して別走査
+    - 不正なパターンは常に False（従来どおり）
+    件数は finditer と同じ（パターンごとに重ならない一致を数える）。
+    """
+
+    def __init__(self, patterns: List[str], flags: int = re.IGNORECASE):
+        self.patterns: List[str] = []
+        self.invalid: List[str] = []
+        self._single: Dict[str, "re.Pattern[str]"] = {}
+        combinable: List[Tuple[str, str]] = []
+
+        for p in patterns:
+            p = (p or "").strip()
+            if not p or p in self._single or p in self.invalid:
+                continue
+            try:
+                rx = re.compile(p, flags)
+            except re.error:
+                self.invalid.append(p)
+                continue
+            self.patterns.append(p)
+            self._single[p] = rx
+            if not _UNSAFE_TO_COMBINE.search(p) and _min_width(p, flags) > 0:
+                combinable.append((f"p{len(combinable)}", p))
+
+        self._group_to_pattern = dict(combinable)
+        self._combined: Optional["re.Pattern[str]"] = None
+        if len(combinable) > 1:
+            # 先頭の (?=A|B|..) でどれかが当たる位置だけに絞り、そこで各パターンを先読みで試す
+            gate = "|".join(f"(?:{p})" for _, p in combinable)
+            groups = "".join(f"(?=(?P<{g}>{p})?)" for g, p in combinable)
+            try:
+                self._combined = re.compile(f"(?={gate}){groups}", flags)
+            except re.error:
+                self._combined = None
+        if self._combined is None:
+            self._group_to_pattern = {}
+        self._separate = [p for p in self.patterns if p not in self._group_to_pattern.values()]
+
+    @staticmethod
+    def _scan_one(rx: "re.Pattern[str]", text: str) -> Dict[str, Any]:
+        count = 0
+        offsets: List[int] = []
+        for m in rx.finditer(text):
+            count += 1
+            if len(offsets) < MAX_OFFSETS:
+                offsets.append(m.start())
+        return {"count": count, "offsets": offsets}
+
+    def scan(self, text: str) -> Dict[str, Dict[str, Any]]:
+        """パターン -> {"count": ヒット数, "offsets": 先頭 MAX_OFFSETS 件の位置}"""
+        text = text or ""
+        out: Dict[str, Dict[str, Any]] = {p: {"count": 0, "offsets": []} for p in self.patterns}
+        for p in self.invalid:
+            out[p] = {"count": 0, "offsets": [], "invalid": True}
+
+        if self._combined is not None:
+            # パターンごとに直前の一致の終わりを覚え、それより前から始まる一致は数えない（finditer と同じ）
+            last_end = {g: 0 for g in self._group_to_pattern}
+            for m in self._combined.finditer(text):
+                for g, p in self._group_to_pattern.items():
+                    start = m.start(g)
+                    if start < 0 or start < last_end[g]:
+                        continue
+                    last_end[g] = m.end(g)
+                    info = out[p]
+                    info["count"] += 1
+                    if len(info["offsets"]) < MAX_OFFSETS:
+                        info["offsets"].append(start)
+
+        for p in self._separate:
+            out[p] = self._scan_one(self._single[p], text)
+        return out
+
+    @staticmethod
+    def hits(scan: Dict[str, Dict[str, Any]]) -> Dict[str, bool]:
+        return {p: info["count"] > 0 for p, info in scan.items()}
+
+
+# ----------------------------
+# Status / length（ZAP メッセージから）
+# ----------------------------
+
+def status_and_length(message: Dict[str, Any]) -> Tuple[str, int]:
+    """
+    ZAP のメッセージ（responseHeader / responseBody）から (status, body の長さ) を返す。
+    長さは ZAP が返した本文を常に同じ方法で測る（ZAP の長さ項目があればそれ、無ければ responseBody のバイト数）。
+    Content-Length は gzip だと圧縮後の値、chunked だと無いので使わない。
+    """
+    header = message.get("responseHeader", "") or ""
+    m = _STATUS_RE.match(header)
+    status = m.group(1) if m else ""
+
+    for key in ("responseBodyLength", "responseLength"):
+        v = message.get(key)
+        if v not in (None, ""):
+            try:
+                return status, int(v)
+            except (TypeError, ValueError):
+                pass
+
+    body = message.get("responseBody", "") or ""
+    return status, len(body) if body.isascii() else len(body.encode("utf-8", errors="ignore"))
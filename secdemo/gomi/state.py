@@ -20,7 +20,7 @@ def init_session():
         "zap_selected_msgid": "",
         "zap_selected_message": None,
         "zap_repeater_request": "",
-        "zap_repeater_response": "",
+        "zap_repeater_last_id": None,
         "zap_alerts_cache": None,
 
         "auto_refresh_on": False,
@@ -33,7 +33,7 @@ def init_session():
         "generated_md": "",
         "edited_md": "",
 
-        "intruder_results": [],
+        "intruder_run": None,
 
         "ui_show_browser_tab": False,
         "ui_global_alerts_bar": True,
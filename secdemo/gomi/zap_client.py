@@ -1,14 +1,32 @@
+import threading
 from typing import Any, Dict, List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 
 
+# ZAP への接続はプロセスで1つの Session を共有（keep-alive。Intruder の並列送信でも接続を使い回す）
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+POOL_MAXSIZE = 32
+
+
+def _session() -> requests.Session:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _SESSION = s
+        return _SESSION
 
 def zap_json_get(base: str, path: str, apikey: str = "", params: Optional[Dict[str, Any]] = None, timeout: int = 20):
     params = dict(params or {})
     if apikey:
         params["apikey"] = apikey
     url = base.rstrip("/") + path
-    r = requests.get(url, params=params, timeout=timeout)
+    r = _session().get(url, params=params, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
@@ -105,9 +123,3 @@ def ascan_status(base: str, apikey: str, scan_id: str) -> int:
         return int(data.get("status", 0))
     except Exception:
         return 0
-
-async def messages(self, baseurl: str | None = None, start: int = 0, count: int = 200):
-    params = {"start": start, "count": count}
-    if baseurl:
-        params["baseurl"] = baseurl
-    return await self._get_json("/JSON/core/view/messages/", params=params)
@@ -0,0 +1,110 @@
+# secdemo/history_sync.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from secdemo.zap_live_client import ZapLiveClient
+
+
+def _msg_id(m: Dict[str, Any]) -> int:
+    try:
+        return int(m.get("id"))
+    except Exception:
+        return -1
+
+
+class _SiteState:
+    def __init__(self, maxlen: int):
+        self.offset = 0  # ZAP側で取り込み済みのメッセージ数
+        self.last_id = -1  # 取り込み済みの最大 message id
+        self.items: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+
+
+class HistorySync:
+    """
+    ZAP履歴の差分同期。
+    - サイトごとに「取り込み済み件数 / 最大id」を覚え、新しいメッセージだけ start= で取得
+    - 変換済みの履歴は maxlen 件のリングバッファに保持（rerun をまたいで session_state に置く）
+    """
+
+    def __init__(self, page_size: int = 200):
+        self.page_size = page_size
+        self._sites: Dict[Tuple[str, str], _SiteState] = {}
+        # 締め切り超過で前回の同期がまだ走っている場合に備えて直列化する
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+
+    def _state(self, zap_base: str, site: str, maxlen: int) -> _SiteState:
+        key = (zap_base, site)
+        s = self._sites.get(key)
+        if s is None or (s.items.maxlen or 0) < maxlen:
+            # 窓を広げた場合は古い分を取り直す
+            s = _SiteState(maxlen)
+            self._sites[key] = s
+        elif s.items.maxlen != maxlen:
+            s.items = deque(s.items, maxlen=maxlen)
+        return s
+
+    def sync(
+        self,
+        z: ZapLiveClient,
+        baseurl: Optional[str],
+        maxlen: int,
+        to_item: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._sync(z, baseurl, maxlen, to_item)
+
+    def _sync(
+        self,
+        z: ZapLiveClient,
+        baseurl: Optional[str],
+        maxlen: int,
+        to_item: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        s = self._state(z.zap_base, baseurl or "", maxlen)
+
+        try:
+            total = z.number_of_messages(baseurl=baseurl)
+        except Exception:
+            # numberOfMessages が使えない環境：窓ぶん取得して id で差分だけ取り込む
+            self._merge(s, z.messages(baseurl=baseurl, count=maxlen), to_item)
+            return list(s.items)
+
+        if total < s.offset:
+            # ZAPセッションが新しくなった（履歴が減った）→ 取り直し
+            s = _SiteState(maxlen)
+            self._sites[(z.zap_base, baseurl or "")] = s
+
+        # 窓より古い分は取らない。1件重ねて取得し id で重複排除（start の基数差を吸収）
+        start = max(s.offset, total - maxlen, 0)
+        while start < total:
+            count = min(self.page_size, total - start) + 1
+            page = z.messages(baseurl=baseurl, start=start, count=count)
+            if not page:
+                break
+            self._merge(s, page, to_item)
+            if len(page) < count:
+                break
+            start += count - 1
+
+        s.offset = total
+        return list(s.items)
+
+    @staticmethod
+    def _merge(
+        s: _SiteState,
+        msgs: List[Dict[str, Any]],
+        to_item: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> None:
+        for m in msgs:
+            mid = _msg_id(m)
+            if mid <= s.last_id:
+                continue
+            s.items.append(to_item(m))
+            s.last_id = mid
@@ -0,0 +1,162 @@
+# secdemo/llm_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from secdemo.ai_ollama import OllamaChatClient
+from secdemo.paths import data_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key        TEXT PRIMARY KEY,
+    model      TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used);
+"""
+
+
+class LlmCache:
+    """
+    LLM 応答のローカル永続キャッシュ（SQLite, secdemo_data/llm_cache.sqlite3）。
+    キーは (prompt, model, temperature, system) のハッシュ。
+    件数 / 合計サイズの上限を超えたら last_used の古いものから消す（LRU）。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = 5000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = path or os.path.join(data_dir(), "llm_cache.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # 呼び出しごとに接続（ワーカースレッドからも安全に使える）
+        con = sqlite3.connect(self.path, timeout=10)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float, system: Optional[str]) -> str:
+        raw = json.dumps([prompt, model, round(float(temperature), 4), system or ""], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as con:
+            row = con.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, model: str, value: str) -> None:
+        if not value:
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, size, now, now),
+            )
+            self._evict(con)
+
+    def _evict(self, con: sqlite3.Connection) -> None:
+        count, total = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 古い順に、上限の 9 割まで減らす
+        target_entries = int(self.max_entries * 0.9)
+        target_bytes = int(self.max_bytes * 0.9)
+        drop: List[str] = []
+        for key, size in con.execute("SELECT key, size FROM llm_cache ORDER BY last_used ASC"):
+            if count <= target_entries and total <= target_bytes:
+                break
+            drop.append(key)
+            count -= 1
+            total -= size
+        con.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in drop])
+
+    def clear(self) -> None:
+        with self._connect() as con:
+            con.execute("DELETE FROM llm_cache")
+
+
+_DEFAULT: Optional[LlmCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_llm_cache() -> LlmCache:
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = LlmCache()
+        return _DEFAULT
+
+
+# -------------------------
+# chat / chat_stream のキャッシュ付きラッパ
+# -------------------------
+def _cache_key(messages: List[Dict[str, str]], model: str, temperature: float, system: Optional[str]) -> str:
+    prompt = OllamaChatClient._build_prompt(messages, None)
+    return LlmCache.make_key(prompt, model, temperature, system)
+
+
+def cached_chat(
+    client: OllamaChatClient,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.2,
+    system: Optional[str] = None,
+    cache: Optional[LlmCache] = None,
+) -> str:
+    cache = cache or default_llm_cache()
+    key = _cache_key(messages, model, temperature, system)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    text = client.chat(model=model, messages=messages, temperature=temperature, system=system)
+    cache.put(key, model, text)
+    return text
+
+
+def cached_chat_stream(
+    client: OllamaChatClient,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.2,
+    system: Optional[str] = None,
+    cache: Optional[LlmCache] = None,
+) -> Iterator[str]:
+    """ヒットすれば全文を一度に返す。ミスなら流しながら溜め、最後まで届いたときだけ保存"""
+    cache = cache or default_llm_cache()
+    key = _cache_key(messages, model, temperature, system)
+    hit = cache.get(key)
+    if hit is not None:
+        yield hit
+        return
+    parts: List[str] = []
+    for token in client.chat_stream(model=model, messages=messages, temperature=temperature, system=system):
+        parts.append(token)
+        yield token
+    cache.put(key, model, "".join(parts))
@@ -0,0 +1,100 @@
+# secdemo/nmap_xml.py
+from __future__ import annotations
+
+import xml.etree.ElementTree as ET
+from typing import IO, Any, Dict, List, Union
+
+PORT_KEYS = ("host", "hostname", "port", "proto", "state", "service", "version")
+
+
+def _service_version(svc: ET.Element) -> str:
+    parts = [svc.get("product", ""), svc.get("version", ""), svc.get("extrainfo", "")]
+    return " ".join(p for p in parts if p)
+
+
+def _host_rows(host: ET.Element) -> List[Dict[str, Any]]:
+    addr = ""
+    for a in host.iter("address"):
+        if a.get("addrtype") in ("ipv4", "ipv6"):
+            addr = a.get("addr", "")
+            break
+    hn = host.find("hostnames/hostname")
+    hostname = hn.get("name", "") if hn is not None else ""
+
+    rows: List[Dict[str, Any]] = []
+    for p in host.iterfind("ports/port"):
+        st_el = p.find("state")
+        svc = p.find("service")
+        rows.append(
+            {
+                "host": addr,
+                "hostname": hostname,
+                "port": p.get("portid", ""),
+                "proto": p.get("protocol", ""),
+                "state": st_el.get("state", "") if st_el is not None else "",
+                "service": svc.get("name", "") if svc is not None else "",
+                "version": _service_version(svc) if svc is not None else "",
+            }
+        )
+    return rows
+
+
+def parse_nmap_xml(source: Union[str, IO[bytes]]) -> Dict[str, Any]:
+    """
+    nmap -oX の出力を iterparse で1ホストずつ読み、処理済みの要素は捨てる（/24 でもメモリが増えない）。
+    戻り値:
+      ports: [{host, hostname, port, proto, state, service, version}, ...]
+      hosts_up / hosts_total: runstats の値（途中で止まったスキャンでは数えた値）
+      complete: XML を最後まで読めたか（中止・タイムアウト時は False）
+    """
+    ports: List[Dict[str, Any]] = []
+    hosts_up = 0
+    hosts_seen = 0
+    hosts_total = None
+    complete = True
+
+    try:
+        for _, el in ET.iterparse(source, events=("end",)):
+            if el.tag == "host":
+                hosts_seen += 1
+                status = el.find("status")
+                if status is None or status.get("state") == "up":
+                    hosts_up += 1
+                ports.extend(_host_rows(el))
+                el.clear()
+            elif el.tag == "hosts" and el.get("total"):
+                hosts_up = int(el.get("up", hosts_up))
+                hosts_total = int(el.get("total"))
+    except ET.ParseError:
+        # 中止したスキャンは閉じタグが無い。読めた分だけ返す
+        complete = False
+
+    return {
+        "ports": ports,
+        "hosts_up": hosts_up,
+        "hosts_total": hosts_total if hosts_total is not None else hosts_seen,
+        "complete": complete,
+    }
+
+
+def format_port_table(scan: Dict[str, Any], states: tuple = ("open",)) -> str:
+    """
+    LLM に渡すための簡潔な表（1ホスト1行、指定 state のポートだけ）。
+    例: 10.0.0.5 (web01): 22/tcp ssh OpenSSH 8.9p1; 443/tcp https nginx 1.18.0
+    """
+    by_host: Dict[str, List[str]] = {}
+    for r in scan.get("ports", []):
+        if states and r["state"] not in states:
+            continue
+        label = f"{r['host']} ({r['hostname']})" if r["hostname"] else r["host"]
+        svc = " ".join(x for x in (r["service"], r["version"]) if x)
+        by_host.setdefault(label, []).append(f"{r['port']}/{r['proto']} {svc}".rstrip())
+
+    lines = [
+        f"hosts up: {scan.get('hosts_up', 0)} / {scan.get('hosts_total', 0)}"
+        + ("" if scan.get("complete", True) else "（スキャン途中で終了）"),
+        f"hosts with {'/'.join(states) or 'any'} ports: {len(by_host)}",
+    ]
+    for label, entries in by_host.items():
+        lines.append(f"{label}: " + "; ".join(entries))
+    return "\n".join(lines)
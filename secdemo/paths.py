@@ -0,0 +1,15 @@
+# secdemo/paths.py
+from __future__ import annotations
+
+import os
+
+
+def project_root() -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def data_dir(*parts: str) -> str:
+    """secdemo_data/（ローカル保存先）配下のディレクトリを作って返す"""
+    d = os.path.join(project_root(), "secdemo_data", *parts)
+    os.makedirs(d, exist_ok=True)
+    return d
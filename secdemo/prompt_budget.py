@@ -0,0 +1,218 @@
+# secdemo/prompt_budget.py
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from secdemo.ai_ollama import _shared_http_client
+
+# text -> トークン数
+Tokenizer = Callable[[str], int]
+
+
+# -------------------------
+# Tokenizers
+# -------------------------
+def heuristic_tokens(text: str) -> int:
+    """
+    依存なしの見積もり。ASCII は 4 文字 ≒ 1 トークン、日本語などは 1 文字 ≒ 1 トークン。
+    多めに見積もる側に倒している（溢れるよりは削りすぎの方がまし）。
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def tiktoken_tokenizer(encoding: str = "cl100k_base") -> Optional[Tokenizer]:
+    """tiktoken があればそれを使う（無ければ None）"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    enc = tiktoken.get_encoding(encoding)
+    return lambda text: len(enc.encode(text or "", disallowed_special=()))
+
+
+def llama_server_tokenizer(base_url: str, timeout: float = 5.0) -> Tokenizer:
+    """
+    llama-server の /tokenize で数える（実モデルの語彙なので正確）。
+    通信に失敗したら見積もりにフォールバックする。同じ文字列は覚えておく。
+    """
+    base = base_url.rstrip("/")
+    client = _shared_http_client(base)
+
+    @lru_cache(maxsize=4096)
+    def _count(text: str) -> int:
+        if not text:
+            return 0
+        try:
+            r = client.post(f"{base}/tokenize", json={"content": text}, timeout=timeout)
+            r.raise_for_status()
+            return len(r.json()["tokens"])
+        except Exception:
+            return heuristic_tokens(text)
+
+    return _count
+
+
+TOKENIZER_KINDS = ("heuristic", "tiktoken", "llama-server")
+
+_TOKENIZERS: Dict[Tuple[str, str], Tokenizer] = {}
+_TOKENIZER_LOCK = threading.Lock()
+
+
+def make_tokenizer(kind: str, base_url: str = "") -> Tokenizer:
+    """
+    kind ごとに1つだけ作って使い回す（llama-server のカウント結果キャッシュを活かすため）。
+    どれを使うかはセッションごとに決めて、呼び出し側が tokenizer 引数で渡す（モジュールの既定値は変えない）。
+    """
+    key = (kind, base_url.rstrip("/") if kind == "llama-server" else "")
+    with _TOKENIZER_LOCK:
+        tok = _TOKENIZERS.get(key)
+        if tok is None:
+            if kind == "tiktoken":
+                tok = tiktoken_tokenizer() or heuristic_tokens
+            elif kind == "llama-server" and base_url:
+                tok = llama_server_tokenizer(base_url)
+            else:
+                tok = heuristic_tokens
+            _TOKENIZERS[key] = tok
+        return tok
+
+
+def count_tokens(text: str, tokenizer: Optional[Tokenizer] = None) -> int:
+    return (tokenizer or heuristic_tokens)(text or "")
+
+
+# -------------------------
+# Truncation
+# -------------------------
+def truncate_text(
+    text: str,
+    max_tokens: int,
+    tokenizer: Optional[Tokenizer] = None,
+    note: str = "...（以下 {n} 文字省略）",
+) -> str:
+    """
+    text を max_tokens 以内に収める（行の途中では切らない）。
+    文字数の比で当たりを付けて数回だけ数え直すので、長い出力でも数える回数は少ない。
+    """
+    tok = tokenizer or heuristic_tokens
+    if not text or max_tokens <= 0:
+        return "" if max_tokens <= 0 else text
+    total = tok(text)
+    if total <= max_tokens:
+        return text
+
+    keep = int(len(text) * max_tokens / total)
+    for _ in range(6):
+        cut = text.rfind("\n", 0, keep)
+        head = text[: cut if cut > keep // 2 else keep]
+        out = head + "\n" + note.format(n=len(text) - len(head))
+        if tok(out) <= max_tokens or keep <= 0:
+            return out
+        keep = int(keep * 0.85)
+    return note.format(n=len(text))
+
+
+def fit_items(
+    items: List[str],
+    max_tokens: int,
+    tokenizer: Optional[Tokenizer] = None,
+    more_note: str = "- ...（他 {n} 件）",
+) -> List[str]:
+    """
+    先頭（価値の高い順に並べておく）から max_tokens に収まるだけ採る。
+    落とした件数は more_note で1行にまとめる。
+    行ごとには数えず、連結したテキストを二分探索で数える（llama-server でも数回の呼び出しで済む）。
+    """
+    tok = tokenizer or heuristic_tokens
+    n = len(items)
+
+    def _lines(k: int) -> List[str]:
+        return list(items[:k]) + ([more_note.format(n=n - k)] if k < n else [])
+
+    if not items or tok("\n".join(items)) <= max_tokens:
+        return list(items)
+    # 収まる最大の k を探す（k=0 は注記だけ）
+    lo, hi = 0, n - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if tok("\n".join(_lines(mid))) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return _lines(lo)
+
+
+# -------------------------
+# Section-based prompt assembly
+# -------------------------
+@dataclass
+class PromptSection:
+    """
+    プロンプトの1区画。
+    - text: まとまった本文（溢れたら末尾から切る）
+    - items: 1行ずつ落とせる項目（価値の高い順）
+    - priority: 大きいほど重要。予算が足りないときは小さい区画から削る
+    - min_tokens: 削るときでも最低限残す量
+    - fixed: True なら削らない（指示文など）
+    """
+
+    name: str
+    text: str = ""
+    items: List[str] = field(default_factory=list)
+    priority: int = 0
+    min_tokens: int = 0
+    fixed: bool = False
+    header: str = ""
+    more_note: str = "- ...（他 {n} 件）"
+
+    def render(self, max_tokens: Optional[int], tokenizer: Tokenizer) -> str:
+        if not self.items and not self.text:
+            return ""
+        parts = [self.header] if self.header else []
+        body_budget = None if max_tokens is None else max(0, max_tokens - tokenizer(self.header))
+        if self.items:
+            lines = self.items if body_budget is None else fit_items(self.items, body_budget, tokenizer, self.more_note)
+            parts.append("\n".join(lines))
+        elif self.text:
+            parts.append(self.text if body_budget is None else truncate_text(self.text, body_budget, tokenizer))
+        return "\n".join(parts)
+
+
+def build_prompt(
+    sections: List[PromptSection],
+    max_tokens: int,
+    tokenizer: Optional[Tokenizer] = None,
+    sep: str = "\n\n",
+) -> str:
+    """
+    区画を並び順どおりに連結し、合計を max_tokens に収める。
+    予算は priority の高い区画から必要な分だけ割り当て、足りなければ低い区画が削られる。
+    """
+    tok = tokenizer or heuristic_tokens
+    full = [s.render(None, tok) for s in sections]
+    need = [tok(t) for t in full]
+    sep_cost = tok(sep) * max(0, len(sections) - 1)
+    if sum(need) + sep_cost <= max_tokens:
+        return sep.join(full)
+
+    # 固定区画と各区画の最低限を先に確保し、残りを優先度順に配る
+    alloc = [need[i] if s.fixed else min(need[i], s.min_tokens) for i, s in enumerate(sections)]
+    left = max_tokens - sep_cost - sum(alloc)
+    for i in sorted(range(len(sections)), key=lambda i: -sections[i].priority):
+        if sections[i].fixed or left <= 0:
+            continue
+        extra = min(left, need[i] - alloc[i])
+        alloc[i] += extra
+        left -= extra
+
+    out = [
+        full[i] if alloc[i] >= need[i] else s.render(alloc[i], tok)
+        for i, s in enumerate(sections)
+    ]
+    return sep.join(t for t in out if t)
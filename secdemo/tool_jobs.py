@@ -0,0 +1,191 @@
+# secdemo/tool_jobs.py
+from __future__ import annotations
+
+import os
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from typing import IO, Dict, List, Optional, Tuple
+
+from secdemo.paths import data_dir
+
+
+class ToolJob:
+    """
+    外部ツール（nmap / sqlmap など）をバックグラウンドのサブプロセスで実行する。
+    - stdout / stderr は読み取りスレッドが1行ずつ、全量をログファイル（secdemo_data/tool_jobs/）へ、
+      直近 max_lines 行をリングバッファ（実行中の表示用）へ積む。最終結果は output() でファイルから読む
+    - UI は snapshot() で状態と途中までの出力をポーリングする（スクリプトはブロックしない）
+    - cancel() で terminate → 猶予後に kill
+    - スレッドは streamlit に触らない（session_state への反映は UI 側で行う）
+    """
+
+    def __init__(self, cmd: List[str], timeout_sec: Optional[float] = 300, max_lines: int = 5000):
+        self.id = uuid.uuid4().hex[:12]
+        self.cmd = list(cmd)
+        self.cmd_str = " ".join(self.cmd)
+        self.timeout_sec = timeout_sec
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self.returncode: Optional[int] = None
+        self.status = "running"  # running / done / failed / cancelled / timeout
+
+        self._lines: deque = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self.log_path = os.path.join(data_dir("tool_jobs"), f"{self.id}.log")
+        self._log: Optional[IO[str]] = open(self.log_path, "w", encoding="utf-8", errors="replace")
+
+        try:
+            self._proc: Optional[subprocess.Popen] = subprocess.Popen(
+                self.cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                text=True,
+                errors="replace",
+                bufsize=1,
+            )
+        except FileNotFoundError:
+            self._proc = None
+            self._append(f"COMMAND NOT FOUND: {self.cmd[0]}（PATHに存在しません）")
+            self._finish("failed", -2)
+            return
+
+        self._readers = [
+            threading.Thread(target=self._read, args=(self._proc.stdout,), daemon=True, name=f"tool-out-{self.id}"),
+            threading.Thread(target=self._read, args=(self._proc.stderr,), daemon=True, name=f"tool-err-{self.id}"),
+        ]
+        for t in self._readers:
+            t.start()
+        threading.Thread(target=self._watch, daemon=True, name=f"tool-wait-{self.id}").start()
+
+    # -------------------------
+    # Worker threads
+    # -------------------------
+    def _append(self, line: str) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.write(line + "\n")
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+
+    def _read(self, stream: IO[str]) -> None:
+        for line in iter(stream.readline, ""):
+            self._append(line.rstrip("\n"))
+        stream.close()
+
+    def _finish(self, status: str, returncode: Optional[int]) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self.status = status
+            self.returncode = returncode
+            self.ended_at = time.time()
+
+    def _watch(self) -> None:
+        try:
+            rc = self._proc.wait(timeout=self.timeout_sec)
+            status = "cancelled" if self._cancel.is_set() else ("done" if rc == 0 else "failed")
+        except subprocess.TimeoutExpired:
+            self._stop()
+            rc = self._proc.returncode
+            status = "timeout"
+            self._append(f"TIMEOUT: {self.timeout_sec:g}s")
+        # 出力を読み切ってから完了にする（最後の行の取りこぼし防止）
+        for t in self._readers:
+            t.join(5)
+        self._finish(status, rc)
+
+    def _stop(self, grace_sec: float = 5.0) -> None:
+        if self._proc is None or self._proc.poll() is not None:
+            return
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=grace_sec)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    # -------------------------
+    # UI API
+    # -------------------------
+    def cancel(self) -> None:
+        self._cancel.set()
+        threading.Thread(target=self._stop, daemon=True).start()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "running"
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended_at or time.time()) - self.started_at
+
+    def output(self) -> str:
+        """全出力（ログファイルから。リングバッファから溢れた先頭も含む）"""
+        with self._lock:
+            if self._log is not None:
+                self._log.flush()
+        try:
+            with open(self.log_path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().rstrip("\n")
+        except OSError:
+            return self.snapshot()[1]
+
+    def discard_log(self) -> None:
+        try:
+            os.remove(self.log_path)
+        except OSError:
+            pass
+
+    def snapshot(self, tail: Optional[int] = None) -> Tuple[str, str, Optional[int]]:
+        """(status, 出力（リングバッファ分。tail 指定時は末尾 tail 行）, returncode)"""
+        with self._lock:
+            lines = list(self._lines) if tail is None else list(self._lines)[-tail:]
+            dropped = self._dropped
+            status, rc = self.status, self.returncode
+        if dropped and tail is None:
+            lines.insert(0, f"...（先頭 {dropped} 行は省略）")
+        return status, "\n".join(lines), rc
+
+
+# -------------------------
+# Registry（プロセス共有。同時に複数のツールを走らせられる）
+# -------------------------
+_JOBS: Dict[str, ToolJob] = {}
+_JOBS_LOCK = threading.Lock()
+# 終わったジョブをいくつまで覚えておくか
+MAX_FINISHED_JOBS = 20
+
+
+def start_tool_job(cmd: List[str], timeout_sec: Optional[float] = 300, max_lines: int = 5000) -> ToolJob:
+    job = ToolJob(cmd, timeout_sec=timeout_sec, max_lines=max_lines)
+    with _JOBS_LOCK:
+        _JOBS[job.id] = job
+        finished = [j for j in _JOBS.values() if j.finished]
+        finished.sort(key=lambda j: j.ended_at or 0)
+        for j in finished[:-MAX_FINISHED_JOBS]:
+            _JOBS.pop(j.id, None)
+            j.discard_log()
+    return job
+
+
+def get_tool_job(job_id: Optional[str]) -> Optional[ToolJob]:
+    if not job_id:
+        return None
+    with _JOBS_LOCK:
+        return _JOBS.get(job_id)
+
+
+def list_tool_jobs(running_only: bool = False) -> List[ToolJob]:
+    with _JOBS_LOCK:
+        jobs = list(_JOBS.values())
+    if running_only:
+        jobs = [j for j in jobs if not j.finished]
+    return sorted(jobs, key=lambda j: j.started_at)
@@ -0,0 +1,175 @@
+# secdemo/tool_output.py
+from __future__ import annotations
+
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from secdemo.ai_mapreduce import Chunk, fit_summaries, map_chunks
+from secdemo.ai_ollama import OllamaChatClient
+from secdemo.prompt_budget import Tokenizer, count_tokens, heuristic_tokens
+
+# -------------------------
+# Noise / boundary patterns（ツールごとに1本の正規表現へまとめて compile）
+# -------------------------
+_NOISE: Dict[str, List[str]] = {
+    "sqlmap": [
+        # バナー（アスキーアート）と定型文
+        r"^\s*_{2,}\s*$",
+        r"^\s*_{2,}\s*H\s*_{2,}",
+        r"^\s*_{3}\s*_{3}\[",
+        r"^\s*\|_ -\|",
+        r"^\s*\|___\|",
+        r"^\s*\|_\|\s*V\.\.\.",
+        r"https?://sqlmap\.org",
+        r"^\[!\] legal disclaimer",
+        r"^\[\*\] (starting|ending) @",
+        # 進捗（テスト1件ごとの行、接続確認、--batch の自動応答）
+        r"\[INFO\] testing '",
+        r"\[INFO\] testing (connection|if the target URL content is stable|whether)",
+        r"\[INFO\] checking if the target is protected",
+        r"\[INFO\] target URL content is stable",
+        r"\[INFO\] (fetching|using) ",
+        r"\? \[[YyNn]/[YyNn]",
+        r"^\s*\[\d{2}:\d{2}:\d{2}\] \[DEBUG\]",
+    ],
+    "nmap": [
+        r"^Stats: \d+:\d+:\d+ elapsed",
+        r"Timing: About [\d.]+% done",
+        r"^Starting Nmap ",
+        r"^Initiating ",
+        r"^Completed .* at \d",
+        r"^Discovered open port ",
+        r"^Scanning .* \[\d+ ports?\]",
+        r"^Read data files from:",
+        r"^NSE: ",
+        r"^Service detection performed\.",
+    ],
+}
+
+# ノイズに当たっても落とさない行（検出結果を含む進捗・--batch の質問文）
+_KEEP: Dict[str, str] = {
+    "sqlmap": r"back-end DBMS|injectable|vulnerable|\bparameter\b",
+}
+
+_BOUNDARY: Dict[str, str] = {
+    # sqlmap: パラメータごとのテスト開始 / 注入点サマリ
+    "sqlmap": r"^(---\s*$|Parameter: |.*\[INFO\] (testing|heuristic).*parameter '[^']+')",
+    # nmap: ホストごと
+    "nmap": r"^Nmap scan report for ",
+}
+
+NOISE_PATTERNS: Dict[str, "re.Pattern[str]"] = {k: re.compile("|".join(v)) for k, v in _NOISE.items()}
+KEEP_PATTERNS: Dict[str, "re.Pattern[str]"] = {k: re.compile(v, re.IGNORECASE) for k, v in _KEEP.items()}
+BOUNDARY_PATTERNS: Dict[str, "re.Pattern[str]"] = {k: re.compile(v) for k, v in _BOUNDARY.items()}
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+def _tool_key(tool_name: str) -> str:
+    return (tool_name or "").strip().lower()
+
+
+def _as_lines(output: Union[str, Iterable[str]]) -> Iterable[str]:
+    return output.splitlines() if isinstance(output, str) else output
+
+
+def clean_lines(output: Union[str, Iterable[str]], tool_name: str) -> Iterator[str]:
+    """
+    ノイズ行を落とした行を順に返す（入力は文字列でも行のイテレータでもよい）。
+    - \\r で上書きされる進捗表示は最後の状態だけ残す
+    - 同じ行の連続は「(×N)」に畳む
+    """
+    noise = NOISE_PATTERNS.get(_tool_key(tool_name))
+    keep = KEEP_PATTERNS.get(_tool_key(tool_name))
+    prev: Optional[str] = None
+    repeat = 0
+    for raw in _as_lines(output):
+        line = _ANSI.sub("", raw.rsplit("\r", 1)[-1]).rstrip()
+        if not line:
+            continue
+        if noise is not None and noise.search(line) and not (keep is not None and keep.search(line)):
+            continue
+        if line == prev:
+            repeat += 1
+            continue
+        if prev is not None:
+            yield prev if repeat == 0 else f"{prev}  (×{repeat + 1})"
+        prev, repeat = line, 0
+    if prev is not None:
+        yield prev if repeat == 0 else f"{prev}  (×{repeat + 1})"
+
+
+def iter_chunks(output: Union[str, Iterable[str]], tool_name: str, max_tokens: int = 1500) -> Iterator[str]:
+    """
+    clean_lines の結果を、ツール固有の区切り（nmap はホスト、sqlmap はパラメータ）か
+    max_tokens のどちらか早い方で区切って返す。
+    行ごとの計測は頻度が高いので、外部 tokenizer ではなく見積もりで数える。
+    """
+    boundary = BOUNDARY_PATTERNS.get(_tool_key(tool_name))
+    part: List[str] = []
+    used = 0
+    for line in clean_lines(output, tool_name):
+        t = heuristic_tokens(line) + 1
+        at_boundary = boundary is not None and boundary.search(line) is not None
+        if part and (used + t > max_tokens or (at_boundary and used > max_tokens // 4)):
+            yield "\n".join(part)
+            part, used = [], 0
+        part.append(line)
+        used += t
+    if part:
+        yield "\n".join(part)
+
+
+# -------------------------
+# Condense（map → 予算に収まるまで統合）
+# -------------------------
+def condense_output(
+    client: OllamaChatClient,
+    model: str,
+    tool_name: str,
+    output: str,
+    max_tokens: int,
+    make_prompt: Callable[[str, str], str],
+    make_collapse_prompt: Callable[[str], str],
+    chunk_tokens: int = 1500,
+    temperature: float = 0.2,
+    system: Optional[str] = None,
+    parallel: int = 2,
+    on_done: Optional[Callable[[int, int], None]] = None,
+    tokenizer: Optional[Tokenizer] = None,
+) -> Tuple[str, bool]:
+    """
+    ツール出力を最終プロンプト用に max_tokens 以内へ縮める。
+    ノイズ除去だけで収まればそれを返し（LLM 呼び出しなし）、
+    収まらなければチャンクごとに並列要約 → 部分要約を統合する。
+    戻り値は (テキスト, 要約したか)。
+    """
+    cleaned = "\n".join(clean_lines(output, tool_name))
+    if count_tokens(cleaned, tokenizer) <= max_tokens:
+        return cleaned, False
+
+    bodies = list(iter_chunks(cleaned, tool_name, max_tokens=chunk_tokens))
+    chunks: List[Chunk] = [(f"{tool_name} ({i}/{len(bodies)})", b) for i, b in enumerate(bodies, 1)]
+
+    summaries = map_chunks(
+        client,
+        model,
+        chunks,
+        make_prompt,
+        temperature=temperature,
+        system=system,
+        parallel=parallel,
+        on_done=on_done,
+    )
+    merged = fit_summaries(
+        client,
+        model,
+        summaries,
+        max_tokens=max_tokens,
+        make_collapse_prompt=make_collapse_prompt,
+        temperature=temperature,
+        system=system,
+        parallel=parallel,
+        tokenizer=tokenizer,
+    )
+    return merged, True
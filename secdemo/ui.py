@@ -5,18 +5,27 @@ import json
 import os
 import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import streamlit as st
 
-from secdemo.zap_live_client import ZapLiveClient
+from secdemo.paths import data_dir
+from secdemo.zap_live_client import ZapLiveClient, fetch_parallel
+from secdemo.history_sync import HistorySync
+from secdemo.alerts import collect_alerts, group_alerts, normalize_alert
 from secdemo.url_reconstruct import reconstruct_url
 
 from secdemo.ui_tables import render_history_table, render_alerts_table
 from secdemo.ui_details import render_bookmarks_panel, render_history_details
-from secdemo.ui_ai import render_help_ai_dialog, generate_alert_explain
-from secdemo.ai_ollama import OllamaChatClient
-from secdemo.ui_report import render_report_ui, generate_overall_risk_report
+from secdemo.ui_ai import (
+    render_batch_explain_panel,
+    render_help_ai_dialog,
+    stream_alert_explain,
+    write_stream_transient,
+)
+from secdemo.ai_ollama import cached_list_models
+from secdemo.prompt_budget import TOKENIZER_KINDS
+from secdemo.ui_report import render_report_ui, stream_overall_risk_report
 
 # 互換：render_sqlmap_ui がある場合だけ使う（無いなら render_tool_ui を使う構成でもOK）
 try:
@@ -28,18 +37,18 @@ from secdemo.ui_tools import render_tool_ui
 from secdemo.ui_tool_ai import render_tool_ai_summary
 
 
+# ZAP 取得（version/sites/history/alerts）全体の締め切り
+ZAP_FETCH_DEADLINE_SEC = 15.0
+
+# アラートを個別に保持する上限（超過分は同一キーの代表行で件数だけ数える）
+ALERT_MAX_ITEMS = 5000
+
+
 # =============================
 # Settings persistence (local file)
 # =============================
-def _project_root() -> str:
-    return os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-
-
 def _settings_path() -> str:
-    root = _project_root()
-    data_dir = os.path.join(root, "secdemo_data")
-    os.makedirs(data_dir, exist_ok=True)
-    return os.path.join(data_dir, "ui_settings.json")
+    return os.path.join(data_dir(), "ui_settings.json")
 
 
 def _load_settings() -> Dict[str, Any]:
@@ -84,27 +93,21 @@ def _safe_str(x: Any) -> str:
     return "" if x is None else str(x)
 
 
-def _normalize_alert(a: Dict[str, Any]) -> Dict[str, Any]:
+def _to_hist_item(m: Dict[str, Any], fallback_base: str) -> Dict[str, Any]:
     """
-    UI側が参照するキーを必ず持つように正規化（KeyError防止）
+    一覧表示用のサマリだけを保持（ヘッダ/ボディは詳細表示時に id で取り直す）
     """
-    base = {
-        "risk": "",
-        "name": "",
-        "url": "",
-        "param": "",
-        "attack": "",
-        "evidence": "",
-        "cweid": "",
-        "wascid": "",
-        "desc": "",
-        "solution": "",
-        "reference": "",
+    req_h = m.get("requestHeader", "") or ""
+    method, full_url = reconstruct_url(req_h, fallback_base=fallback_base)
+    return {
+        "id": m.get("id"),
+        "time": _format_zap_time(m.get("time")),
+        "method": method,
+        "status": m.get("responseCode"),
+        "url": full_url,
+        "rtt": m.get("rtt"),
+        "len": m.get("responseLength"),
     }
-    if not a:
-        return base
-    base.update({k: a.get(k, base.get(k, "")) for k in base.keys()})
-    return base
 
 
 def render_app() -> None:
@@ -119,6 +122,7 @@ def render_app() -> None:
         st.session_state["ollama_base"] = saved.get("ollama_base", "http://127.0.0.1:11434")
         st.session_state["ollama_model"] = saved.get("ollama_model", "")
         st.session_state["ollama_temp"] = float(saved.get("ollama_temp", 0.2))
+        st.session_state["token_counter"] = saved.get("token_counter", "heuristic")
         st.session_state["keyword"] = saved.get("keyword", "")
         st.session_state["bookmarks"] = saved.get("bookmarks", []) or []
         st.session_state["selected_alert"] = None
@@ -175,12 +179,7 @@ def render_app() -> None:
         )
 
         # ✅ モデル一覧を取得して selectbox 化（失敗時は手入力にフォールバック）
-        models: List[str] = []
-        try:
-            client = OllamaChatClient(st.session_state["ollama_base"], timeout=10)
-            models = client.list_models()
-        except Exception:
-            models = []
+        models: List[str] = cached_list_models(st.session_state["ollama_base"])
 
         saved_model = st.session_state.get("ollama_model", "")
         if models:
@@ -209,6 +208,14 @@ def render_app() -> None:
             0.05,
         )
 
+        saved_counter = st.session_state.get("token_counter", "heuristic")
+        st.session_state["token_counter"] = st.selectbox(
+            "トークン数の数え方",
+            TOKENIZER_KINDS,
+            index=TOKENIZER_KINDS.index(saved_counter) if saved_counter in TOKENIZER_KINDS else 0,
+            help="プロンプトを予算内に収めるときの計測方法（tiktoken は要インストール / llama-server は /tokenize を使用）",
+        )
+
         if remember:
             _save_settings(
                 {
@@ -218,6 +225,7 @@ def render_app() -> None:
                     "ollama_base": st.session_state["ollama_base"],
                     "ollama_model": st.session_state["ollama_model"],
                     "ollama_temp": st.session_state.get("ollama_temp", 0.2),
+                    "token_counter": st.session_state.get("token_counter", "heuristic"),
                     "keyword": st.session_state.get("keyword", ""),
                     "bookmarks": st.session_state.get("bookmarks", []),
                     "history_count": st.session_state.get("history_count", 200),
@@ -246,6 +254,7 @@ def render_app() -> None:
     hist_items: List[Dict[str, Any]] = []
     alert_items: List[Dict[str, Any]] = []
     last_err: Optional[str] = None
+    fetch_message: Optional[Callable[[Any], Optional[Dict[str, Any]]]] = None
 
     try:
         z = ZapLiveClient(
@@ -253,66 +262,56 @@ def render_app() -> None:
             apikey=st.session_state["apikey"],
             timeout=15,
         )
-        zap_ver = z.version()
-        zap_ok = True
+        fetch_message = z.message
 
-        try:
-            sites = ["(all)"] + z.sites()
-        except Exception:
-            sites = ["(all)"]
+        # 対象サイトは前回の選択（widget state）を使い、4つの取得を並列に投げる
+        selected_site = st.session_state.get("site_select") or "(all)"
+        site_baseurl = None if selected_site == "(all)" else selected_site
 
-        selected_site = st.sidebar.selectbox("対象サイト", options=sites, index=0)
+        # History（差分同期：新しいメッセージだけ取得してリングバッファへ）
+        sync: HistorySync = st.session_state.setdefault("history_sync", HistorySync())
+        fallback = selected_site if selected_site != "(all)" else "http://localhost"
 
-        # History
-        try:
-            raw_msgs = z.messages(baseurl=None if selected_site == "(all)" else selected_site, count=history_count)
-        except Exception:
-            raw_msgs = z.messages(count=history_count)
+        def _to_item(m: Dict[str, Any]) -> Dict[str, Any]:
+            return _to_hist_item(m, fallback)
 
-        fallback = selected_site if selected_site != "(all)" else "http://localhost"
-        for m in raw_msgs:
-            req_h = m.get("requestHeader", "") or ""
-            method, full_url = reconstruct_url(req_h, fallback_base=fallback)
-            hist_items.append(
-                {
-                    "id": m.get("id"),
-                    "time": _format_zap_time(m.get("time")),
-                    "method": method,
-                    "status": m.get("responseCode"),
-                    "url": full_url,
-                    "rtt": m.get("rtt"),
-                    "len": m.get("responseLength"),
-                    "requestHeader": req_h,
-                    "requestBody": m.get("requestBody", "") or "",
-                    "responseHeader": m.get("responseHeader", "") or "",
-                    "responseBody": m.get("responseBody", "") or "",
-                }
-            )
+        def _history() -> List[Dict[str, Any]]:
+            try:
+                return sync.sync(z, baseurl=site_baseurl, maxlen=history_count, to_item=_to_item)
+            except Exception:
+                return sync.sync(z, baseurl=None, maxlen=history_count, to_item=_to_item)
 
-        # Alerts
-        try:
-            raw_alerts = z.alerts(baseurl=None if selected_site == "(all)" else selected_site, count=500)
-        except Exception:
-            raw_alerts = z.alerts(count=500)
-
-        for a in raw_alerts:
-            alert_items.append(
-                _normalize_alert(
-                    {
-                        "risk": a.get("risk") or a.get("riskdesc") or "",
-                        "name": a.get("alert") or a.get("name") or "",
-                        "url": a.get("url") or "",
-                        "param": a.get("param") or "",
-                        "attack": a.get("attack") or "",
-                        "evidence": a.get("evidence") or "",
-                        "cweid": a.get("cweid") or "",
-                        "wascid": a.get("wascid") or "",
-                        "desc": a.get("description") or "",
-                        "solution": a.get("solution") or "",
-                        "reference": a.get("reference") or "",
-                    }
-                )
-            )
+        def _alerts() -> List[Dict[str, Any]]:
+            try:
+                return collect_alerts(z.iter_alerts(baseurl=site_baseurl), max_items=ALERT_MAX_ITEMS)
+            except Exception:
+                return collect_alerts(z.iter_alerts(), max_items=ALERT_MAX_ITEMS)
+
+        fetched = fetch_parallel(
+            {"version": z.version, "sites": z.sites, "history": _history, "alerts": _alerts},
+            deadline=ZAP_FETCH_DEADLINE_SEC,
+        )
+
+        zap_ver, err = fetched["version"]
+        if err is not None:
+            raise err
+        zap_ok = True
+
+        site_list, err = fetched["sites"]
+        sites = ["(all)"] + (site_list if err is None else [])
+
+        selected_site = st.sidebar.selectbox("対象サイト", options=sites, index=0, key="site_select")
+        st.session_state["selected_site"] = selected_site
+
+        hist_items, err = fetched["history"]
+        if err is not None:
+            hist_items = []
+            last_err = f"history: {err}"
+
+        alert_items, err = fetched["alerts"]
+        if err is not None:
+            alert_items = []
+            last_err = f"alerts: {err}"
 
         # URL contains filter（維持）
         kw = (st.session_state.get("keyword") or "").strip().lower()
@@ -368,11 +367,13 @@ def render_app() -> None:
         render_history_table(hist_items)
 
     with right:
-        render_alerts_table(alert_items)
+        alert_groups = group_alerts(alert_items)
+        render_alerts_table(alert_groups)
+        render_batch_explain_panel(alert_groups)
 
         # ✅ アラート詳細パネル（右側に常時）
         sel_raw = st.session_state.get("selected_alert")
-        sel = _normalize_alert(sel_raw) if sel_raw else None
+        sel = normalize_alert(sel_raw) if sel_raw else None
 
         st.markdown("### 🧾 選択アラート詳細")
 
@@ -381,6 +382,11 @@ def render_app() -> None:
         else:
             st.write(f"**[{sel.get('risk','')}] {sel.get('name','')}**")
             st.caption(sel.get("url", ""))
+            urls = sel_raw.get("urls") or []
+            if int(sel_raw.get("count") or 1) > 1:
+                with st.expander(f"インスタンス: {sel_raw.get('count')} 件（URLサンプル）", expanded=False):
+                    for u in urls:
+                        st.markdown(f"- {u}")
 
             with st.expander("Description / Solution", expanded=True):
                 st.markdown(sel.get("desc") or "(no description)")
@@ -395,13 +401,14 @@ def render_app() -> None:
 
             # ✅ AI要約を「詳細内に統合」
             if st.button("🧠 このアラートをAI要約（詳細に表示）", use_container_width=True):
-                with st.spinner("AIで要約中..."):
-                    text = generate_alert_explain(
+                text = write_stream_transient(
+                    stream_alert_explain(
                         alert=sel,
                         ollama_base=st.session_state["ollama_base"],
                         model=st.session_state["ollama_model"],
                         temperature=float(st.session_state.get("ollama_temp", 0.2)),
                     )
+                )
                 st.session_state["alert_ai_text"] = text
 
             if st.session_state.get("alert_ai_text"):
@@ -411,7 +418,7 @@ def render_app() -> None:
     # -----------------------------
     # Details（History）
     # -----------------------------
-    render_history_details(hist_items, _load_settings, _save_settings)
+    render_history_details(hist_items, _load_settings, _save_settings, fetch_message)
 
     # -----------------------------
     # Report UI
@@ -440,8 +447,8 @@ def render_app() -> None:
     # -----------------------------
     st.divider()
     if st.button("🧠 総合リスクAI分析", use_container_width=True):
-        with st.spinner("AIが全体を分析しています..."):
-            st.session_state["overall_risk_ai"] = generate_overall_risk_report(hist_items, alert_items)
+        # 結果と入力ハッシュは stream_overall_risk_report が session_state に保存する（レポート生成で再利用）
+        write_stream_transient(stream_overall_risk_report(hist_items, alert_items))
 
     if "overall_risk_ai" in st.session_state:
         st.markdown("## 📊 総合リスク評価（AI）")
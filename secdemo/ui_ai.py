@@ -1,11 +1,19 @@
 # secdemo/ui_ai.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import streamlit as st
 
-from secdemo.ai_ollama import OllamaChatClient, DEFAULT_SYSTEM
+from secdemo.ai_ollama import OllamaChatClient, DEFAULT_SYSTEM, cached_list_models, cached_parallel_slots
+from secdemo.ai_batch import BatchLlmJob
+from secdemo.llm_cache import cached_chat, cached_chat_stream
+from secdemo.prompt_budget import Tokenizer, make_tokenizer
+
+
+def session_tokenizer() -> Tokenizer:
+    """このセッションで選ばれたトークン計測（ワーカースレッドへは戻り値を渡す）"""
+    return make_tokenizer(st.session_state.get("token_counter", "heuristic"), st.session_state.get("ollama_base", ""))
 
 
 def _build_alert_explain_prompt(alert: Dict[str, Any]) -> str:
@@ -26,20 +34,22 @@ Reference: {alert.get('reference','')}
 """
 
 
-def generate_alert_explain(
+_ALERT_EXPLAIN_SYSTEM = (
+    DEFAULT_SYSTEM
+    + "\nあなたはセキュリティ診断の説明担当です。具体的な悪用方法や攻撃手順は書かず、対策と判断に集中してください。"
+)
+
+
+def _prepare_alert_explain(
     alert: Dict[str, Any],
     ollama_base: str,
     model: str,
-    temperature: float = 0.2,
-    timeout: int = 180,
-) -> str:
+    timeout: int,
+) -> Tuple[OllamaChatClient, str, List[Dict[str, str]]]:
     client = OllamaChatClient(base_url=ollama_base, timeout=timeout)
 
     # ✅ モデル存在チェック → なければ先頭モデルにフォールバック
-    try:
-        models = client.list_models()
-    except Exception:
-        models = []
+    models = cached_list_models(ollama_base)
 
     use_model = model
     if models and model not in models:
@@ -47,18 +57,131 @@ def generate_alert_explain(
         st.session_state["ollama_model"] = use_model  # UI側にも反映
 
     prompt = _build_alert_explain_prompt(alert)
-    system = (
-        DEFAULT_SYSTEM
-        + "\nあなたはセキュリティ診断の説明担当です。具体的な悪用方法や攻撃手順は書かず、対策と判断に集中してください。"
+    return client, use_model, [{"role": "user", "content": prompt}]
+
+
+def generate_alert_explain(
+    alert: Dict[str, Any],
+    ollama_base: str,
+    model: str,
+    temperature: float = 0.2,
+    timeout: int = 180,
+) -> str:
+    client, use_model, messages = _prepare_alert_explain(alert, ollama_base, model, timeout)
+    return cached_chat(
+        client,
+        model=use_model,
+        messages=messages,
+        temperature=float(temperature),
+        system=_ALERT_EXPLAIN_SYSTEM,
     )
-    return client.chat(
+
+
+def stream_alert_explain(
+    alert: Dict[str, Any],
+    ollama_base: str,
+    model: str,
+    temperature: float = 0.2,
+    timeout: int = 180,
+) -> Iterator[str]:
+    """generate_alert_explain のストリーミング版（st.write_stream に渡す）。キャッシュ済みなら即座に全文"""
+    client, use_model, messages = _prepare_alert_explain(alert, ollama_base, model, timeout)
+    yield from cached_chat_stream(
+        client,
         model=use_model,
-        messages=[{"role": "user", "content": prompt}],
+        messages=messages,
         temperature=float(temperature),
-        system=system,
+        system=_ALERT_EXPLAIN_SYSTEM,
     )
 
 
+def write_stream_transient(stream: Iterable[str]) -> str:
+    """
+    トークンを届いた順に一時表示し、完了後に全文を返す。
+    表示は消すので、呼び出し側は session_state に保存した全文を通常どおり描画する。
+    """
+    ph = st.empty()
+    with ph.container():
+        text = st.write_stream(stream)
+    ph.empty()
+    return text if isinstance(text, str) else "".join(map(str, text or []))
+
+
+def _alert_explain_messages(alert: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": _build_alert_explain_prompt(alert)}]
+
+
+def render_batch_explain_panel(alert_groups: List[Dict[str, Any]]) -> None:
+    """
+    アラート（グループ）を一括でAI解説。ワーカープールで並列に投げ、終わった順に表示する。
+    結果は session_state["alert_ai_batch"]（"[risk] name" -> 解説）に入る。
+    """
+    with st.expander("🧠 全アラートを一括AI解説（バックグラウンド）", expanded=False):
+        job: Optional[BatchLlmJob] = st.session_state.get("alert_ai_batch_job")
+        running = job is not None and not job.finished
+
+        base = st.session_state.get("ollama_base", "http://127.0.0.1:11434")
+        # /props は裏で確認（未確定の間は 2 とみなす）
+        slots = cached_parallel_slots(base) or 2
+
+        c1, c2, c3 = st.columns([2, 1, 1], gap="small")
+        with c1:
+            parallel = st.slider(
+                "並列数（サーバのスロット数に合わせる）",
+                1,
+                16,
+                int(min(max(slots, 1), 16)),
+                key="alert_ai_batch_parallel",
+                disabled=running,
+            )
+        with c2:
+            if st.button(
+                f"▶ {len(alert_groups)} 件を解説",
+                use_container_width=True,
+                disabled=running or not alert_groups,
+                key="alert_ai_batch_start",
+            ):
+                model = st.session_state.get("ollama_model", "")
+                models = cached_list_models(base)
+                if models and model not in models:
+                    model = models[0]
+                st.session_state["alert_ai_batch_job"] = BatchLlmJob(
+                    alert_groups,
+                    _alert_explain_messages,
+                    ollama_base=base,
+                    model=model,
+                    temperature=float(st.session_state.get("ollama_temp", 0.2)),
+                    system=_ALERT_EXPLAIN_SYSTEM,
+                    parallel=parallel,
+                )
+                st.session_state["alert_ai_batch"] = {}
+                st.rerun()
+        with c3:
+            if st.button("⏹ 中止", use_container_width=True, disabled=not running, key="alert_ai_batch_cancel"):
+                job.cancel()
+
+        if job is None:
+            st.caption("※ 解説は LLM キャッシュにも保存され、同じアラートは次回から即座に表示されます。")
+            return
+
+        @st.fragment(run_every=1.0 if running else None)
+        def _progress() -> None:
+            done, results, errors = job.snapshot()
+            labels = [f"[{a.get('risk','')}] {a.get('name','')} ({a.get('param','') or '-'})" for a in job.items]
+            st.session_state["alert_ai_batch"] = {labels[i]: text for i, text in sorted(results.items())}
+
+            st.progress(done / max(job.total, 1), text=f"{done}/{job.total} 完了" + ("（中止）" if job.cancelled else ""))
+            for i, text in sorted(results.items()):
+                with st.expander(labels[i], expanded=False):
+                    st.markdown(text)
+            for i, err in sorted(errors.items()):
+                st.warning(f"{labels[i]}: {err}")
+            if job.finished and running:
+                # 完了したらポーリングを止めるため全体を描き直す
+                st.rerun()
+
+        _progress()
+
 
 def render_help_ai_dialog(
     zap_ok: bool,
@@ -84,10 +207,7 @@ def render_help_ai_dialog(
         client = OllamaChatClient(base_url=base, timeout=180)
 
         default_model = st.session_state.get("help_model", st.session_state.get("ollama_model", "qwen2.5-1.5b-instruct-q4_k_m"))
-        try:
-            models = client.list_models()
-        except Exception:
-            models = []
+        models = cached_list_models(base)
 
         if models:
             model = st.selectbox("Model", models, index=models.index(default_model) if default_model in models else 0)
@@ -119,14 +239,14 @@ def render_help_ai_dialog(
             system = DEFAULT_SYSTEM + "\n現在の状態:\n" + str(context)
 
             with st.chat_message("assistant"):
-                with st.spinner("考え中..."):
-                    answer = client.chat(
+                answer = st.write_stream(
+                    client.chat_stream(
                         model=model,
                         messages=st.session_state["help_chat"],
                         temperature=float(temp),
                         system=system,
                     )
-                st.markdown(answer)
+                )
 
             st.session_state["help_chat"].append({"role": "assistant", "content": answer})
 
@@ -1,7 +1,8 @@
 # secdemo/ui_details.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
 
 import pandas as pd
 import streamlit as st
@@ -17,6 +18,44 @@ def _bookmark_key(item: Dict[str, Any]) -> str:
     return f"{_safe_str(item.get('method'))}|{_safe_str(item.get('url'))}|{_safe_str(item.get('time'))}|{_safe_str(item.get('status'))}"
 
 
+_BODY_KEYS = ("requestHeader", "requestBody", "responseHeader", "responseBody")
+_MESSAGE_CACHE_SIZE = 16
+
+
+def _load_message_detail(
+    item: Dict[str, Any],
+    fetch_message_fn: Optional[Callable[[Any], Optional[Dict[str, Any]]]],
+) -> Dict[str, Any]:
+    """
+    選択された履歴のヘッダ/ボディを id で取得（直近に見たものは LRU で保持）
+    """
+    if all(k in item for k in _BODY_KEYS) or fetch_message_fn is None:
+        return item
+
+    cache: "OrderedDict[str, Dict[str, Any]]" = st.session_state.setdefault("history_message_cache", OrderedDict())
+    key = f"{st.session_state.get('zap_base', '')}|{_safe_str(item.get('id'))}"
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    msg = None
+    try:
+        msg = fetch_message_fn(item.get("id"))
+    except Exception:
+        msg = None
+    if not msg:
+        # 取得できなかった場合はキャッシュせず、次回また取りに行く
+        return dict(item)
+
+    full = dict(item)
+    for k in _BODY_KEYS:
+        full[k] = msg.get(k, "") or ""
+    cache[key] = full
+    while len(cache) > _MESSAGE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return full
+
+
 def render_bookmarks_panel(load_settings_fn, save_settings_fn) -> None:
     with st.expander("📌 Bookmarks（ピン留め）", expanded=False):
         bm_list: List[Dict[str, Any]] = st.session_state.get("bookmarks", []) or []
@@ -43,6 +82,7 @@ def render_history_details(
     hist_items: List[Dict[str, Any]],
     load_settings_fn,
     save_settings_fn,
+    fetch_message_fn: Optional[Callable[[Any], Optional[Dict[str, Any]]]] = None,
 ) -> None:
     st.divider()
     st.subheader("🔎 詳細（選択した履歴）")
@@ -60,6 +100,8 @@ def render_history_details(
         st.info("履歴の行をクリックすると、ここにリクエスト/レスポンスが表示されます。")
         return
 
+    selected_item = _load_message_detail(selected_item, fetch_message_fn)
+
     bm_key = _bookmark_key(selected_item)
     bm_list = st.session_state.get("bookmarks", []) or []
     already = any(_bookmark_key(bm) == bm_key for bm in bm_list)
@@ -1,12 +1,28 @@
 # secdemo/ui_report.py
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import streamlit as st
 
+from secdemo.ai_mapreduce import chunk_alert_groups, fit_summaries, format_group_line, map_chunks
 from secdemo.ai_ollama import OllamaChatClient, DEFAULT_SYSTEM
+from secdemo.alerts import group_alerts
+from secdemo.llm_cache import LlmCache, cached_chat, cached_chat_stream
+from secdemo.prompt_budget import PromptSection, Tokenizer, build_prompt, count_tokens, fit_items
+from secdemo.ui_ai import session_tokenizer, write_stream_transient
+from secdemo.ui_tables import items_version
+
+# レポート本文と並行して総合リスク評価を作るためのワーカー
+_REPORT_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-report")
+
+
+# 検出一覧に割くトークン数（これに収まらない種別数なら map-reduce を既定ONにする）
+ALERT_OVERVIEW_TOKENS = 1500
+# 生成側に残しておくトークン数（コンテキスト上限からこれを引いた分をプロンプトに使う）
+REPORT_OUTPUT_RESERVE = 1024
 
 
 def _ensure_report_blocks() -> None:
@@ -24,28 +40,32 @@ def _risk_bucket(r: str) -> str:
     return "Info"
 
 
-def _alerts_overview(alert_items: List[Dict[str, Any]]) -> str:
+def _alerts_overview(
+    alert_items: List[Dict[str, Any]],
+    max_tokens: int = ALERT_OVERVIEW_TOKENS,
+    tokenizer: Optional[Tokenizer] = None,
+) -> str:
     if not alert_items:
         return "（アラートなし）"
 
+    groups = group_alerts(alert_items)
+
     counts = {"High": 0, "Medium": 0, "Low": 0, "Info": 0}
-    for a in alert_items:
-        counts[_risk_bucket(a.get("risk", ""))] += 1
+    for g in groups:
+        counts[_risk_bucket(g.get("risk", ""))] += g["count"]
 
     lines = [
         f"- High: {counts['High']}",
         f"- Medium: {counts['Medium']}",
         f"- Low: {counts['Low']}",
         f"- Info: {counts['Info']}",
+        f"- 検出種別: {len(groups)}（同一検出はURL単位のインスタンスをまとめて件数表示）",
         "",
         "### 検出一覧（上位）",
     ]
 
-    # “見出し用”に上位だけ
-    for a in alert_items[:30]:
-        lines.append(f"- [{a.get('risk','')}] {a.get('name','')}  ({a.get('url','')})")
-    if len(alert_items) > 30:
-        lines.append(f"- ...（他 {len(alert_items)-30} 件）")
+    # group_alerts は risk → 件数 の降順なので、予算に入らない分は末尾（低リスク・少数）から落ちる
+    lines.extend(fit_items([format_group_line(g) for g in groups], max_tokens, tokenizer, more_note="- ...（他 {n} 種別）"))
 
     return "\n".join(lines)
 
@@ -61,16 +81,7 @@ def _traffic_overview(hist_items: List[Dict[str, Any]]) -> str:
     return "\n".join(lines)
 
 
-def generate_overall_risk_report(hist_items, alert_items) -> str:
-    """
-    総合リスク評価（AI）
-    - ZAP + 通信 + 外部ツールAI要約（あれば）を統合
-    - 攻撃手順は禁止
-    """
-    client = OllamaChatClient(st.session_state["ollama_base"])
-    model = st.session_state["ollama_model"]
-    temp = float(st.session_state.get("ollama_temp", 0.2))
-
+def _overall_risk_prompt(hist_items, alert_items) -> str:
     sql_ai = st.session_state.get("sqlmap_ai", "未実施")
     nmap_ai = st.session_state.get("nmap_ai", "未実施")
 
@@ -79,7 +90,7 @@ def generate_overall_risk_report(hist_items, alert_items) -> str:
 “守る側”の観点で、全体リスクを評価してください。
 
 【ZAPアラート概要】
-{_alerts_overview(alert_items)}
+{_alerts_overview(alert_items, tokenizer=session_tokenizer())}
 
 【通信ログの特徴（抜粋）】
 {_traffic_overview(hist_items)}
@@ -100,12 +111,152 @@ def generate_overall_risk_report(hist_items, alert_items) -> str:
 - 攻撃手順・PoC・悪用方法は書かない
 - 断定しすぎず、前提条件・可能性を明記
 """
-    return client.chat(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
+    return prompt
+
+
+def _overall_risk_request(hist_items, alert_items) -> Tuple[OllamaChatClient, str, float, List[Dict[str, str]], str]:
+    """
+    総合リスク評価の (client, model, temp, messages, key) を組み立てる（session_state を読むのでメインスレッドで呼ぶ）。
+    key はプロンプト/モデル/温度のハッシュで、同じ入力なら前回の結果を使い回す判定に使う。
+    """
+    client = OllamaChatClient(st.session_state["ollama_base"])
+    model = st.session_state["ollama_model"]
+    temp = float(st.session_state.get("ollama_temp", 0.2))
+    prompt = _overall_risk_prompt(hist_items, alert_items)
+    key = LlmCache.make_key(prompt, model, temp, DEFAULT_SYSTEM)
+    return client, model, temp, [{"role": "user", "content": prompt}], key
+
+
+def _remember_overall_risk(text: str, key: str) -> None:
+    st.session_state["overall_risk_ai"] = text
+    st.session_state["overall_risk_ai_key"] = key
+
+
+def cached_overall_risk(hist_items, alert_items) -> Optional[str]:
+    """入力が前回と同じなら session_state の総合リスク評価を返す（無ければ None）"""
+    text = st.session_state.get("overall_risk_ai")
+    if not text:
+        return None
+    *_, key = _overall_risk_request(hist_items, alert_items)
+    return text if st.session_state.get("overall_risk_ai_key") == key else None
+
+
+def generate_overall_risk_report(hist_items, alert_items) -> str:
+    """
+    総合リスク評価（AI）
+    - ZAP + 通信 + 外部ツールAI要約（あれば）を統合
+    - 攻撃手順は禁止
+    """
+    client, model, temp, messages, key = _overall_risk_request(hist_items, alert_items)
+    text = cached_chat(client, model=model, messages=messages, temperature=temp, system=DEFAULT_SYSTEM)
+    _remember_overall_risk(text, key)
+    return text
+
+
+def stream_overall_risk_report(hist_items, alert_items) -> Iterator[str]:
+    """generate_overall_risk_report のストリーミング版（最後まで届いたら session_state に保存）"""
+    client, model, temp, messages, key = _overall_risk_request(hist_items, alert_items)
+    parts: List[str] = []
+    for token in cached_chat_stream(client, model=model, messages=messages, temperature=temp, system=DEFAULT_SYSTEM):
+        parts.append(token)
+        yield token
+    _remember_overall_risk("".join(parts), key)
+
+
+def _map_prompt(title: str, body: str) -> str:
+    return f"""
+以下は ZAP アラートのうち「{title}」に該当する検出の一覧です（×N は同一検出のURL件数）。
+報告書の素材として、次を簡潔にまとめてください。
+
+- 主な検出（種類ごとに1行、件数と代表URLを添える）
+- 想定される影響
+- 優先すべき対策
+
+制約:
+- 攻撃手順・PoC・悪用方法は書かない
+- 一覧にない検出を作らない
+
+--- 検出一覧 ---
+{body}
+"""
+
+
+def _collapse_prompt(body: str) -> str:
+    return f"""
+以下は ZAP アラートの部分要約です。重複をまとめ、件数・代表URL・優先度の情報を落とさずに短く統合してください。
+攻撃手順・PoC・悪用方法は書かないでください。
+
+{body}
+"""
+
+
+def _mapreduce_alerts_section(alert_items, chunk_by: str, ctx_budget: int, parallel: int) -> str:
+    """
+    map: risk / CWE ごとのチャンクを並列に要約
+    reduce: 部分要約をコンテキスト上限の半分に収まるまで畳み、レポート用プロンプトへ渡す
+    """
+    client = OllamaChatClient(st.session_state["ollama_base"])
+    model = st.session_state["ollama_model"]
+    temp = float(st.session_state.get("ollama_temp", 0.2))
+
+    groups = group_alerts(alert_items)
+    counts = {"High": 0, "Medium": 0, "Low": 0, "Info": 0}
+    for g in groups:
+        counts[_risk_bucket(g.get("risk", ""))] += g["count"]
+
+    # 1チャンクはコンテキストの 1/4 程度（指示文と出力の余白を残す）
+    chunks = chunk_alert_groups(groups, by=chunk_by, max_tokens=max(256, ctx_budget // 4))
+
+    bar = st.progress(0.0, text=f"アラート要約（map）: 0/{len(chunks)}")
+    summaries = map_chunks(
+        client,
+        model,
+        chunks,
+        _map_prompt,
         temperature=temp,
         system=DEFAULT_SYSTEM,
+        parallel=parallel,
+        on_done=lambda done, total: bar.progress(done / total, text=f"アラート要約（map）: {done}/{total}"),
+    )
+    bar.progress(1.0, text="部分要約を統合中（reduce）...")
+    merged = fit_summaries(
+        client,
+        model,
+        summaries,
+        max_tokens=ctx_budget // 2,
+        make_collapse_prompt=_collapse_prompt,
+        temperature=temp,
+        system=DEFAULT_SYSTEM,
+        parallel=parallel,
+        tokenizer=session_tokenizer(),
+    )
+    bar.empty()
+
+    header = "\n".join(
+        [
+            f"- High: {counts['High']}",
+            f"- Medium: {counts['Medium']}",
+            f"- Low: {counts['Low']}",
+            f"- Info: {counts['Info']}",
+            f"- 検出種別: {len(groups)}（全件を {chunk_by} 単位で分割要約）",
+        ]
     )
+    return header + "\n\n" + merged
+
+
+_ALERT_KEYS = ("pluginId", "alert", "name", "risk", "param", "url", "instances", "cweid")
+
+
+def _alert_list_stats(alert_items) -> Tuple[int, int]:
+    """(検出種別数, 検出一覧のトークン数)。アラートと計測方法が変わらない限り再計算しない"""
+    key = (items_version(alert_items or [], _ALERT_KEYS), st.session_state.get("token_counter", "heuristic"))
+    cached = st.session_state.get("_rep_alert_list_stats")
+    if cached and cached[0] == key:
+        return cached[1]
+    groups = group_alerts(alert_items) if alert_items else []
+    stats = (len(groups), count_tokens("\n".join(format_group_line(g) for g in groups), session_tokenizer()))
+    st.session_state["_rep_alert_list_stats"] = (key, stats)
+    return stats
 
 
 def render_report_ui(hist_items, alert_items) -> None:
@@ -116,31 +267,75 @@ def render_report_ui(hist_items, alert_items) -> None:
     include_overall = st.checkbox("総合リスク評価（AI）を含める", value=True, key="rep_inc_overall")
     include_selected_alert_ai = st.checkbox("選択アラートAI要約（詳細で生成したもの）を含める", value=True, key="rep_inc_sel_ai")
 
+    with st.expander("⚙ プロンプト予算 / 大規模スキャン向け（map-reduce）", expanded=False):
+        n_groups, list_tokens = _alert_list_stats(alert_items)
+        ctx_budget = st.number_input(
+            "コンテキスト上限（トークン）",
+            1024,
+            131072,
+            4096,
+            512,
+            key="rep_ctx_budget",
+            help=f"プロンプトは（上限 - {REPORT_OUTPUT_RESERVE}）に収まるよう、重要度の低い素材から削ります",
+        )
+        use_mapreduce = st.checkbox(
+            "アラートを分割して並列要約してから統合する",
+            value=list_tokens > ALERT_OVERVIEW_TOKENS,
+            key="rep_mapreduce",
+            help="検出種別が多いと、1つのプロンプトに入らず上位だけになるため",
+        )
+        m1, m2 = st.columns(2, gap="small")
+        with m1:
+            chunk_by = st.selectbox("分割単位", ["risk", "cwe"], key="rep_chunk_by")
+        with m2:
+            map_parallel = st.slider("並列数", 1, 8, 2, key="rep_map_parallel")
+        st.caption(f"検出種別: {n_groups} / 検出一覧 ≒ {list_tokens} tokens")
+
     col1, col2 = st.columns([1, 1], gap="small")
     with col1:
         if st.button("📄 AIでレポート生成", use_container_width=True, key="gen_report"):
-            with st.spinner("AIがレポートを生成しています..."):
-                # ここで report_blocks も組み込む
-                blocks = st.session_state.get("report_blocks", []) or []
-                blocks_md = ""
-                if include_tool_ai and blocks:
-                    parts = []
-                    for b in blocks[-10:]:  # 重くならないように直近だけ
-                        parts.append(f"## {b.get('title','')}\n\n{b.get('md','')}")
-                    blocks_md = "\n\n".join(parts)
-
-                sel_ai = ""
-                if include_selected_alert_ai and st.session_state.get("alert_ai_text"):
-                    sel_ai = "## 選択アラートAI要約\n\n" + st.session_state["alert_ai_text"]
-
-                overall_md = ""
-                if include_overall:
-                    overall_text = generate_overall_risk_report(hist_items, alert_items)
-                    overall_md = "## 総合リスク評価（AI）\n\n" + overall_text
-                    st.session_state["overall_risk_ai"] = overall_text
-
-                prompt = f"""
-以下はWebセキュリティ診断結果です。
+            # ここで report_blocks も組み込む
+            blocks = st.session_state.get("report_blocks", []) or []
+            blocks = blocks[-10:] if include_tool_ai else []  # 重くならないように直近だけ
+
+            sel_ai = ""
+            if include_selected_alert_ai and st.session_state.get("alert_ai_text"):
+                sel_ai = st.session_state["alert_ai_text"]
+
+            # 総合リスク評価は本文のプロンプトに埋め込まず、末尾に付ける。
+            # 入力が同じなら前回の結果を再利用し、無ければ本文の生成と並行して裏で作る。
+            overall_text: Optional[str] = None
+            overall_future: Optional[Future] = None
+            if include_overall:
+                overall_text = cached_overall_risk(hist_items, alert_items)
+                if overall_text is None:
+                    o_client, o_model, o_temp, o_messages, overall_key = _overall_risk_request(hist_items, alert_items)
+                    overall_future = _REPORT_POOL.submit(
+                        cached_chat,
+                        o_client,
+                        model=o_model,
+                        messages=o_messages,
+                        temperature=o_temp,
+                        system=DEFAULT_SYSTEM,
+                    )
+
+            prompt_budget = max(512, int(ctx_budget) - REPORT_OUTPUT_RESERVE)
+            if use_mapreduce and alert_items:
+                alerts_section = _mapreduce_alerts_section(
+                    alert_items,
+                    chunk_by=chunk_by,
+                    ctx_budget=int(ctx_budget),
+                    parallel=int(map_parallel),
+                )
+            else:
+                alerts_section = _alerts_overview(alert_items, max_tokens=prompt_budget // 2, tokenizer=session_tokenizer())
+
+            # 予算が足りないときは priority の低い区画（通信ログ → 古いツール要約 …）から削る
+            sections = [
+                PromptSection(
+                    "head",
+                    fixed=True,
+                    text=f"""以下はWebセキュリティ診断結果です。
 IPA「安全なウェブサイトの作り方」を参考に、Markdown形式の診断報告書としてまとめてください。
 
 条件:
@@ -150,39 +345,63 @@ IPA「安全なウェブサイトの作り方」を参考に、Markdown形式の
 
 【診断概要】
 対象: {st.session_state.get('selected_site','(all)')}
-日時: {datetime.now().strftime("%Y-%m-%d %H:%M")}
-
-【アラート概要】
-{_alerts_overview(alert_items)}
-
-【通信ログ（抜粋）】
-{_traffic_overview(hist_items)}
-
-【追加情報（AI要約/外部ツール）】
-{sel_ai}
-
-{blocks_md}
-
-{overall_md}
-
-出力構成:
+日時: {datetime.now().strftime("%Y-%m-%d %H:%M")}""",
+                ),
+                PromptSection("alerts", header="【アラート概要】", text=alerts_section, priority=100, min_tokens=400),
+                PromptSection(
+                    "traffic",
+                    header="【通信ログ（抜粋）】",
+                    items=_traffic_overview(hist_items).splitlines(),
+                    priority=20,
+                    min_tokens=80,
+                ),
+            ]
+            if sel_ai or blocks:
+                sections.append(PromptSection("extra", fixed=True, text="【追加情報（AI要約/外部ツール）】"))
+            sections.append(PromptSection("sel_ai", header="## 選択アラートAI要約", text=sel_ai, priority=60))
+            # 新しい素材ほど優先
+            for n, b in enumerate(blocks):
+                sections.append(
+                    PromptSection(f"block{n}", header=f"## {b.get('title','')}", text=b.get("md", ""), priority=40 + n)
+                )
+            sections.append(
+                PromptSection(
+                    "tail",
+                    fixed=True,
+                    text="""出力構成:
 1. 概要
 2. 検出された脆弱性（優先度つき）
 3. 通信ログから見える特徴
 4. 総合評価と対応優先度
-5. 推奨対応方針（短期/中期）
-"""
-                client = OllamaChatClient(st.session_state["ollama_base"])
-                model = st.session_state["ollama_model"]
-                temp = float(st.session_state.get("ollama_temp", 0.2))
+5. 推奨対応方針（短期/中期）""",
+                )
+            )
+            prompt = build_prompt(sections, prompt_budget, session_tokenizer())
+
+            client = OllamaChatClient(st.session_state["ollama_base"])
+            model = st.session_state["ollama_model"]
+            temp = float(st.session_state.get("ollama_temp", 0.2))
 
-                md = client.chat(
+            md = write_stream_transient(
+                client.chat_stream(
                     model=model,
                     messages=[{"role": "user", "content": prompt}],
                     temperature=temp,
                     system=DEFAULT_SYSTEM,
                 )
-                st.session_state["ai_report_md"] = md
+            )
+
+            if overall_future is not None:
+                try:
+                    with st.spinner("総合リスク評価（AI）の完了を待っています..."):
+                        overall_text = overall_future.result()
+                    _remember_overall_risk(overall_text, overall_key)
+                except Exception as e:
+                    st.warning(f"総合リスク評価の生成に失敗しました: {e}")
+            if overall_text:
+                md = md.rstrip() + "\n\n## 総合リスク評価（AI）\n\n" + overall_text
+
+            st.session_state["ai_report_md"] = md
 
     with col2:
         if st.button("🧹 レポート素材（AI要約）をクリア", use_container_width=True, key="clear_blocks"):
@@ -1,37 +1,56 @@
 # secdemo/ui_tables.py
 from __future__ import annotations
 
+import hashlib
+import io
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
 
 
-def _risk_rank(text: str) -> int:
-    s = (text or "").lower()
-    if "high" in s:
-        return 3
-    if "medium" in s:
-        return 2
-    if "low" in s:
-        return 1
-    if "info" in s:
-        return 0
-    return -1
-
-
-def _risk_label(text: str) -> str:
-    s = (text or "").lower()
-    if "high" in s:
-        return "High"
-    if "medium" in s:
-        return "Medium"
-    if "low" in s:
-        return "Low"
-    if "info" in s:
-        return "Info"
-    return "Other"
+# 判定の優先順（"High" を含めば High …）は従来の _risk_label/_risk_rank と同じ
+_RISK_LEVELS = (("high", "High", 3), ("medium", "Medium", 2), ("low", "Low", 1), ("info", "Info", 0))
+
+HISTORY_COLS = ["time", "method", "status", "url", "rtt", "len", "id"]
+ALERT_COLS = ["risk", "name", "count", "param", "url"]
+
+
+def _risk_columns(risk: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """risk 列から (label, rank) をベクトル演算でまとめて作る"""
+    s = risk.fillna("").astype(str).str.lower()
+    conds = [s.str.contains(key, regex=False) for key, _, _ in _RISK_LEVELS]
+    label = np.select(conds, [lbl for _, lbl, _ in _RISK_LEVELS], default="Other")
+    rank = np.select(conds, [r for _, _, r in _RISK_LEVELS], default=-1)
+    return pd.Series(label, index=risk.index), pd.Series(rank, index=risk.index)
+
+
+def items_version(items: List[Dict[str, Any]], keys: Tuple[str, ...]) -> str:
+    """
+    表データの版（DataFrame キャッシュのキー）。
+    表示に使う列だけをハッシュするので、DataFrame を作るより十分安い。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for it in items:
+        h.update("\x1f".join(str(it.get(k, "")) for k in keys).encode("utf-8", errors="ignore"))
+        h.update(b"\x1e")
+    return f"{len(items)}:{h.hexdigest()}"
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _history_frame(data_version: str, _hist_items: List[Dict[str, Any]]) -> pd.DataFrame:
+    return pd.DataFrame(_hist_items, columns=HISTORY_COLS)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _alerts_frame(data_version: str, _alert_groups: List[Dict[str, Any]]) -> pd.DataFrame:
+    df = pd.DataFrame(_alert_groups, columns=ALERT_COLS)
+    df["count"] = pd.to_numeric(df["count"], errors="coerce").fillna(1).astype(int)
+    df["risk_label"], df["__risk"] = _risk_columns(df["risk"])
+    df["__gid"] = np.arange(len(df))
+    return df.sort_values(["__risk", "count"], ascending=False)
 
 
 def _selected_rows_as_list(grid_resp: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -51,23 +70,67 @@ def _df_to_tsv(df: pd.DataFrame) -> str:
     return df.to_csv(sep="\t", index=False)
 
 
-def copy_block(title: str, df: pd.DataFrame, key_prefix: str, selected_df: Optional[pd.DataFrame] = None) -> None:
+def _write_delimited(df: pd.DataFrame, sep: str, chunk_rows: int = 5000) -> bytes:
+    """
+    大きい表はチャンクごとに整形し、UTF-8 にしてバイト列バッファへ足していく
+    （全行の文字列と、それをエンコードしたコピーを同時に持たない）。
+    download_button はファイル全体を受け取ってメディアファイルとして登録するので、最後は1つのバイト列にする。
+    """
+    buf = io.BytesIO()
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start : start + chunk_rows].to_csv(sep=sep, index=False, header=(start == 0))
+        buf.write(chunk.encode("utf-8"))
+    return buf.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _export_bytes(data_version: str, sep: str, _df: pd.DataFrame) -> bytes:
+    return _write_delimited(_df, sep)
+
+
+def _frame_version(df: pd.DataFrame) -> str:
+    h = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).values.tobytes(), digest_size=16)
+    h.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def copy_block(
+    title: str,
+    df: pd.DataFrame,
+    key_prefix: str,
+    selected_df: Optional[pd.DataFrame] = None,
+    data_version: Optional[str] = None,
+) -> None:
+    """
+    CSV/TSV/Copy 欄。書き出しはトグルONの間だけ行い、表の版（data_version）ごとにキャッシュする。
+    """
     if df is None or df.empty:
         return
 
+    export_on = st.toggle(
+        f"📤 {title} をエクスポート（CSV/TSV/Copy）",
+        key=f"{key_prefix}_export_on",
+        help="ONの間だけ書き出しを生成します（自動更新のたびに全件を書き出さない）",
+    )
+    if not export_on:
+        return
+
+    version = f"{key_prefix}:{data_version or _frame_version(df)}"
+
     c1, c2, c3, c4 = st.columns([1.0, 1.0, 1.0, 5.0], gap="small")
     with c1:
         st.download_button(
             "⬇ CSV",
-            data=df.to_csv(index=False).encode("utf-8"),
+            data=_export_bytes(version, ",", df),
             file_name=f"{key_prefix}.csv",
             mime="text/csv",
             use_container_width=True,
         )
+    tsv = _export_bytes(version, "\t", df)
     with c2:
         st.download_button(
             "⬇ TSV",
-            data=_df_to_tsv(df).encode("utf-8"),
+            data=tsv,
             file_name=f"{key_prefix}.tsv",
             mime="text/tab-separated-values",
             use_container_width=True,
@@ -77,7 +140,7 @@ def copy_block(title: str, df: pd.DataFrame, key_prefix: str, selected_df: Optio
             st.caption("全選択 → Ctrl+C（Excel貼り付けOK）")
             st.text_area(
                 f"{title} TSV",
-                value=_df_to_tsv(df),
+                value=tsv.decode("utf-8"),
                 height=240,
                 key=f"{key_prefix}_copy_all",
             )
@@ -95,20 +158,16 @@ def copy_block(title: str, df: pd.DataFrame, key_prefix: str, selected_df: Optio
             st.caption("※ 行を選択すると「選択だけCopy」が使えます")
 
 
-def render_history_table(hist_items: List[Dict[str, Any]]) -> None:
+def render_history_table(hist_items: List[Dict[str, Any]], data_version: Optional[str] = None) -> None:
     st.subheader("📜 履歴（Messages）")
-    df_hist = pd.DataFrame(hist_items)
 
-    if df_hist.empty:
+    if not hist_items:
         st.info("履歴が空です。ZAPプロキシ経由で通信が流れているか確認してください。")
         return
 
-    show_cols = ["time", "method", "status", "url", "rtt", "len", "id"]
-    for c in show_cols:
-        if c not in df_hist.columns:
-            df_hist[c] = ""
-
-    df_show = df_hist[show_cols].copy()
+    if data_version is None:
+        data_version = items_version(hist_items, ("id", "status", "url"))
+    df_show = _history_frame(data_version, hist_items)
 
     gb = GridOptionsBuilder.from_dataframe(df_show)
     gb.configure_default_column(resizable=True, sortable=True, filter=True)
@@ -139,15 +198,17 @@ def render_history_table(hist_items: List[Dict[str, Any]]) -> None:
         except Exception:
             selected_df = None
 
-    copy_block("History", df_show.drop(columns=["id"], errors="ignore"), "history", selected_df)
+    copy_block("History", df_show.drop(columns=["id"], errors="ignore"), "history", selected_df, data_version)
 
 
-def render_alerts_table(alert_items: List[Dict[str, Any]]) -> None:
+def render_alerts_table(alert_groups: List[Dict[str, Any]], data_version: Optional[str] = None) -> None:
+    """
+    alert_groups は secdemo.alerts.group_alerts の出力（1行 = 同一検出のグループ）
+    """
     st.subheader("🚨 アラート")
-    df_alert = pd.DataFrame(alert_items)
 
     # リスクカード
-    if df_alert.empty:
+    if not alert_groups:
         cH, cM, cL, cI = st.columns([1, 1, 1, 1], gap="small")
         cH.metric("High", "0")
         cM.metric("Med", "0")
@@ -156,8 +217,12 @@ def render_alerts_table(alert_items: List[Dict[str, Any]]) -> None:
         st.info("アラートがありません（または取得できません）。")
         return
 
-    df_alert["risk_label"] = df_alert["risk"].apply(_risk_label)
-    counts = df_alert["risk_label"].value_counts().to_dict()
+    if data_version is None:
+        data_version = items_version(alert_groups, ("risk", "name", "param", "count", "url"))
+    df_alert = _alerts_frame(data_version, alert_groups)
+
+    # カードはインスタンス数で数える
+    counts = df_alert.groupby("risk_label")["count"].sum().to_dict()
     cH, cM, cL, cI = st.columns([1, 1, 1, 1], gap="small")
     cH.metric("High", str(int(counts.get("High", 0))))
     cM.metric("Med", str(int(counts.get("Medium", 0))))
@@ -165,28 +230,23 @@ def render_alerts_table(alert_items: List[Dict[str, Any]]) -> None:
     cI.metric("Info", str(int(counts.get("Info", 0))))
 
     # 表
-    df_alert["__risk"] = df_alert["risk"].apply(_risk_rank)
-
-    show_cols = ["risk", "name", "url", "param", "__risk"]
-    for c in show_cols:
-        if c not in df_alert.columns:
-            df_alert[c] = ""
-
-    df_show = df_alert[show_cols].copy()
+    df_show = df_alert[ALERT_COLS + ["__risk", "__gid"]]
 
     gb = GridOptionsBuilder.from_dataframe(df_show)
     gb.configure_default_column(resizable=True, sortable=True, filter=True)
     gb.configure_grid_options(enableRangeSelection=True, enableCellTextSelection=True)
     gb.configure_column("risk", flex=1, min_width=110)
     gb.configure_column("name", flex=3, min_width=220)
+    gb.configure_column("count", flex=1, min_width=80)
     gb.configure_column("param", flex=1, min_width=120)
     gb.configure_column("url", flex=4, min_width=260)
     gb.configure_column("__risk", hide=True)
+    gb.configure_column("__gid", hide=True)
     gb.configure_selection(selection_mode="single", use_checkbox=False)
     gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=20)
 
     grid = AgGrid(
-        df_show.sort_values("__risk", ascending=False),
+        df_show,
         gridOptions=gb.build(),
         data_return_mode=DataReturnMode.FILTERED_AND_SORTED,
         update_mode=GridUpdateMode.SELECTION_CHANGED,
@@ -202,23 +262,13 @@ def render_alerts_table(alert_items: List[Dict[str, Any]]) -> None:
     selected_alert_df = None
     if sel:
         cand = sel[0]
-        st.session_state["selected_alert"] = cand  # 最低限はこれでOK（必要なら元データへ復元はui.py側で実施）
-
         try:
-            r = str(cand.get("risk", ""))
-            n = str(cand.get("name", ""))
-            u = str(cand.get("url", ""))
-            p = str(cand.get("param", ""))
-            selected_alert_df = (
-                df_show[
-                    (df_show["risk"].astype(str) == r)
-                    & (df_show["name"].astype(str) == n)
-                    & (df_show["url"].astype(str) == u)
-                    & (df_show["param"].astype(str) == p)
-                ]
-                .drop(columns=["__risk"], errors="ignore")
-            )
+            gid = int(cand.get("__gid"))
+            # グリッドの行ではなく、元のグループ（desc/solution/URLサンプル込み）を保持
+            st.session_state["selected_alert"] = alert_groups[gid]
+            selected_alert_df = df_show[df_show["__gid"] == gid].drop(columns=["__risk", "__gid"], errors="ignore")
         except Exception:
+            st.session_state["selected_alert"] = cand
             selected_alert_df = None
 
     sel_state = st.session_state.get("selected_alert")
@@ -227,4 +277,10 @@ def render_alerts_table(alert_items: List[Dict[str, Any]]) -> None:
     else:
         st.caption("Selected: (none)")
 
-    copy_block("Alerts", df_show.drop(columns=["__risk"], errors="ignore"), "alerts", selected_alert_df)
+    copy_block(
+        "Alerts",
+        df_show.drop(columns=["__risk", "__gid"], errors="ignore"),
+        "alerts",
+        selected_alert_df,
+        data_version,
+    )
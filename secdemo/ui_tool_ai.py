@@ -1,9 +1,19 @@
 # secdemo/ui_tool_ai.py
 from __future__ import annotations
 
+from typing import Iterator, Optional, Tuple
+
 import streamlit as st
 
 from secdemo.ai_ollama import OllamaChatClient, DEFAULT_SYSTEM
+from secdemo.prompt_budget import truncate_text
+from secdemo.tool_output import condense_output
+from secdemo.ui_ai import session_tokenizer, write_stream_transient
+
+# 実行結果に割くトークン数（ノイズ除去後も超える場合は分割要約してから渡す）
+TOOL_OUTPUT_TOKENS = 6000
+# 分割要約の1チャンクあたりのトークン数
+TOOL_CHUNK_TOKENS = 2000
 
 
 def _ensure_report_blocks() -> None:
@@ -15,13 +25,10 @@ def _push_report_block(title: str, content_md: str) -> None:
     st.session_state["report_blocks"].append({"title": title, "md": content_md})
 
 
-def summarize_tool_output(tool_name: str, output: str) -> str:
-    client = OllamaChatClient(st.session_state["ollama_base"])
-    model = st.session_state["ollama_model"]
-    temp = float(st.session_state.get("ollama_temp", 0.2))
-
-    prompt = f"""
-以下は {tool_name} の実行結果です。
+def _tool_summary_prompt(tool_name: str, output: str, summarized: bool = False) -> str:
+    source = "実行結果（長いため分割して要約したもの）" if summarized else "実行結果"
+    return f"""
+以下は {tool_name} の{source}です。
 この結果から次を要約してください。
 
 1) 検出された重要ポイント（箇条書き）
@@ -33,22 +40,119 @@ def summarize_tool_output(tool_name: str, output: str) -> str:
 - “可能性” と “前提条件” を明確に
 - 守る側の判断材料を重視
 
---- 実行結果 ---
-{output}
+--- {source} ---
+{truncate_text(output, TOOL_OUTPUT_TOKENS, session_tokenizer())}
 """
 
+
+def _tool_chunk_prompt(title: str, body: str) -> str:
+    return f"""
+以下は {title} の実行ログの一部です（進捗・バナー行は除去済み）。
+この部分から分かる事実だけを簡潔に抜き出してください。
+
+- 対象（ホスト/ポート/パラメータ）
+- 検出内容（脆弱性の可能性、開いているサービス、バージョン など）
+- 警告・エラー
+
+何も検出が無い部分なら「特記事項なし」とだけ書いてください。
+攻撃手順・PoC・悪用方法は書かないでください。
+
+--- ログ ---
+{body}
+"""
+
+
+def _tool_collapse_prompt(body: str) -> str:
+    return f"""
+以下はツール実行ログの部分要約です。重複をまとめ、対象・検出内容・警告を落とさずに短く統合してください。
+「特記事項なし」の部分は省いてください。攻撃手順・PoC・悪用方法は書かないでください。
+
+{body}
+"""
+
+
+def condense_tool_output(tool_name: str, output: str, on_done=None) -> Tuple[str, bool]:
+    """
+    ツール出力を最終プロンプトに収まる量へ縮める（ノイズ除去 → 必要ならチャンク並列要約）。
+    戻り値は (テキスト, 分割要約したか)。
+    """
+    client = OllamaChatClient(st.session_state["ollama_base"])
+    model = st.session_state["ollama_model"]
+    temp = float(st.session_state.get("ollama_temp", 0.2))
+
+    return condense_output(
+        client,
+        model,
+        tool_name,
+        output,
+        max_tokens=TOOL_OUTPUT_TOKENS,
+        make_prompt=_tool_chunk_prompt,
+        make_collapse_prompt=_tool_collapse_prompt,
+        chunk_tokens=TOOL_CHUNK_TOKENS,
+        temperature=temp,
+        system=DEFAULT_SYSTEM,
+        parallel=int(st.session_state.get("tool_ai_parallel", 2)),
+        on_done=on_done,
+        tokenizer=session_tokenizer(),
+    )
+
+
+def summarize_tool_output(tool_name: str, output: str) -> str:
+    client = OllamaChatClient(st.session_state["ollama_base"])
+    model = st.session_state["ollama_model"]
+    temp = float(st.session_state.get("ollama_temp", 0.2))
+
+    text, summarized = condense_tool_output(tool_name, output)
     return client.chat(
         model=model,
-        messages=[{"role": "user", "content": prompt}],
+        messages=[{"role": "user", "content": _tool_summary_prompt(tool_name, text, summarized)}],
         temperature=temp,
         system=DEFAULT_SYSTEM,
     )
 
 
+def stream_tool_output_summary(tool_name: str, output: str, summarized: Optional[bool] = None) -> Iterator[str]:
+    """
+    summarize_tool_output のストリーミング版。
+    summarized を渡した場合、output は condense_tool_output 済みとして扱う。
+    """
+    client = OllamaChatClient(st.session_state["ollama_base"])
+    model = st.session_state["ollama_model"]
+    temp = float(st.session_state.get("ollama_temp", 0.2))
+
+    if summarized is None:
+        output, summarized = condense_tool_output(tool_name, output)
+    yield from client.chat_stream(
+        model=model,
+        messages=[{"role": "user", "content": _tool_summary_prompt(tool_name, output, summarized)}],
+        temperature=temp,
+        system=DEFAULT_SYSTEM,
+    )
+
+
+def _summarize_with_progress(tool_name: str, output: str) -> str:
+    bar = st.progress(0.0, text=f"{tool_name}: ログを整理中...")
+    text, summarized = condense_tool_output(
+        tool_name,
+        output,
+        on_done=lambda done, total: bar.progress(done / total, text=f"{tool_name}: 分割要約 {done}/{total}"),
+    )
+    bar.empty()
+    return write_stream_transient(stream_tool_output_summary(tool_name, text, summarized))
+
+
 def render_tool_ai_summary() -> None:
     st.subheader("🤖 外部ツール結果のAI要約（レポート連携）")
 
     _ensure_report_blocks()
+    st.slider(
+        "分割要約の並列数",
+        1,
+        8,
+        2,
+        key="tool_ai_parallel",
+        help="出力が長い場合のみ使用（ノイズ除去後もプロンプトに入らないとき）",
+    )
 
     # --- sqlmap ---
     sql_out = st.session_state.get("sqlmap_output", "")
@@ -56,9 +160,8 @@ def render_tool_ai_summary() -> None:
         col1, col2 = st.columns([1, 1], gap="small")
         with col1:
             if st.button("🧠 sqlmap 結果をAI要約", use_container_width=True, key="ai_sqlmap"):
-                with st.spinner("AIが要約中..."):
-                    st.session_state["sqlmap_ai"] = summarize_tool_output("sqlmap", sql_out)
-                    _push_report_block("sqlmap AI要約", st.session_state["sqlmap_ai"])
+                st.session_state["sqlmap_ai"] = _summarize_with_progress("sqlmap", sql_out)
+                _push_report_block("sqlmap AI要約", st.session_state["sqlmap_ai"])
         with col2:
             st.caption("※ 要約は report_blocks に自動追加されます")
 
@@ -76,9 +179,13 @@ def render_tool_ai_summary() -> None:
         col1, col2 = st.columns([1, 1], gap="small")
         with col1:
             if st.button("🧠 nmap 結果をAI要約", use_container_width=True, key="ai_nmap"):
-                with st.spinner("AIが要約中..."):
-                    st.session_state["nmap_ai"] = summarize_tool_output("nmap", nmap_out)
-                    _push_report_block("nmap AI要約", st.session_state["nmap_ai"])
+                # -oX から作ったポート表があれば生ログの代わりに渡す（/24 などでもプロンプトが小さい）
+                nmap_table = st.session_state.get("nmap_table")
+                st.session_state["nmap_ai"] = _summarize_with_progress(
+                    "nmap（open ポート表）" if nmap_table else "nmap",
+                    nmap_table or nmap_out,
+                )
+                _push_report_block("nmap AI要約", st.session_state["nmap_ai"])
         with col2:
             st.caption("※ 要約は report_blocks に自動追加されます")
 
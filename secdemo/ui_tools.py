@@ -1,11 +1,17 @@
 # secdemo/ui_tools.py
 from __future__ import annotations
 
-import subprocess
-from typing import Optional, Tuple
+import os
+from datetime import datetime
+from typing import Callable, Optional
 
+import pandas as pd
 import streamlit as st
 
+from secdemo.nmap_xml import PORT_KEYS, format_port_table, parse_nmap_xml
+from secdemo.paths import data_dir
+from secdemo.tool_jobs import get_tool_job, start_tool_job
+
 
 def _host_from_url(url: str) -> str:
     url = (url or "").strip()
@@ -17,15 +23,67 @@ def _host_from_url(url: str) -> str:
     return url
 
 
-def _run(cmd: list[str], timeout_sec: int = 300) -> Tuple[str, str, int]:
-    p = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=timeout_sec,
-    )
-    out = (p.stdout or "") + ("\n" if p.stdout and p.stderr else "") + (p.stderr or "")
-    return out, " ".join(cmd), p.returncode
+# 外部ツールの実行上限（秒）
+TOOL_TIMEOUT_SEC = 300
+
+_STATUS_LABELS = {
+    "running": "⏳ 実行中",
+    "done": "✅ 完了",
+    "failed": "⚠ 異常終了",
+    "cancelled": "⏹ 中止",
+    "timeout": "⌛ タイムアウト",
+}
+
+
+def _start_tool(name: str, cmd: list[str]) -> None:
+    job = start_tool_job(cmd, timeout_sec=TOOL_TIMEOUT_SEC)
+    st.session_state[f"{name}_job_id"] = job.id
+    st.session_state[f"{name}_cmd"] = job.cmd_str
+
+
+def _tool_running(name: str) -> bool:
+    job = get_tool_job(st.session_state.get(f"{name}_job_id"))
+    return job is not None and not job.finished
+
+
+def _render_tool_job(name: str, on_finish: Optional[Callable[[], None]] = None) -> None:
+    """
+    実行中のジョブを1秒ごとにポーリングして末尾を表示（ページ全体は止めない）。
+    終わったら出力を session_state["{name}_output"] へ移し、全体を描き直す。
+    """
+    job = get_tool_job(st.session_state.get(f"{name}_job_id"))
+    if job is None:
+        if st.session_state.get(f"{name}_output"):
+            st.text_area(f"{name} output", st.session_state[f"{name}_output"], height=280)
+            st.caption(f"return code: {st.session_state.get(f'{name}_rc')}")
+        return
+
+    running = not job.finished
+
+    @st.fragment(run_every=1.0 if running else None)
+    def _poll() -> None:
+        status, tail, _ = job.snapshot(tail=200)
+        c1, c2 = st.columns([4, 1], gap="small")
+        with c1:
+            st.caption(f"{_STATUS_LABELS.get(status, status)}  {job.elapsed:.0f}s  —  {job.cmd_str}")
+        with c2:
+            if st.button("⏹ 中止", use_container_width=True, disabled=job.finished, key=f"{name}_cancel"):
+                job.cancel()
+        st.code(tail or "（出力待ち）", language=None)
+
+        if job.finished:
+            # 最終結果はログファイルの全量（リングバッファは実行中の表示用）
+            out, rc = job.output(), job.returncode
+            st.session_state[f"{name}_output"] = out
+            st.session_state[f"{name}_rc"] = rc
+            st.session_state[f"{name}_job_id"] = None
+            if on_finish is not None:
+                on_finish()
+            if running:
+                # ポーリングを止め、AI要約など他の欄にも結果を反映するため全体を描き直す
+                st.rerun()
+
+    _poll()
 
 
 def _ensure_tools_state() -> None:
@@ -60,20 +118,40 @@ def _sqlmap_cmd(url: str, param: Optional[str]) -> list[str]:
 # -------------------------
 # nmap（安全モード）
 # -------------------------
-def _nmap_cmd(target: str, top_ports: int = 100, version_detect: bool = True) -> list[str]:
+def _nmap_cmd(target: str, top_ports: int = 100, version_detect: bool = True, xml_path: Optional[str] = None) -> list[str]:
     cmd = ["nmap", "-sT", "-Pn", f"--top-ports={int(top_ports)}"]
     if version_detect:
         cmd += ["-sV"]
+    if xml_path:
+        # 機械可読の結果（AI要約にはこちらから作った表を渡す）
+        cmd += ["-oX", xml_path]
     cmd += [target]
     return cmd
 
 
+def _nmap_xml_path() -> str:
+    return os.path.join(data_dir("nmap"), f"nmap_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xml")
+
+
+def _load_nmap_xml() -> None:
+    """nmap 終了時に -oX の結果を読み、ポート表と LLM 用の簡潔な表を session_state に置く"""
+    path = st.session_state.get("nmap_xml_path")
+    st.session_state["nmap_ports"] = []
+    st.session_state["nmap_table"] = ""
+    if not path or not os.path.exists(path):
+        return
+    scan = parse_nmap_xml(path)
+    st.session_state["nmap_ports"] = scan["ports"]
+    st.session_state["nmap_table"] = format_port_table(scan)
+
+
 def render_tool_ui(selected_alert) -> None:
     """
     sqlmap / nmap を UI 内から実行。
     - 実行前に同意チェック必須（面接で強い）
     - コマンド表示（透明性）
     - 出力は session_state に保持（AI要約→レポート連携の素材）
+    - 実行はバックグラウンド（実行中もダッシュボードは更新され、sqlmap と nmap は同時に走らせられる）
     """
     _ensure_tools_state()
 
@@ -101,17 +179,11 @@ def render_tool_ui(selected_alert) -> None:
         cmd = _sqlmap_cmd(url, param if param else None)
         st.code("CMD: " + " ".join(cmd))
 
-        run_disabled = (not st.session_state["tool_allow_run"]) or (not url)
+        run_disabled = (not st.session_state["tool_allow_run"]) or (not url) or _tool_running("sqlmap")
         if st.button("▶ sqlmap 実行", use_container_width=True, disabled=run_disabled, key="run_sqlmap"):
-            with st.spinner("sqlmap 実行中..."):
-                out, cmd_str, rc = _run(cmd, timeout_sec=300)
-                st.session_state["sqlmap_output"] = out
-                st.session_state["sqlmap_cmd"] = cmd_str
-                st.session_state["sqlmap_rc"] = rc
+            _start_tool("sqlmap", cmd)
 
-        if st.session_state.get("sqlmap_output"):
-            st.text_area("sqlmap output", st.session_state["sqlmap_output"], height=280)
-            st.caption(f"return code: {st.session_state.get('sqlmap_rc')}")
+        _render_tool_job("sqlmap")
 
     # ---- nmap ----
     with st.expander("🛠 nmap（ポート・サービス検出）", expanded=False):
@@ -122,16 +194,17 @@ def render_tool_ui(selected_alert) -> None:
         version_detect = st.checkbox("サービス/バージョン検出（-sV）", value=True, key="nmap_sv")
 
         cmd = _nmap_cmd(target, top_ports=top_ports, version_detect=version_detect)
-        st.code("CMD: " + " ".join(cmd))
+        st.code("CMD: " + " ".join(cmd[:-1] + ["-oX", "<secdemo_data/nmap/*.xml>", cmd[-1]]))
 
-        run_disabled = (not st.session_state["tool_allow_run"]) or (not target)
+        run_disabled = (not st.session_state["tool_allow_run"]) or (not target) or _tool_running("nmap")
         if st.button("▶ nmap 実行", use_container_width=True, disabled=run_disabled, key="run_nmap"):
-            with st.spinner("nmap 実行中..."):
-                out, cmd_str, rc = _run(cmd, timeout_sec=300)
-                st.session_state["nmap_output"] = out
-                st.session_state["nmap_cmd"] = cmd_str
-                st.session_state["nmap_rc"] = rc
-
-        if st.session_state.get("nmap_output"):
-            st.text_area("nmap output", st.session_state["nmap_output"], height=280)
-            st.caption(f"return code: {st.session_state.get('nmap_rc')}")
+            xml_path = _nmap_xml_path()
+            st.session_state["nmap_xml_path"] = xml_path
+            _start_tool("nmap", _nmap_cmd(target, top_ports=top_ports, version_detect=version_detect, xml_path=xml_path))
+
+        _render_tool_job("nmap", on_finish=_load_nmap_xml)
+
+        ports = [r for r in st.session_state.get("nmap_ports") or [] if r.get("state") == "open"]
+        if ports:
+            st.markdown("**open ports（-oX から）**")
+            st.dataframe(pd.DataFrame(ports, columns=list(PORT_KEYS)), hide_index=True, use_container_width=True)
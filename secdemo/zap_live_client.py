@@ -1,13 +1,102 @@
 # secdemo/zap_live_client.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import httpx
 
+from secdemo.alerts import from_zap_alert
+
+# -----------------------------
+# Shared connection pool（プロセス内で使い回す）
+# -----------------------------
+# Streamlit は rerun のたびにスクリプトを先頭から実行するため、
+# (zap_base, apikey) ごとに httpx.Client を1つだけ作り、keep-alive で再利用する。
+_CLIENTS: Dict[Tuple[str, str], httpx.Client] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _shared_client(
+    zap_base: str,
+    apikey: str,
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+) -> httpx.Client:
+    key = (zap_base, apikey)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None or client.is_closed:
+            client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive,
+                    keepalive_expiry=keepalive_expiry,
+                ),
+            )
+            _CLIENTS[key] = client
+        return client
+
+
+def close_shared_clients() -> None:
+    """プール済みの接続をすべて閉じる（設定変更時・終了時用）"""
+    with _CLIENTS_LOCK:
+        for client in _CLIENTS.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _CLIENTS.clear()
+
+
+# -----------------------------
+# Parallel fetch（独立したAPI呼び出しを同時に投げる）
+# -----------------------------
+_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="zap-fetch")
+
+
+def fetch_parallel(
+    calls: Dict[str, Callable[[], Any]],
+    deadline: float,
+) -> Dict[str, Tuple[Any, Optional[BaseException]]]:
+    """
+    calls を並列実行し、全体の締め切り deadline 秒で打ち切る。
+    戻り値は name -> (result, error)。締め切りに間に合わなかったものは TimeoutError。
+    """
+    futures = {name: _FETCH_POOL.submit(fn) for name, fn in calls.items()}
+    wait(list(futures.values()), timeout=deadline)
+
+    out: Dict[str, Tuple[Any, Optional[BaseException]]] = {}
+    for name, fut in futures.items():
+        if not fut.done():
+            fut.cancel()
+            out[name] = (None, TimeoutError(f"ZAP {name}: deadline {deadline:g}s exceeded"))
+            continue
+        err = fut.exception()
+        out[name] = (None, err) if err is not None else (fut.result(), None)
+    return out
+
+
 class ZapLiveClient:
-    def __init__(self, zap_base: str, apikey: str = "", timeout: float = 15.0):
+    def __init__(
+        self,
+        zap_base: str,
+        apikey: str = "",
+        timeout: float = 15.0,
+        max_connections: int = 10,
+        max_keepalive: int = 5,
+        keepalive_expiry: float = 30.0,
+    ):
         self.zap_base = (zap_base or "").rstrip("/")
         self.apikey = apikey or ""
         self.timeout = timeout
+        self._client = _shared_client(
+            self.zap_base,
+            self.apikey,
+            max_connections=max_connections,
+            max_keepalive=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
 
     def _get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         if not self.zap_base:
@@ -18,10 +107,9 @@ class ZapLiveClient:
             params["apikey"] = self.apikey
 
         url = f"{self.zap_base}{path}"
-        with httpx.Client(timeout=self.timeout) as client:
-            r = client.get(url, params=params)
-            r.raise_for_status()
-            return r.json()
+        r = self._client.get(url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
 
     def version(self) -> str:
         data = self._get_json("/JSON/core/view/version/")
@@ -38,9 +126,64 @@ class ZapLiveClient:
         data = self._get_json("/JSON/core/view/messages/", params=params)
         return data.get("messages", []) or []
 
+    def message(self, msgid: Any) -> Optional[Dict[str, Any]]:
+        """
+        1件分のメッセージ（ヘッダ/ボディ込み）を取得。
+        core/view/message が使えない環境では messagesById にフォールバック。
+        """
+        try:
+            data = self._get_json("/JSON/core/view/message/", params={"id": msgid})
+            if isinstance(data.get("message"), dict):
+                return data["message"]
+            if any(k in data for k in ["requestHeader", "responseHeader", "requestBody", "responseBody"]):
+                return data
+        except Exception:
+            pass
+
+        try:
+            data = self._get_json("/JSON/core/view/messagesById/", params={"ids": msgid})
+            msgs = data.get("messages", [])
+            if isinstance(msgs, list) and msgs and isinstance(msgs[0], dict):
+                return msgs[0]
+        except Exception:
+            pass
+
+        return None
+
+    def number_of_messages(self, baseurl: Optional[str] = None) -> int:
+        params: Dict[str, Any] = {}
+        if baseurl:
+            params["baseurl"] = baseurl
+        data = self._get_json("/JSON/core/view/numberOfMessages/", params=params)
+        try:
+            return int(data.get("numberOfMessages", 0))
+        except Exception:
+            return 0
+
     def alerts(self, baseurl: Optional[str] = None, start: int = 0, count: int = 500) -> List[Dict[str, Any]]:
         params: Dict[str, Any] = {"start": start, "count": count}
         if baseurl:
             params["baseurl"] = baseurl
         data = self._get_json("/JSON/core/view/alerts/", params=params)
         return data.get("alerts", []) or []
+
+    def iter_alerts(self, baseurl: Optional[str] = None, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        start/count でページングしながら、正規化済みアラートを1件ずつ返す（件数上限なし）
+        ページは1件重ねて取得し、アラート id で重複排除する（start の基数差を吸収。history_sync と同じ）
+        """
+        seen: set = set()
+        start = 0
+        while True:
+            count = page_size + 1
+            page = self.alerts(baseurl=baseurl, start=start, count=count)
+            for a in page:
+                aid = a.get("id")
+                if aid not in (None, ""):
+                    if aid in seen:
+                        continue
+                    seen.add(aid)
+                yield from_zap_alert(a)
+            if len(page) < count:
+                return
+            start += count - 1
@@ -0,0 +1,40 @@
+import pytest
+
+from secdemo.gomi.payload_positions import RequestTemplate, iter_attack
+
+
+def _raw(nl: str) -> str:
+    # Content-Length が最後のヘッダではない（よくある並び）
+    return nl.join([
+        "POST /login HTTP/1.1",
+        "Host: example.test",
+        "Content-Length: 7",
+        "Content-Type: application/x-www-form-urlencoded",
+        "Cookie: s=1",
+        "",
+        "user=ab",
+    ])
+
+
+def _content_length(req: str) -> int:
+    head = req.split("\r\n\r\n", 1)[0] if "\r\n\r\n" in req else req.split("\n\n", 1)[0]
+    for line in head.splitlines():
+        k, _, v = line.partition(":")
+        if k.strip().lower() == "content-length":
+            return int(v.strip())
+    raise AssertionError("Content-Length がありません")
+
+
+def _body(req: str) -> str:
+    return req.split("\r\n\r\n", 1)[1] if "\r\n\r\n" in req else req.split("\n\n", 1)[1]
+
+
+@pytest.mark.parametrize("nl", ["\n", "\r\n"])
+@pytest.mark.parametrize("raw_of", [
+    _raw,
+    lambda nl: _raw(nl).replace("user=ab", "user=§ab§"),
+])
+def test_content_length_follows_payload(nl, raw_of):
+    tpl = RequestTemplate.from_raw(raw_of(nl), ["user"])
+    for _, _, req in iter_attack(tpl, "sniper", [["x", "y" * 24]]):
+        assert _content_length(req) == len(_body(req).encode("utf-8"))
@@ -23,6 +23,7 @@ def normalize_alert(a: Dict[str, Any]) -> Dict[str, Any]:
     risk = _pick(a, "risk", "riskdesc", "riskDescription", default="Unknown")
     confidence = _pick(a, "confidence", "conf", default="")
     cweid = _pick(a, "cweid", "cweId", default="")
+    pluginid = _pick(a, "pluginId", "pluginid", default="")
     wascid = _pick(a, "wascid", "wascId", default="")
     desc = _pick(a, "desc", "description", default="")
     solution = _pick(a, "solution", default="")
@@ -47,6 +48,7 @@ def normalize_alert(a: Dict[str, Any]) -> Dict[str, Any]:
         "risk_level": str(risk),
         "confidence": str(confidence),
         "cweid": str(cweid),
+        "pluginid": str(pluginid),
         "wascid": str(wascid),
         "uri": str(uri),
         "method": str(method),
@@ -59,6 +61,25 @@ def normalize_alert(a: Dict[str, Any]) -> Dict[str, Any]:
         "raw": a,
     }
 
+def group_alerts(alerts: List[Dict[str, Any]], uri_samples: int = 5) -> List[Dict[str, Any]]:
+    """
+    (pluginid/alert_name, risk_level, param) で1パスに畳み込む。
+    代表インスタンスに count（件数）と uris（URIサンプル）を付けて返す。
+    """
+    index: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for a in alerts:
+        key = (a["pluginid"] or a["alert_name"], a["risk_level"], a["param"])
+        g = index.get(key)
+        if g is None:
+            g = dict(a)
+            g["count"] = 0
+            g["uris"] = []
+            index[key] = g
+        g["count"] += 1
+        if a["uri"] and len(g["uris"]) < uri_samples and a["uri"] not in g["uris"]:
+            g["uris"].append(a["uri"])
+    return list(index.values())
+
 def load_zap_alerts(json_path: Path) -> List[Dict[str, Any]]:
     data = json.loads(json_path.read_text(encoding="utf-8", errors="replace"))
 
@@ -91,6 +112,7 @@ def main():
     ap.add_argument("--in", dest="inp", required=True, help="ZAP alerts json path")
     ap.add_argument("--min_risk", default="High", help="High or Medium ...")
     ap.add_argument("--out", dest="outp", required=True, help="Output normalized json")
+    ap.add_argument("--no_group", action="store_true", help="Do not collapse per-URL instances into groups")
     args = ap.parse_args()
 
     in_path = Path(args.inp)
@@ -102,19 +124,25 @@ def main():
 
     min_int = _risk_to_int(args.min_risk)
     filtered = [x for x in norm if _risk_to_int(x["risk_level"]) >= min_int]
+    count_instances = len(filtered)
+
+    # 同一検出（URL違いのインスタンス）を1件にまとめる
+    if not args.no_group:
+        filtered = group_alerts(filtered)
 
-    # ざっくり見やすい順にソート（risk desc → alert名）
-    filtered.sort(key=lambda x: (-_risk_to_int(x["risk_level"]), x["alert_name"]))
+    # ざっくり見やすい順にソート（risk desc → 件数 desc → alert名）
+    filtered.sort(key=lambda x: (-_risk_to_int(x["risk_level"]), -x.get("count", 1), x["alert_name"]))
 
     out_obj = {
         "source": str(in_path),
         "count_total": len(norm),
         "count_filtered": len(filtered),
+        "count_instances": count_instances,
         "min_risk": args.min_risk,
         "alerts": filtered,
     }
     out_path.write_text(json.dumps(out_obj, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"OK: total={len(norm)} filtered={len(filtered)} -> {out_path}")
+    print(f"OK: total={len(norm)} filtered={len(filtered)} instances={count_instances} -> {out_path}")
 
 if __name__ == "__main__":
     main()
@@ -23,6 +23,11 @@ def format_alert_block(a: Dict[str, Any]) -> str:
     parts.append(f"uri: {a.get('uri','')}")
     parts.append(f"method: {a.get('method','')}")
     parts.append(f"param: {a.get('param','')}")
+    if a.get("count"):
+        parts.append(f"instances: {a.get('count')}")
+    uris = a.get("uris") or []
+    if len(uris) > 1:
+        parts.append("other_uris:\n" + "\n".join(f"- {u}" for u in uris[1:]))
 
     desc = (a.get("desc") or "").strip()
     if desc: